@@ -0,0 +1,83 @@
+"""
+Compare :class:`sirbot.plugins.slack.templates.Template` rendering against building
+the message dictionary and serializing it with :func:`json.dumps`.
+
+.. code-block:: console
+
+    $ python benchmarks/templates.py
+"""
+import json
+import timeit
+
+from sirbot.plugins.slack.templates import Template
+
+SECTIONS = 20
+
+
+def build(channel, title, user, status):
+    blocks = [
+        {"type": "header", "text": {"type": "plain_text", "text": title}},
+        {
+            "type": "section",
+            "text": {"type": "mrkdwn", "text": f"Reported by <@{user}>"},
+        },
+    ]
+    for i in range(SECTIONS):
+        blocks.append(
+            {
+                "type": "section",
+                "fields": [
+                    {"type": "mrkdwn", "text": f"*Service {i}*"},
+                    {"type": "mrkdwn", "text": "Operational"},
+                ],
+            }
+        )
+    blocks.append({"type": "context", "elements": [{"type": "mrkdwn", "text": status}]})
+    return json.dumps({"channel": channel, "blocks": blocks})
+
+
+TEMPLATE = Template(
+    {
+        "channel": "{channel}",
+        "blocks": [
+            {"type": "header", "text": {"type": "plain_text", "text": "{title}"}},
+            {
+                "type": "section",
+                "text": {"type": "mrkdwn", "text": "Reported by <@{user}>"},
+            },
+            *(
+                {
+                    "type": "section",
+                    "fields": [
+                        {"type": "mrkdwn", "text": f"*Service {i}*"},
+                        {"type": "mrkdwn", "text": "Operational"},
+                    ],
+                }
+                for i in range(SECTIONS)
+            ),
+            {"type": "context", "elements": [{"type": "mrkdwn", "text": "{status}"}]},
+        ],
+    }
+)
+
+VALUES = {
+    "channel": "C00000A00",
+    "title": "Daily status",
+    "user": "U000AA000",
+    "status": "All systems operational",
+}
+
+
+def main(number=20000):
+    assert json.loads(build(**VALUES)) == json.loads(TEMPLATE.render(**VALUES))
+
+    baseline = timeit.timeit(lambda: build(**VALUES), number=number)
+    template = timeit.timeit(lambda: TEMPLATE.render(**VALUES), number=number)
+
+    print(f"dict + json.dumps: {baseline / number * 1e6:.2f} us/message")
+    print(f"Template.render:   {template / number * 1e6:.2f} us/message")
+    print(f"speedup:           {baseline / template:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -9,18 +9,24 @@ LOG = logging.getLogger(__name__)
 
 
 class SirBot(aiohttp.web.Application):
-    def __init__(self, user_agent=None, **kwargs):
+    def __init__(self, user_agent=None, recorder=None, **kwargs):
         super().__init__(**kwargs)
 
         self.router.add_route("GET", "/sirbot/plugins", endpoints.plugins)
+        self.router.add_route("GET", "/sirbot/metrics", endpoints.metrics)
 
         self["plugins"] = dict()
         self["http_session"] = aiohttp.ClientSession(
             loop=kwargs.get("loop") or asyncio.get_event_loop()
         )
         self["user_agent"] = user_agent or "sir-bot-a-lot"
+        self["recorder"] = recorder
 
-        self.on_shutdown.append(self.stop)
+        if recorder:
+            recorder.load(self)
+
+        # Closed once every plugin shutdown hook, which may call APIs, has run
+        self.on_cleanup.append(self.stop)
 
     def start(self, **kwargs):
         LOG.info("Starting SirBot")
@@ -45,3 +51,7 @@ class SirBot(aiohttp.web.Application):
     @property
     def user_agent(self):
         return self["user_agent"]
+
+    @property
+    def recorder(self):
+        return self["recorder"]
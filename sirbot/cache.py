@@ -0,0 +1,147 @@
+import time
+import asyncio
+import functools
+from collections import OrderedDict
+
+from aiohttp.web import Response
+
+
+class ResultCache:
+    """
+    TTL and LRU cache of coroutine results with single-flight execution.
+
+    Concurrent calls for a key that is not cached share a single execution.
+    Exceptions are not cached. :class:`aiohttp.web.Response` results are stored
+    frozen and rebuilt for every caller, as a response can only be sent once.
+
+    Args:
+        ttl: Time to live of the results in seconds.
+        max_size: Maximum number of cached results.
+        metrics: Instance of :class:`collections.Counter`.
+
+    **Variables**:
+        * **hits**: Number of calls answered from the cache.
+        * **misses**: Number of executions.
+        * **coalesced**: Number of calls that joined a running execution.
+    """
+
+    def __init__(self, ttl=60, max_size=1024, metrics=None):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.metrics = metrics
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+        self._results = OrderedDict()
+        self._running = {}
+
+    def __len__(self):
+        return len(self._results)
+
+    async def call(self, key, coroutine, *args, **kwargs):
+        """
+        Return the cached result for ``key`` or call ``coroutine``.
+        """
+        cached = self._results.get(key)
+        if cached is not None:
+            expires, result = cached
+            if expires > time.monotonic():
+                self._results.move_to_end(key)
+                self._count("hits", "cache_hit")
+                return _thaw(result)
+            del self._results[key]
+
+        if key in self._running:
+            self._count("coalesced", "cache_coalesced")
+            return _thaw(await asyncio.shield(self._running[key]))
+
+        self._count("misses", "cache_miss")
+        future = asyncio.ensure_future(self._execute(key, coroutine, *args, **kwargs))
+        self._running[key] = future
+        return _thaw(await asyncio.shield(future))
+
+    def invalidate(self, key=None):
+        """
+        Drop the cached result of ``key``, or of every key.
+        """
+        if key is None:
+            self._results.clear()
+        else:
+            self._results.pop(key, None)
+
+    async def _execute(self, key, coroutine, *args, **kwargs):
+        try:
+            result = _freeze(await coroutine(*args, **kwargs))
+            self._results[key] = (time.monotonic() + self.ttl, result)
+            self._results.move_to_end(key)
+            while len(self._results) > self.max_size:
+                self._results.popitem(last=False)
+            return result
+        finally:
+            del self._running[key]
+
+    def _count(self, attribute, metric):
+        setattr(self, attribute, getattr(self, attribute) + 1)
+        if self.metrics is not None:
+            self.metrics[metric] += 1
+
+
+def cached(ttl=60, max_size=1024, key=None, metrics=None):
+    """
+    Decorator caching the results of a coroutine function in a :class:`ResultCache`.
+
+    .. code-block:: python
+
+        @cached(ttl=300, key=lambda pep: pep)
+        async def fetch_pep(pep):
+            ...
+
+    Args:
+        ttl: Time to live of the results in seconds.
+        max_size: Maximum number of cached results.
+        key: Function called with the arguments and returning the cache key
+             (defaults to the arguments).
+        metrics: Instance of :class:`collections.Counter`.
+    """
+
+    def decorator(coroutine):
+        cache = ResultCache(ttl, max_size, metrics=metrics)
+
+        @functools.wraps(coroutine)
+        async def wrapper(*args, **kwargs):
+            if key:
+                cache_key = key(*args, **kwargs)
+            else:
+                cache_key = (args, tuple(sorted(kwargs.items())))
+            return await cache.call(cache_key, coroutine, *args, **kwargs)
+
+        wrapper.cache = cache
+        return wrapper
+
+    return decorator
+
+
+class _FrozenResponse:
+    def __init__(self, response):
+        self.status = response.status
+        self.reason = response.reason
+        self.body = response.body
+        self.headers = response.headers.copy()
+
+    def thaw(self):
+        return Response(
+            status=self.status, reason=self.reason, body=self.body, headers=self.headers
+        )
+
+
+def _freeze(result):
+    if isinstance(result, Response):
+        return _FrozenResponse(result)
+    return result
+
+
+def _thaw(result):
+    if isinstance(result, _FrozenResponse):
+        return result.thaw()
+    return result
@@ -0,0 +1,161 @@
+import heapq
+import asyncio
+import logging
+import functools
+import itertools
+from collections import deque
+
+LOG = logging.getLogger(__name__)
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+
+class ConcurrencyLimiter:
+    """
+    Limit the number of concurrent executions of coroutines.
+
+    Executions over the limit wait, in order, for a running one to finish. When
+    ``queue_size`` executions are already waiting new ones are rejected with
+    :class:`asyncio.QueueFull`.
+
+    Args:
+        max_concurrency: Maximum number of concurrent executions.
+        queue_size: Maximum number of waiting executions (``None`` for unbounded).
+
+    **Variables**:
+        * **running**: Number of running executions.
+        * **rejected**: Number of rejected executions.
+    """
+
+    def __init__(self, max_concurrency, queue_size=None):
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1")
+
+        self.max_concurrency = max_concurrency
+        self.queue_size = queue_size
+        self.running = 0
+        self.rejected = 0
+        self._waiters = deque()
+
+    @property
+    def waiting(self):
+        return len(self._waiters)
+
+    async def run(self, coroutine, *args, **kwargs):
+        """
+        Call ``coroutine`` once a slot is available.
+        """
+        await self.acquire()
+        try:
+            return await coroutine(*args, **kwargs)
+        finally:
+            self.release()
+
+    async def acquire(self, priority=PRIORITY_NORMAL):
+        if self.running < self.max_concurrency and not self._waiters:
+            self.running += 1
+            return
+
+        if self.queue_size is not None and len(self._waiters) >= self.queue_size:
+            self.rejected += 1
+            raise asyncio.QueueFull()
+
+        waiter = asyncio.get_event_loop().create_future()
+        self._push(waiter, priority)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.cancelled():
+                self._remove(waiter)
+            else:
+                # The slot was handed over before the cancellation.
+                self.release()
+            raise
+
+    def release(self):
+        while self._waiters:
+            waiter = self._pop()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.running -= 1
+
+    def _push(self, waiter, priority):
+        self._waiters.append(waiter)
+
+    def _pop(self):
+        return self._waiters.popleft()
+
+    def _remove(self, waiter):
+        # A release may already have popped the cancelled waiter
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+
+
+class PriorityScheduler(ConcurrencyLimiter):
+    """
+    :class:`ConcurrencyLimiter` starting waiting executions by priority.
+
+    Lower priority values run first (see ``PRIORITY_HIGH``, ``PRIORITY_NORMAL`` and
+    ``PRIORITY_LOW``), executions of the same priority run in order.
+
+    Args:
+        max_concurrency: Maximum number of concurrent executions.
+        queue_size: Maximum number of waiting executions (``None`` for unbounded).
+    """
+
+    def __init__(self, max_concurrency, queue_size=None):
+        super().__init__(max_concurrency, queue_size)
+        self._waiters = []
+        self._counter = itertools.count()
+
+    async def run(self, coroutine, *args, priority=PRIORITY_NORMAL, **kwargs):
+        """
+        Call ``coroutine`` once a slot is available for ``priority``.
+        """
+        await self.acquire(priority)
+        try:
+            return await coroutine(*args, **kwargs)
+        finally:
+            self.release()
+
+    def _push(self, waiter, priority):
+        heapq.heappush(self._waiters, (priority, next(self._counter), waiter))
+
+    def _pop(self):
+        return heapq.heappop(self._waiters)[2]
+
+    def _remove(self, waiter):
+        self._waiters = [entry for entry in self._waiters if entry[2] is not waiter]
+        heapq.heapify(self._waiters)
+
+
+def limit(handler, max_concurrency, queue_size=None, metrics=None):
+    """
+    Wrap a coroutine handler in a :class:`ConcurrencyLimiter`.
+
+    Rejected calls are logged, counted in ``metrics["handler_rejected"]`` and return ``None``.
+
+    Args:
+        handler: Coroutine function.
+        max_concurrency: Maximum number of concurrent executions.
+        queue_size: Maximum number of waiting executions (``None`` for unbounded).
+        metrics: Instance of :class:`collections.Counter`.
+    """
+    limiter = ConcurrencyLimiter(max_concurrency, queue_size)
+
+    @functools.wraps(handler)
+    async def limited(*args, **kwargs):
+        try:
+            return await limiter.run(handler, *args, **kwargs)
+        except asyncio.QueueFull:
+            LOG.warning("Handler %s queue is full, dropping call", handler)
+            if metrics is not None:
+                metrics["handler_rejected"] += 1
+
+    limited.limiter = limiter
+    return limited
@@ -4,3 +4,12 @@ from aiohttp.web import json_response
 async def plugins(request):
     data = [k for k in request.app["plugins"].keys()]
     return json_response({"plugins": data})
+
+
+async def metrics(request):
+    data = {
+        name: dict(plugin.metrics)
+        for name, plugin in request.app["plugins"].items()
+        if hasattr(plugin, "metrics")
+    }
+    return json_response(data)
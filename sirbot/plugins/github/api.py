@@ -0,0 +1,83 @@
+import copy
+import hashlib
+
+from gidgethub import aiohttp
+
+from .scheduler import INTERACTIVE
+
+
+class GitHubAPI(aiohttp.GitHubAPI):
+    """
+    :class:`gidgethub.aiohttp.GitHubAPI` recording request metrics and scheduling
+    the requests according to the rate limit.
+
+    Args:
+        metrics: Instance of :class:`collections.Counter`.
+        scheduler: Instance of
+                   :class:`sirbot.plugins.github.scheduler.RateLimitScheduler`.
+        priority: ``INTERACTIVE`` or ``BULK`` scheduling priority.
+        rate_limit_key: Key of the client quota in the scheduler, defaults to a hash
+                        of the token. Requests authenticated as a GitHub App share
+                        the ``app`` quota.
+    """
+
+    def __init__(
+        self,
+        *args,
+        metrics=None,
+        scheduler=None,
+        priority=INTERACTIVE,
+        rate_limit_key=None,
+        **kwargs
+    ):
+        super().__init__(*args, **kwargs)
+        self.metrics = metrics
+        self.scheduler = scheduler
+        self.priority = priority
+        self.rate_limit_key = rate_limit_key
+
+    def with_priority(self, priority):
+        """
+        Copy of the client sending its requests with another scheduling priority.
+
+        .. code-block:: python
+
+            bulk = github.api.with_priority(BULK)
+        """
+        api = copy.copy(self)
+        api.priority = priority
+        return api
+
+    async def _request(self, method, url, headers, body=b""):
+        if self.scheduler is None:
+            return await self._send(method, url, headers, body)
+
+        key = self._rate_limit_key(headers)
+        for attempt in range(self.scheduler.max_retries + 1):
+            await self.scheduler.acquire(key, self.priority)
+            status, response_headers, data = await self._send(
+                method, url, headers, body
+            )
+            retry_after = self.scheduler.update(key, status, response_headers)
+            if retry_after is None or retry_after > self.scheduler.max_wait:
+                break
+        return status, response_headers, data
+
+    def _rate_limit_key(self, headers):
+        authorization = headers.get("authorization", "")
+        if authorization.lower().startswith("bearer "):
+            # App JWTs are minted every few minutes but share the app quota
+            return "app"
+        elif self.rate_limit_key is not None:
+            return self.rate_limit_key
+        return hashlib.sha256(authorization.encode("utf-8")).hexdigest()[:16]
+
+    async def _send(self, method, url, headers, body):
+        status, response_headers, data = await super()._request(
+            method, url, headers, body
+        )
+        if self.metrics is not None:
+            self.metrics["github_requests"] += 1
+            if status == 304:
+                self.metrics["github_cache_304"] += 1
+        return status, response_headers, data
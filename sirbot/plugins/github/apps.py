@@ -0,0 +1,119 @@
+import time
+import asyncio
+import logging
+import datetime
+
+LOG = logging.getLogger(__name__)
+
+ACCEPT = "application/vnd.github.machine-man-preview+json"
+
+
+class InstallationTokens:
+    """
+    Mint and cache the access tokens of a GitHub App installations.
+
+    Tokens are refreshed in the background once they expire in less than
+    ``refresh_margin`` seconds, callers keep using the current token meanwhile.
+    Concurrent requests for a missing token share a single round trip.
+
+    Requires `PyJWT <https://pyjwt.readthedocs.io>`_ with the ``crypto`` extra.
+
+    Args:
+        api: Instance of :class:`gidgethub.abc.GitHubAPI` used to request tokens.
+        app_id: GitHub App id.
+        private_key: GitHub App private key (PEM).
+        refresh_margin: Time in seconds before expiry a token is refreshed.
+        metrics: Instance of :class:`collections.Counter`.
+    """
+
+    def __init__(self, api, app_id, private_key, refresh_margin=300, metrics=None):
+        self.api = api
+        self.app_id = app_id
+        self.private_key = private_key
+        self.refresh_margin = refresh_margin
+        self.metrics = metrics
+
+        self._jwt = None
+        self._tokens = {}
+        self._requests = {}
+
+    def __len__(self):
+        return len(self._tokens)
+
+    def app_jwt(self):
+        """
+        JSON Web Token authenticating as the GitHub App.
+        """
+        now = int(time.time())
+        if self._jwt is None or self._jwt[0] < now + 60:
+            try:
+                import jwt
+            except ImportError as e:
+                raise RuntimeError("GitHub App authentication requires PyJWT") from e
+
+            expires = now + 600
+            token = jwt.encode(
+                {"iat": now - 60, "exp": expires, "iss": self.app_id},
+                self.private_key,
+                algorithm="RS256",
+            )
+            if isinstance(token, bytes):
+                token = token.decode("ascii")
+            self._jwt = (expires, token)
+        return self._jwt[1]
+
+    async def token(self, installation_id):
+        """
+        Access token of an installation.
+        """
+        cached = self._tokens.get(installation_id)
+        now = time.time()
+        if cached is not None and cached[0] > now:
+            self._count("github_app_token_cached")
+            if cached[0] - now < self.refresh_margin:
+                self._refresh(installation_id)
+            return cached[1]
+
+        return await asyncio.shield(self._refresh(installation_id))
+
+    def invalidate(self, installation_id):
+        """
+        Drop the token of an installation, e.g. after it was revoked.
+        """
+        self._tokens.pop(installation_id, None)
+
+    def _refresh(self, installation_id):
+        if installation_id not in self._requests:
+            request = asyncio.ensure_future(self._request(installation_id))
+            self._requests[installation_id] = request
+            request.add_done_callback(self._log_failure)
+        return self._requests[installation_id]
+
+    async def _request(self, installation_id):
+        try:
+            data = await self.api.post(
+                "/app/installations/{installation_id}/access_tokens",
+                {"installation_id": str(installation_id)},
+                data=b"",
+                accept=ACCEPT,
+                jwt=self.app_jwt(),
+            )
+            self._count("github_app_token_minted")
+            expires = datetime.datetime.strptime(
+                data["expires_at"], "%Y-%m-%dT%H:%M:%SZ"
+            ).replace(tzinfo=datetime.timezone.utc)
+            self._tokens[installation_id] = (expires.timestamp(), data["token"])
+            return data["token"]
+        finally:
+            del self._requests[installation_id]
+
+    def _log_failure(self, request):
+        if not request.cancelled() and request.exception():
+            self._count("github_app_token_failed")
+            LOG.error(
+                "Failed to refresh github installation token: %s", request.exception()
+            )
+
+    def _count(self, metric):
+        if self.metrics is not None:
+            self.metrics[metric] += 1
@@ -0,0 +1,157 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from collections.abc import MutableMapping
+
+LOG = logging.getLogger(__name__)
+
+
+class ETagCache(MutableMapping):
+    """
+    Size bounded LRU cache of github responses used by
+    :class:`gidgethub.abc.GitHubAPI` for conditional requests.
+
+    Cached ``GET`` requests are sent with their ``ETag`` / ``Last-Modified``
+    validators and a ``304 Not Modified`` response is answered from the cache.
+
+    Args:
+        max_size: Maximum number of cached responses.
+        metrics: Instance of :class:`collections.Counter`.
+    """
+
+    def __init__(self, max_size=500, metrics=None):
+        self.max_size = max_size
+        self.metrics = metrics
+        self._entries = OrderedDict()
+
+    def __getitem__(self, url):
+        try:
+            entry = self._entries[url]
+        except KeyError:
+            self._count("github_cache_miss")
+            raise
+
+        self._entries.move_to_end(url)
+        self._count("github_cache_hit")
+        return entry
+
+    def __setitem__(self, url, entry):
+        self._entries[url] = entry
+        self._entries.move_to_end(url)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def __delitem__(self, url):
+        del self._entries[url]
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _count(self, metric):
+        if self.metrics is not None:
+            self.metrics[metric] += 1
+
+
+class PgETagCache(ETagCache):
+    """
+    :class:`ETagCache` persisted through :class:`sirbot.plugins.postgres.PgPlugin`.
+
+    Responses are written to postgres in the background and the most recent ones
+    are loaded back on startup. The table is created on first use.
+
+    Args:
+        plugin: Name of the postgres plugin.
+        table: Table name.
+        max_size: Maximum number of cached responses.
+        metrics: Instance of :class:`collections.Counter`.
+    """
+
+    def __init__(self, plugin="pg", table="github_etags", max_size=500, metrics=None):
+        super().__init__(max_size=max_size, metrics=metrics)
+        self.plugin = plugin
+        self.table = table
+        self._app = None
+        self._created = False
+        self._writes = set()
+
+    def load_app(self, sirbot):
+        self._app = sirbot
+        sirbot.on_startup.append(self.restore)
+        sirbot.on_shutdown.append(self.flush)
+
+    def __setitem__(self, url, entry):
+        super().__setitem__(url, entry)
+        if self._app is not None:
+            write = asyncio.ensure_future(self._save(url, entry))
+            self._writes.add(write)
+            write.add_done_callback(self._writes.discard)
+
+    async def restore(self, app=None):
+        """
+        Load the most recent responses from postgres.
+        """
+        try:
+            async with self._connection() as pg_con:
+                await self._create_table(pg_con)
+                rows = await pg_con.fetch(
+                    f"""SELECT url, etag, last_modified, data, more FROM {self.table}
+                        ORDER BY updated DESC LIMIT $1""",
+                    self.max_size,
+                )
+                await pg_con.execute(
+                    f"""DELETE FROM {self.table} WHERE url NOT IN
+                        (SELECT url FROM {self.table} ORDER BY updated DESC LIMIT $1)""",
+                    self.max_size,
+                )
+        except Exception as e:
+            LOG.exception(e)
+            return
+
+        for row in reversed(rows):
+            super().__setitem__(
+                row["url"],
+                (row["etag"], row["last_modified"], row["data"], row["more"]),
+            )
+        LOG.debug("Restored %s github responses", len(rows))
+
+    async def flush(self, app=None):
+        """
+        Wait for the pending writes.
+        """
+        if self._writes:
+            await asyncio.gather(*self._writes, return_exceptions=True)
+
+    async def _save(self, url, entry):
+        etag, last_modified, data, more = entry
+        try:
+            async with self._connection() as pg_con:
+                await self._create_table(pg_con)
+                await pg_con.execute(
+                    f"""INSERT INTO {self.table}
+                        (url, etag, last_modified, data, more, updated)
+                        VALUES ($1, $2, $3, $4, $5, now())
+                        ON CONFLICT (url) DO UPDATE SET etag = $2, last_modified = $3,
+                        data = $4, more = $5, updated = now()""",
+                    url,
+                    etag,
+                    last_modified,
+                    data,
+                    more,
+                )
+        except Exception as e:
+            LOG.exception(e)
+
+    def _connection(self):
+        return self._app["plugins"][self.plugin].connection()
+
+    async def _create_table(self, pg_con):
+        if not self._created:
+            await pg_con.execute(
+                f"""CREATE TABLE IF NOT EXISTS {self.table}
+                    (url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT,
+                    data JSONB, more TEXT, updated TIMESTAMPTZ)"""
+            )
+            self._created = True
@@ -0,0 +1,91 @@
+import time
+from collections import OrderedDict
+
+
+class MemoryDeliveryStore:
+    """
+    In-memory record of the processed github deliveries.
+
+    Delivery stores implement ``add(delivery_id, ttl)``, returning ``False`` for a
+    delivery already seen in the last ``ttl`` seconds, and ``discard(delivery_id)``.
+
+    Args:
+        max_size: Maximum number of remembered deliveries.
+    """
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self._deliveries = OrderedDict()
+
+    async def add(self, delivery_id, ttl):
+        now = time.monotonic()
+        expires = self._deliveries.get(delivery_id)
+        if expires is not None and expires > now:
+            return False
+
+        self._deliveries.pop(delivery_id, None)
+        self._deliveries[delivery_id] = now + ttl
+        while self._deliveries:
+            oldest, expires = next(iter(self._deliveries.items()))
+            if expires > now and len(self._deliveries) <= self.max_size:
+                break
+            del self._deliveries[oldest]
+        return True
+
+    async def discard(self, delivery_id):
+        self._deliveries.pop(delivery_id, None)
+
+
+class PgDeliveryStore:
+    """
+    Record of the processed github deliveries shared through
+    :class:`sirbot.plugins.postgres.PgPlugin`.
+
+    The table is created on first use.
+
+    Args:
+        plugin: Name of the postgres plugin.
+        table: Table name.
+    """
+
+    def __init__(self, plugin="pg", table="github_deliveries"):
+        self.plugin = plugin
+        self.table = table
+        self._app = None
+        self._created = False
+
+    def load_app(self, sirbot):
+        self._app = sirbot
+
+    async def add(self, delivery_id, ttl):
+        async with self._connection() as pg_con:
+            await self._create_table(pg_con)
+            added = await pg_con.fetchval(
+                f"""INSERT INTO {self.table} (delivery_id, expires)
+                    VALUES ($1, now() + $2 * interval '1 second')
+                    ON CONFLICT (delivery_id) DO UPDATE SET expires = EXCLUDED.expires
+                    WHERE {self.table}.expires < now()
+                    RETURNING delivery_id""",
+                delivery_id,
+                ttl,
+            )
+            await pg_con.execute(f"""DELETE FROM {self.table} WHERE expires < now()""")
+        return added is not None
+
+    async def discard(self, delivery_id):
+        async with self._connection() as pg_con:
+            await self._create_table(pg_con)
+            await pg_con.execute(
+                f"""DELETE FROM {self.table} WHERE delivery_id = $1""", delivery_id
+            )
+
+    def _connection(self):
+        return self._app["plugins"][self.plugin].connection()
+
+    async def _create_table(self, pg_con):
+        if not self._created:
+            await pg_con.execute(
+                f"""CREATE TABLE IF NOT EXISTS {self.table}
+                    (delivery_id TEXT PRIMARY KEY, expires TIMESTAMPTZ)"""
+            )
+            self._created = True
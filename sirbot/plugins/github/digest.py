@@ -0,0 +1,92 @@
+import asyncio
+import logging
+
+LOG = logging.getLogger(__name__)
+
+
+def default_key(event):
+    """
+    Group the events by repository and pull request or issue number.
+    """
+    repository = (event.data.get("repository") or {}).get("full_name")
+    number = (event.data.get("pull_request") or event.data.get("issue") or {}).get(
+        "number"
+    )
+    return repository, number
+
+
+class Digest:
+    """
+    Router handler coalescing bursts of events into batches.
+
+    Events are grouped by ``key``. A group is passed to the handler ``window``
+    seconds after its first event, once it holds ``max_size`` events or at shutdown.
+    Handler failures are logged, the events are not redelivered.
+
+    Args:
+        handler: Coroutine called with the list of events and the application.
+        window: Time in seconds events are collected.
+        key: Function returning the group of an event, defaults to
+             :func:`default_key`.
+        max_size: Maximum number of events in a batch.
+        metrics: Instance of :class:`collections.Counter`.
+    """
+
+    def __init__(self, handler, window=10, key=None, max_size=100, metrics=None):
+        self.handler = handler
+        self.window = window
+        self.key = key or default_key
+        self.max_size = max_size
+        self.metrics = metrics
+
+        self._batches = {}
+        self._tasks = set()
+
+    def __len__(self):
+        return sum(len(events) for events, _ in self._batches.values())
+
+    async def __call__(self, event, app):
+        key = self.key(event)
+        if key not in self._batches:
+            timer = asyncio.get_event_loop().call_later(
+                self.window, self.flush, key, app
+            )
+            self._batches[key] = ([], timer)
+
+        events = self._batches[key][0]
+        events.append(event)
+        self._count("github_digest_events")
+        if len(events) >= self.max_size:
+            self.flush(key, app)
+
+    def flush(self, key, app):
+        """
+        Pass a group of events to the handler.
+        """
+        events, timer = self._batches.pop(key)
+        timer.cancel()
+        self._count("github_digest_flushed")
+
+        task = asyncio.ensure_future(self._run(events, app))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def close(self, app):
+        """
+        Flush every group and wait for the handlers.
+        """
+        for key in list(self._batches):
+            self.flush(key, app)
+        if self._tasks:
+            await asyncio.gather(*self._tasks)
+
+    async def _run(self, events, app):
+        try:
+            await self.handler(events, app)
+        except Exception as e:
+            LOG.exception(e)
+            self._count("github_digest_failed")
+
+    def _count(self, metric):
+        if self.metrics is not None:
+            self.metrics[metric] += 1
@@ -0,0 +1,210 @@
+import re
+import asyncio
+
+# String literals are matched first so the ``$`` they contain are left untouched
+TOKEN_RE = re.compile(r'"""[\s\S]*?"""|"(?:[^"\\]|\\.)*"|\$(\w+)')
+
+SCALAR_TYPES = ((bool, "Boolean!"), (int, "Int!"), (float, "Float!"), (str, "String!"))
+
+
+class GraphQLError(Exception):
+    """
+    A GraphQL lookup failed.
+
+    Args:
+        errors: GraphQL errors of the lookup.
+    """
+
+    def __init__(self, errors):
+        super().__init__("; ".join(error.get("message", "") for error in errors))
+        self.errors = errors
+
+
+class GraphQLBatcher:
+    """
+    Send the GraphQL lookups issued in the same ``window`` as a single aliased query.
+
+    Each lookup is a single root field. Its variables are sent as query variables,
+    prefixed with the lookup alias. The type of ``str``, ``int``, ``float`` and
+    ``bool`` values is inferred, other variables (e.g. enums, lists or input
+    objects) must be typed with ``types``. The GraphQL API requires
+    authentication, use an authenticated client or pass an ``oauth_token``:
+
+    .. code-block:: python
+
+        batcher = GraphQLBatcher(await github.installation_api(event))
+        pull_request, labels = await asyncio.gather(
+            batcher.query(
+                'repository(owner: $owner, name: $name) { pullRequest(number: 1) { title } }',
+                owner="pyslackers",
+                name="sir-bot-a-lot-2",
+            ),
+            batcher.query(
+                'search(query: $q, type: $type, first: 10) { issueCount }',
+                types={"type": "SearchType!"},
+                q="repo:pyslackers/sir-bot-a-lot-2 is:open",
+                type="ISSUE",
+            ),
+        )
+
+    Args:
+        api: Instance of :class:`gidgethub.abc.GitHubAPI`.
+        oauth_token: Token authenticating the queries, defaults to the ``api`` one.
+        window: Time in seconds lookups are collected, by default the current
+                event loop iteration.
+        max_batch: Maximum number of lookups in a query.
+        url: GraphQL endpoint.
+        metrics: Instance of :class:`collections.Counter`.
+    """
+
+    def __init__(
+        self,
+        api,
+        oauth_token=None,
+        window=0,
+        max_batch=20,
+        url="https://api.github.com/graphql",
+        metrics=None,
+    ):
+        self.api = api
+        self.oauth_token = oauth_token
+        self.window = window
+        self.max_batch = max_batch
+        self.url = url
+        self.metrics = metrics
+
+        self._pending = []
+        self._timer = None
+        self._sending = set()
+
+    async def query(self, query, types=None, **variables):
+        """
+        Resolve a lookup.
+
+        Args:
+            query: Root field of the lookup, e.g. ``repository(...) { ... }``.
+            types: GraphQL types of the variables, e.g. ``{"states": "[IssueState!]"}``.
+                   Required for values other than ``str``, ``int``, ``float`` and
+                   ``bool``.
+            variables: Values of the ``$variables`` used in ``query``.
+
+        Returns:
+            Value of the root field.
+
+        Raises:
+            :class:`sirbot.plugins.github.graphql.GraphQLError`
+        """
+        declarations = _declarations(query, types or {}, variables)
+        future = asyncio.get_event_loop().create_future()
+        self._pending.append((query, declarations, variables, future))
+        if len(self._pending) >= self.max_batch:
+            self.flush()
+        elif self._timer is None:
+            loop = asyncio.get_event_loop()
+            if self.window:
+                self._timer = loop.call_later(self.window, self.flush)
+            else:
+                self._timer = loop.call_soon(self.flush)
+        return await future
+
+    def flush(self):
+        """
+        Send the collected lookups.
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        pending, self._pending = self._pending, []
+        if pending:
+            task = asyncio.ensure_future(self._send(pending))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+
+    async def close(self):
+        """
+        Send the collected lookups and wait for the queries in flight.
+        """
+        self.flush()
+        if self._sending:
+            await asyncio.gather(*self._sending)
+
+    async def _send(self, pending):
+        if self.metrics is not None:
+            self.metrics["github_graphql_queries"] += 1
+            self.metrics["github_graphql_lookups"] += len(pending)
+
+        try:
+            response = await self.api.post(
+                self.url,
+                data=_batch(pending),
+                oauth_token=self.oauth_token or self.api.oauth_token,
+            )
+        except Exception as e:
+            for *_, future in pending:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        data = response.get("data") or {}
+        errors = {}
+        for error in response.get("errors") or ():
+            path = error.get("path") or [None]
+            errors.setdefault(path[0], []).append(error)
+
+        for i, (*_, future) in enumerate(pending):
+            if future.done():
+                continue
+            alias = f"q{i}"
+            lookup_errors = errors.get(alias, []) + errors.get(None, [])
+            if lookup_errors:
+                future.set_exception(GraphQLError(lookup_errors))
+            else:
+                future.set_result(data.get(alias))
+
+
+def _declarations(query, types, variables):
+    declarations = {}
+    for match in TOKEN_RE.finditer(query):
+        name = match.group(1)
+        if name is None or name in declarations:
+            continue
+        elif name not in variables:
+            raise ValueError(f"Missing GraphQL variable: ${name}")
+        elif name in types:
+            declarations[name] = types[name]
+        else:
+            declarations[name] = _scalar_type(name, variables[name])
+    return declarations
+
+
+def _scalar_type(name, value):
+    for python_type, graphql_type in SCALAR_TYPES:
+        if isinstance(value, python_type):
+            return graphql_type
+    raise TypeError(f"GraphQL type of ${name} is required")
+
+
+def _batch(pending):
+    fields = []
+    declarations = []
+    variables = {}
+    for i, (query, lookup_declarations, values, _) in enumerate(pending):
+        alias = f"q{i}"
+
+        def rename(match):
+            if match.group(1) is None:
+                return match.group(0)
+            return f"${alias}_{match.group(1)}"
+
+        fields.append(f"{alias}: {TOKEN_RE.sub(rename, query)}")
+        for name, type_ in lookup_declarations.items():
+            declarations.append(f"${alias}_{name}: {type_}")
+            variables[f"{alias}_{name}"] = values[name]
+
+    if not declarations:
+        return {"query": f"{{ {' '.join(fields)} }}"}
+    return {
+        "query": f"query({', '.join(declarations)}) {{ {' '.join(fields)} }}",
+        "variables": variables,
+    }
@@ -1,14 +1,31 @@
 import os
+import re
+import hmac
+import zlib
+import asyncio
+import hashlib
 import logging
+from collections import Counter
 
 from gidgethub import ValidationFailure
+from multidict import CIMultiDict
 from aiohttp.web import Response
 from gidgethub.sansio import Event
-from gidgethub.aiohttp import GitHubAPI
 from gidgethub.routing import Router
 
+from .api import GitHubAPI
+from .apps import InstallationTokens
+from .cache import ETagCache
+from .digest import Digest
+from .graphql import GraphQLBatcher
+from .scheduler import RateLimitScheduler
+from .deliveries import MemoryDeliveryStore
+from ...concurrency import limit
+
 LOG = logging.getLogger(__name__)
 
+ACTION_RE = re.compile(rb'\A\s*\{\s*"action"\s*:\s*"([^"\\]*)"')
+
 
 class GithubPlugin:
     """
@@ -19,44 +36,486 @@ class GithubPlugin:
 
     .. code-block:: python
 
-        GithubPlugin.router.add(handler, event_type)
+        GithubPlugin.on_event(event_type, handler)
 
     **Endpoints**:
         * ``/github``: Github webhook.
 
+    Args:
+        verify: Webhook secret (env var: `GITHUB_VERIFY`).
+        oauth_token: Token authenticating **api** (env var: `GITHUB_TOKEN`).
+        prefilter: Acknowledge deliveries without a registered handler before
+                   decoding them.
+        workers: Acknowledge verified deliveries with a ``202`` and run the handlers
+                 on ``workers`` background workers. Deliveries of a repository are
+                 always processed in order by the same worker.
+        queue_size: Maximum number of deliveries waiting for each worker. Deliveries
+                    over the limit are answered with a ``503``.
+        deliveries: Skip deliveries already processed, by ``X-GitHub-Delivery``.
+                    ``True`` or a delivery store such as
+                    :class:`sirbot.plugins.github.deliveries.PgDeliveryStore`.
+        deliveries_ttl: Time in seconds a delivery id is remembered.
+        max_body_size: Maximum size of a delivery in bytes. Larger deliveries are
+                       answered with a ``413``. Not limited by the application
+                       ``client_max_size``, deliveries over the
+                       :class:`sirbot.recorder.Recorder` ``max_body_size`` are not
+                       recorded.
+        offload_size: Size in bytes over which the signature verification and the
+                      decoding of a delivery run in the default executor.
+        cache: Cache of the ``GET`` responses revalidated with conditional requests.
+               Defaults to a :class:`sirbot.plugins.github.cache.ETagCache` of
+               ``cache_size`` responses, ``False`` disables it. Use
+               :class:`sirbot.plugins.github.cache.PgETagCache` to persist it.
+        cache_size: Maximum number of responses in the default cache.
+        app_id: GitHub App id (env var: `GITHUB_APP_ID`), enables
+                :meth:`installation_api`.
+        private_key: GitHub App private key (env var: `GITHUB_APP_PRIVATE_KEY`).
+        refresh_margin: Time in seconds before expiry an installation token is
+                        refreshed.
+        scheduler: Rate limit aware scheduling of the API requests. Defaults to a
+                   :class:`sirbot.plugins.github.scheduler.RateLimitScheduler`,
+                   ``False`` disables it.
+
     **Variables**:
         * **router**: Instance of :class:`gidgethub.routing.Router`.
-        * **api**: Instance of :class:`gidgethub.aiohttp.GitHubAPI`.
+        * **api**: Instance of :class:`sirbot.plugins.github.api.GitHubAPI`.
+        * **graphql**: Instance of
+          :class:`sirbot.plugins.github.graphql.GraphQLBatcher` using **api**
+          (``None`` without ``oauth_token``).
+        * **installations**: Instance of
+          :class:`sirbot.plugins.github.apps.InstallationTokens` for a GitHub App.
+        * **metrics**: Instance of :class:`collections.Counter`.
     """
 
     __name__ = "github"
 
-    def __init__(self, *, verify=None):
+    def __init__(
+        self,
+        *,
+        verify=None,
+        oauth_token=None,
+        prefilter=False,
+        workers=None,
+        queue_size=1000,
+        deliveries=None,
+        deliveries_ttl=3600,
+        max_body_size=25 * 1024 * 1024,
+        offload_size=1024 * 1024,
+        cache=None,
+        cache_size=500,
+        app_id=None,
+        private_key=None,
+        refresh_margin=300,
+        scheduler=None,
+    ):
         self.api = None
         self.router = Router()
         self.verify = verify or os.environ["GITHUB_VERIFY"]
+        self.oauth_token = oauth_token or os.environ.get("GITHUB_TOKEN")
+        self.metrics = Counter()
+        self.prefilter = prefilter
+        self.workers = workers
+        self.queue_size = queue_size
+        self._queues = []
+        self._workers = []
+        if deliveries is True:
+            deliveries = MemoryDeliveryStore()
+        self.deliveries = deliveries
+        self.deliveries_ttl = deliveries_ttl
+        self._routing_table = {}
+        self.max_body_size = max_body_size
+        self.offload_size = offload_size
+        if cache is None:
+            cache = ETagCache(max_size=cache_size)
+        elif cache is False:
+            cache = None
+        if getattr(cache, "metrics", False) is None:
+            cache.metrics = self.metrics
+        self.cache = cache
+        self.app_id = app_id or os.environ.get("GITHUB_APP_ID")
+        self.private_key = private_key or os.environ.get("GITHUB_APP_PRIVATE_KEY")
+        self.refresh_margin = refresh_margin
+        self.installations = None
+        self.graphql = None
+        self._digests = []
+        if scheduler is None:
+            scheduler = RateLimitScheduler(metrics_key="plugin", metrics=self.metrics)
+        elif scheduler is False:
+            scheduler = None
+        self.scheduler = scheduler
 
     def load(self, sirbot):
         LOG.info("Loading github plugin")
-        self.api = GitHubAPI(session=sirbot.http_session, requester=sirbot.user_agent)
+        self.api = GitHubAPI(
+            session=sirbot.http_session,
+            requester=sirbot.user_agent,
+            oauth_token=self.oauth_token,
+            cache=self.cache,
+            metrics=self.metrics,
+            scheduler=self.scheduler,
+            rate_limit_key="plugin",
+        )
+
+        # The GraphQL API always requires authentication
+        if self.oauth_token:
+            self.graphql = GraphQLBatcher(self.api, metrics=self.metrics)
+
+        if self.app_id:
+            self.installations = InstallationTokens(
+                self.api,
+                self.app_id,
+                self.private_key,
+                refresh_margin=self.refresh_margin,
+                metrics=self.metrics,
+            )
 
         sirbot.router.add_route("POST", "/github", dispatch)
 
+        if hasattr(self.cache, "load_app"):
+            self.cache.load_app(sirbot)
+
+        if hasattr(self.deliveries, "load_app"):
+            self.deliveries.load_app(sirbot)
+
+        if self.workers:
+            sirbot.on_startup.append(self.start_workers)
+            sirbot.on_shutdown.append(self.stop_workers)
+
+        sirbot.on_shutdown.append(self._close_digests)
+
+        if self.graphql:
+            sirbot.on_shutdown.append(self._close_graphql)
+
+    @property
+    def queued(self):
+        """
+        Number of deliveries waiting for a worker.
+        """
+        return sum(queue.qsize() for queue in self._queues)
+
+    async def start_workers(self, app):
+        self._queues = [
+            asyncio.Queue(maxsize=self.queue_size) for _ in range(self.workers)
+        ]
+        self._workers = [
+            asyncio.ensure_future(self._worker(queue, app)) for queue in self._queues
+        ]
+
+    async def stop_workers(self, app):
+        """
+        Wait for the queued deliveries to be processed and stop the workers.
+        """
+        for queue in self._queues:
+            await queue.put(None)
+        await asyncio.gather(*self._workers)
+        self._workers = []
+
+    async def installation_api(self, installation):
+        """
+        Client authenticated as a GitHub App installation.
+
+        Args:
+            installation: Installation id or :class:`gidgethub.sansio.Event`
+                          delivered to the installation.
+
+        Returns:
+            Instance of :class:`sirbot.plugins.github.api.GitHubAPI`.
+        """
+        if self.installations is None:
+            raise RuntimeError("GitHub App is not configured")
+
+        if isinstance(installation, Event):
+            installation = installation.data["installation"]["id"]
+        token = await self.installations.token(installation)
+        return GitHubAPI(
+            session=self.api._session,
+            requester=self.api.requester,
+            oauth_token=token,
+            cache=self.cache,
+            metrics=self.metrics,
+            scheduler=self.scheduler,
+            rate_limit_key=f"installation:{installation}",
+        )
+
+    async def read_payload(self, request):
+        """
+        Read the body of a webhook request and verify its signature.
+
+        The body is streamed and hashed once complete, in the default executor
+        when it is over ``offload_size``.
+
+        Raises:
+            :class:`gidgethub.ValidationFailure`: Missing or invalid signature.
+            :class:`sirbot.plugins.github.plugin.PayloadTooLarge`: Body over
+                ``max_body_size``.
+        """
+        signature = request.headers.get("X-Hub-Signature", "")
+        if not signature.startswith("sha1="):
+            raise ValidationFailure("signature is missing")
+
+        if request.content_length and request.content_length > self.max_body_size:
+            raise PayloadTooLarge()
+
+        if request.content.at_eof():
+            # Already read, e.g. by the recorder
+            payload = await request.read()
+            if len(payload) > self.max_body_size:
+                raise PayloadTooLarge()
+        else:
+            chunks = []
+            size = 0
+            async for chunk in request.content.iter_any():
+                size += len(chunk)
+                if size > self.max_body_size:
+                    raise PayloadTooLarge()
+                chunks.append(chunk)
+            payload = b"".join(chunks)
+
+        if len(payload) > self.offload_size:
+            expected = await asyncio.get_event_loop().run_in_executor(
+                None, _signature, self.verify, payload
+            )
+        else:
+            expected = _signature(self.verify, payload)
+
+        if not hmac.compare_digest(signature, expected):
+            raise ValidationFailure("invalid signature")
+        return payload
+
+    async def check_delivery(self, event):
+        """
+        Record a delivery.
+
+        Returns:
+            ``False`` if the delivery was already processed.
+        """
+        if not self.deliveries or not event.delivery_id:
+            return True
+
+        try:
+            new = await self.deliveries.add(event.delivery_id, self.deliveries_ttl)
+        except Exception as e:
+            LOG.exception(e)
+            return True
+
+        if not new:
+            LOG.debug("Skipping duplicate github delivery %s", event.delivery_id)
+            self.metrics["github_duplicate"] += 1
+        return new
+
+    async def forget_delivery(self, event):
+        """
+        Forget a delivery so it is processed again when redelivered.
+        """
+        if self.deliveries and event.delivery_id:
+            try:
+                await self.deliveries.discard(event.delivery_id)
+            except Exception as e:
+                LOG.exception(e)
+
+    def enqueue(self, event):
+        """
+        Queue an event for the workers.
+
+        Returns:
+            ``False`` if the worker queue is full.
+        """
+        repository = (event.data.get("repository") or {}).get("full_name") or ""
+        queue = self._queues[zlib.crc32(repository.encode("utf-8")) % len(self._queues)]
+        try:
+            queue.put_nowait(event)
+        except asyncio.QueueFull:
+            LOG.warning(
+                "Github worker queue full, dropping delivery %s", event.delivery_id
+            )
+            self.metrics["github_queue_full"] += 1
+            return False
+
+        self.metrics["github_queued"] += 1
+        return True
+
+    async def _worker(self, queue, app):
+        while True:
+            event = await queue.get()
+            try:
+                if event is None:
+                    break
+                await self.router.dispatch(event, app=app)
+                self.metrics["github_processed"] += 1
+            except Exception as e:
+                LOG.exception(e)
+                self.metrics["github_failed"] += 1
+                await self.forget_delivery(event)
+            finally:
+                queue.task_done()
+
+    def on_event(
+        self, event_type, handler, max_concurrency=None, queue_size=None, **data_detail
+    ):
+        """
+        Register handler for an event
+
+        kwargs are passed to :meth:`gidgethub.routing.Router.add`
+
+        Args:
+            event_type: Incoming event type.
+            handler: Handler to call.
+            max_concurrency: Maximum number of concurrent executions of the handler.
+            queue_size: Maximum number of executions waiting for ``max_concurrency``.
+        """
+        if max_concurrency:
+            handler = limit(handler, max_concurrency, queue_size, metrics=self.metrics)
+        self.router.add(handler, event_type, **data_detail)
+        self._build_routing_table()
+
+    def on_digest(
+        self, event_type, handler, window=10, key=None, max_size=100, **data_detail
+    ):
+        """
+        Register handler for bursts of an event
+
+        The handler is called with the list of events of a group, ``window`` seconds
+        after the first one or once ``max_size`` events are collected.
+
+        kwargs are passed to :meth:`gidgethub.routing.Router.add`
+
+        Args:
+            event_type: Incoming event type.
+            handler: Handler to call with the events.
+            window: Time in seconds events are collected.
+            key: Function returning the group of an event, defaults to the
+                 repository and pull request or issue number.
+            max_size: Maximum number of events passed to the handler.
+        """
+        digest = Digest(
+            handler, window=window, key=key, max_size=max_size, metrics=self.metrics
+        )
+        self._digests.append(digest)
+        self.on_event(event_type, digest, **data_detail)
+
+    def is_routed(self, event_type, payload=None):
+        """
+        Check if a delivery has registered handlers, without decoding its payload.
+
+        The ``action`` is read from the start of the raw payload when handlers are
+        only registered for some actions.
+
+        Args:
+            event_type: ``X-GitHub-Event`` header.
+            payload: Raw request body.
+        """
+        if self._in_routing_table(event_type, payload):
+            return True
+
+        # Handlers may have been added directly to the router since the last build
+        self._build_routing_table()
+        return self._in_routing_table(event_type, payload)
+
+    async def _close_digests(self, app):
+        await asyncio.gather(*(digest.close(app) for digest in self._digests))
+
+    async def _close_graphql(self, app):
+        await self.graphql.close()
+
+    def _build_routing_table(self):
+        # Event type -> ``None`` for any delivery or the set of routed actions
+        table = {}
+        for event_type, details in self.router._deep_routes.items():
+            if set(details) == {"action"}:
+                table[event_type] = frozenset(details["action"])
+            else:
+                table[event_type] = None
+        for event_type in self.router._shallow_routes:
+            table[event_type] = None
+        self._routing_table = table
+
+    def _in_routing_table(self, event_type, payload):
+        actions = self._routing_table.get(event_type, False)
+        if actions is False:
+            return False
+        elif actions is None:
+            return True
+
+        match = ACTION_RE.match(payload or b"")
+        if not match:
+            return True
+        return match.group(1).decode("utf-8") in actions
+
 
 async def dispatch(request):
     github = request.app.plugins["github"]
-    payload = await request.read()
 
     try:
-        event = Event.from_http(request.headers, payload, secret=github.verify)
-        await github.router.dispatch(event, app=request.app)
+        event = await _read_event(request, github)
     except ValidationFailure:
-        LOG.debug(
-            "Github webhook failed verification: %s, %s", request.headers, payload
-        )
+        LOG.debug("Github webhook failed verification: %s", request.headers)
         return Response(status=401)
+    except PayloadTooLarge:
+        LOG.warning(
+            "Github delivery %s over %s bytes",
+            request.headers.get("X-GitHub-Delivery"),
+            github.max_body_size,
+        )
+        github.metrics["github_too_large"] += 1
+        return Response(status=413)
+    except Exception as e:
+        LOG.exception(e)
+        return Response(status=500)
+
+    if event is None:
+        github.metrics["github_unrouted"] += 1
+        return Response(status=200)
+
+    return await _handle_event(event, github, request.app)
+
+
+async def _handle_event(event, github, app):
+    if not await github.check_delivery(event):
+        return Response(status=200)
+
+    if github.workers:
+        if github.enqueue(event):
+            return Response(status=202)
+        await github.forget_delivery(event)
+        return Response(status=503)
+
+    try:
+        await github.router.dispatch(event, app=app)
     except Exception as e:
         LOG.exception(e)
+        await github.forget_delivery(event)
         return Response(status=500)
     else:
         return Response(status=200)
+
+
+async def _read_event(request, github):
+    # ``None`` for a delivery without handlers, not worth decoding
+    payload = await github.read_payload(request)
+    if github.prefilter and not github.is_routed(
+        request.headers.get("X-GitHub-Event"), payload
+    ):
+        return None
+
+    return await _decode_event(request.headers, payload, github.offload_size)
+
+
+async def _decode_event(headers, payload, offload_size):
+    # The signature is already verified
+    headers = CIMultiDict(headers)
+    headers.popall("X-Hub-Signature", None)
+    if len(payload) > offload_size:
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, Event.from_http, headers, payload)
+    return Event.from_http(headers, payload)
+
+
+def _signature(secret, payload):
+    mac = hmac.new(secret.encode("utf-8"), payload, digestmod=hashlib.sha1)
+    return "sha1=" + mac.hexdigest()
+
+
+class PayloadTooLarge(Exception):
+    """
+    The request body is over ``max_body_size``.
+    """
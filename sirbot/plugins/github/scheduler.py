@@ -0,0 +1,155 @@
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+
+LOG = logging.getLogger(__name__)
+
+INTERACTIVE = 0
+BULK = 1
+
+
+class _Quota:
+    __slots__ = ("limit", "remaining", "reset", "blocked_until", "next_slot")
+
+    def __init__(self):
+        self.limit = None
+        self.remaining = None
+        self.reset = 0
+        self.blocked_until = 0
+        self.next_slot = 0
+
+
+class RateLimitScheduler:
+    """
+    Schedule github API requests according to the rate limit of each token.
+
+    The remaining quota is read from the ``X-RateLimit-*`` response headers.
+    ``INTERACTIVE`` requests are sent right away while quota remains. ``BULK``
+    requests are paced to spread the quota left above ``reserve`` until the reset,
+    keeping the reserve for interactive work. Secondary rate limits (``Retry-After``)
+    block every request of the token for the requested time.
+
+    Args:
+        reserve: Number of requests kept for interactive work.
+        max_wait: Maximum time in seconds an interactive request waits for quota.
+                  Longer waits are not attempted and the request fails.
+        max_retries: Number of times a request hitting a secondary rate limit
+                     is retried.
+        max_keys: Maximum number of tracked tokens.
+        metrics_key: Key of the token whose remaining quota is reported as the
+                     ``github_ratelimit_remaining`` metric.
+        metrics: Instance of :class:`collections.Counter`.
+    """
+
+    def __init__(
+        self,
+        reserve=100,
+        max_wait=60,
+        max_retries=2,
+        max_keys=1000,
+        metrics_key=None,
+        metrics=None,
+    ):
+        self.reserve = reserve
+        self.max_wait = max_wait
+        self.max_retries = max_retries
+        self.max_keys = max_keys
+        self.metrics_key = metrics_key
+        self.metrics = metrics
+        self._quotas = OrderedDict()
+
+    def quota(self, key):
+        """
+        Known quota of a token.
+
+        Returns:
+            Tuple of the ``limit``, ``remaining`` requests and ``reset`` epoch time,
+            ``None`` if no response was received yet.
+        """
+        quota = self._quotas.get(key)
+        if quota is None or quota.remaining is None:
+            return None
+        return quota.limit, quota.remaining, quota.reset
+
+    async def acquire(self, key, priority=INTERACTIVE):
+        """
+        Wait for the quota of a token to allow a request.
+
+        Args:
+            key: Token identifier.
+            priority: ``INTERACTIVE`` or ``BULK``.
+        """
+        while True:
+            delay, reserved = self._delay(key, priority)
+            if delay <= 0:
+                return
+            elif priority == INTERACTIVE and delay > self.max_wait:
+                self._count("github_ratelimit_exhausted")
+                return
+
+            self._count("github_ratelimit_waits")
+            await asyncio.sleep(delay)
+            if reserved:
+                return
+
+    def update(self, key, status, headers):
+        """
+        Record the rate limit headers of a response.
+
+        Returns:
+            Time in seconds to wait before retrying the request when a secondary
+            rate limit was hit, otherwise ``None``.
+        """
+        quota = self._quotas.pop(key, None) or _Quota()
+        self._quotas[key] = quota
+        if len(self._quotas) > self.max_keys:
+            self._quotas.popitem(last=False)
+
+        if "x-ratelimit-remaining" in headers:
+            quota.limit = int(headers["x-ratelimit-limit"])
+            quota.remaining = int(headers["x-ratelimit-remaining"])
+            reset = int(headers["x-ratelimit-reset"])
+            if reset != quota.reset:
+                quota.next_slot = 0
+            quota.reset = reset
+            if self.metrics is not None and key == self.metrics_key:
+                self.metrics["github_ratelimit_remaining"] = quota.remaining
+
+        if status in (403, 429) and "retry-after" in headers:
+            retry_after = int(headers["retry-after"])
+            LOG.warning("Github secondary rate limit, retrying in %ss", retry_after)
+            quota.blocked_until = time.time() + retry_after
+            self._count("github_ratelimit_secondary")
+            return retry_after
+        return None
+
+    def _delay(self, key, priority):
+        # Time to wait and whether a paced slot was reserved
+        quota = self._quotas.get(key)
+        if quota is None:
+            return 0, False
+
+        now = time.time()
+        if quota.blocked_until > now:
+            return quota.blocked_until - now, False
+        elif quota.remaining is None or quota.reset <= now:
+            return 0, False
+        elif quota.remaining <= 0:
+            return quota.reset - now, False
+        elif priority == INTERACTIVE:
+            quota.remaining -= 1
+            return 0, True
+
+        available = quota.remaining - self.reserve
+        if available <= 0:
+            return quota.reset - now, False
+
+        slot = max(now, quota.next_slot)
+        quota.next_slot = slot + (quota.reset - slot) / available
+        quota.remaining -= 1
+        return slot - now, True
+
+    def _count(self, metric):
+        if self.metrics is not None:
+            self.metrics[metric] += 1
@@ -1,11 +1,50 @@
 import asyncio
 import logging
+from collections import Counter
 
+import aiohttp
 from aiohttp.web import Response
 
+from ...concurrency import ConcurrencyLimiter, limit
+
 LOG = logging.getLogger(__name__)
 
 
+class BuildResult:
+    """
+    Result of a build request.
+
+    **Variables**:
+        * **project**: Readthedocs project name.
+        * **branch**: Built branch.
+        * **status**: HTTP status of the response.
+        * **data**: Decoded JSON response (``None`` if not JSON).
+        * **attempts**: Number of attempts.
+    """
+
+    def __init__(self, project, branch, status, data=None, attempts=1):
+        self.project = project
+        self.branch = branch
+        self.status = status
+        self.data = data
+        self.attempts = attempts
+
+    @property
+    def ok(self):
+        return 200 <= self.status < 300
+
+    @property
+    def triggered(self):
+        return (
+            self.ok
+            and isinstance(self.data, dict)
+            and bool(self.data.get("build_triggered"))
+        )
+
+    def __repr__(self):
+        return f"<BuildResult {self.project}:{self.branch} status={self.status}>"
+
+
 class RTDPlugin:
     """
     Handle readthedocs webhook
@@ -18,14 +57,33 @@ class RTDPlugin:
 
     **Endpoints**:
         * ``/readthedocs``: Readthedocs webhook.
+
+    :param build_window: Time in seconds build requests of a project branch are
+                         collapsed into a single build.
+    :param build_timeout: Timeout of a build request in seconds.
+    :param build_retries: Number of retries of a build request failing with a
+                          connection error, a timeout or a server error.
+    :param retry_delay: Delay in seconds before the first retry, doubled for each
+                        following one.
+
+    **Variables**:
+        * **metrics**: Instance of :class:`collections.Counter`.
     """
 
     __name__ = "readthedocs"
 
-    def __init__(self):
+    def __init__(
+        self, build_window=0, build_timeout=30, build_retries=2, retry_delay=1
+    ):
 
         self._projects = {}
         self._session = None
+        self._builds = {}
+        self.build_window = build_window
+        self.build_timeout = build_timeout
+        self.build_retries = build_retries
+        self.retry_delay = retry_delay
+        self.metrics = Counter()
 
     def load(self, sirbot):
         LOG.info("Loading read the docs plugin")
@@ -38,13 +96,81 @@ class RTDPlugin:
 
         The project must first be registered with :func:`register_project`
 
+        Requests for the same project branch made within ``build_window`` seconds
+        trigger a single build and share its result.
+
         :param project: Readthedocs project name
         :param branch: Branch to build
-        :return:
+        :return: :class:`sirbot.plugins.readthedocs.plugin.BuildResult`
+        """
+        key = (project, branch)
+        if key in self._builds:
+            self.metrics["rtd_build_coalesced"] += 1
+        else:
+            self._builds[key] = asyncio.ensure_future(self._build(project, branch))
+        return await asyncio.shield(self._builds[key])
+
+    async def build_many(self, builds, max_concurrency=4):
+        """
+        Trigger the builds of many projects.
+
+        :param builds: Project names or ``(project, branch)`` tuples
+        :param max_concurrency: Maximum number of concurrent build requests
+        :return: Build results, or exceptions, in order
         """
+        limiter = ConcurrencyLimiter(max_concurrency)
+        requests = []
+        for build in builds:
+            if isinstance(build, str):
+                build = (build,)
+            requests.append(limiter.run(self.build, *build))
+        return await asyncio.gather(*requests, return_exceptions=True)
+
+    async def _build(self, project, branch):
+        try:
+            if self.build_window:
+                await asyncio.sleep(self.build_window)
+        finally:
+            # Later requests may need a build including newer commits
+            del self._builds[(project, branch)]
+
         url = self._projects[project]["build_url"]
         token = self._projects[project]["jeton"]
-        return await self._session.post(url, json={"branch": branch, "token": token})
+        timeout = aiohttp.ClientTimeout(total=self.build_timeout)
+        self.metrics["rtd_build"] += 1
+
+        attempt = 1
+        while True:
+            try:
+                result = await self._post(url, token, project, branch, timeout)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt > self.build_retries:
+                    self.metrics["rtd_build_failed"] += 1
+                    raise
+                LOG.debug("Readthedocs build request of %s failed: %s", project, e)
+            else:
+                if result.status < 500 or attempt > self.build_retries:
+                    result.attempts = attempt
+                    if not result.ok:
+                        self.metrics["rtd_build_failed"] += 1
+                    return result
+
+            self.metrics["rtd_build_retry"] += 1
+            await asyncio.sleep(self.retry_delay * 2 ** (attempt - 1))
+            attempt += 1
+
+    async def _post(self, url, token, project, branch, timeout):
+        response = await self._session.post(
+            url, json={"branch": branch, "token": token}, timeout=timeout
+        )
+        try:
+            try:
+                data = await response.json(content_type=None)
+            except ValueError:
+                data = None
+            return BuildResult(project, branch, response.status, data)
+        finally:
+            response.release()
 
     def register_project(self, project, build_url, jeton, handlers=None):
         """
@@ -69,7 +195,7 @@ class RTDPlugin:
         self._projects[project]["build_url"] = build_url
         self._projects[project]["jeton"] = jeton
 
-    def register_handler(self, project, handler):
+    def register_handler(self, project, handler, max_concurrency=None, queue_size=None):
         """
         Register a new project notification handler.
 
@@ -78,7 +204,12 @@ class RTDPlugin:
 
         :param project: Readthedocs project name.
         :param handler: Coroutine callback.
+        :param max_concurrency: Maximum number of concurrent executions of the handler.
+        :param queue_size: Maximum number of executions waiting for ``max_concurrency``.
         """
+        if max_concurrency:
+            handler = limit(handler, max_concurrency, queue_size, metrics=self.metrics)
+
         if project not in self._projects:
             self._projects[project] = {"handlers": [handler]}
         else:
@@ -0,0 +1,215 @@
+import time
+import asyncio
+import logging
+
+import aiohttp
+from slack import methods
+from slack.exceptions import RateLimited, HTTPException, SlackAPIError
+
+LOG = logging.getLogger(__name__)
+
+
+class BroadcastResult:
+    """
+    Delivery result of a broadcast target.
+
+    **Variables**:
+        * **target**: Channel or user id.
+        * **response**: Slack API response data (``None`` on failure).
+        * **error**: Exception of the last attempt (``None`` on success).
+        * **attempts**: Number of attempts.
+    """
+
+    def __init__(self, target, response=None, error=None, attempts=1):
+        self.target = target
+        self.response = response
+        self.error = error
+        self.attempts = attempts
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        return f"<BroadcastResult {self.target} ok={self.ok}>"
+
+
+class Broadcast:
+    """
+    Deliver a payload to many channels or users with bounded concurrency.
+
+    Iterate over the broadcast to start it and receive a
+    :class:`sirbot.plugins.slack.broadcast.BroadcastResult` as each delivery
+    finishes. Rate limited deliveries pause every worker for the ``Retry-After``
+    delay, server and connection errors are retried with an exponential backoff.
+    Slack API errors (e.g. ``channel_not_found``) and unexpected exceptions are not
+    retried.
+
+    Args:
+        api: Instance of :class:`slack.io.abc.SlackAPI`.
+        targets: Iterable of channel or user ids.
+        payload: API method data, the target is set as ``channel``.
+        method: :class:`slack.methods` or url string.
+        team: Team passed to ``get_client``.
+        get_client: Coroutine function called with ``team`` when the broadcast
+                    starts, returning the client used instead of ``api``.
+        concurrency: Maximum number of concurrent deliveries.
+        max_retries: Maximum number of retries of a delivery.
+        backoff: Delay in seconds before the first retry.
+        metrics: Instance of :class:`collections.Counter`.
+
+    **Variables**:
+        * **sent**: Number of successful deliveries.
+        * **failed**: Number of failed deliveries.
+        * **retries**: Number of retried attempts.
+    """
+
+    def __init__(
+        self,
+        api,
+        targets,
+        payload,
+        *,
+        method=methods.CHAT_POST_MESSAGE,
+        team=None,
+        get_client=None,
+        concurrency=10,
+        max_retries=3,
+        backoff=1,
+        metrics=None,
+    ):
+        self.api = api
+        self.team = team
+        self.get_client = get_client
+        self.payload = payload
+        self.method = method
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.metrics = metrics
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+
+        self._targets = iter(targets)
+        self._resume_at = 0
+        self._started = None
+        self._finished = None
+
+    @property
+    def elapsed(self):
+        if self._started is None:
+            return 0.0
+        return (self._finished or time.monotonic()) - self._started
+
+    @property
+    def throughput(self):
+        """
+        Deliveries per second.
+        """
+        if not self.elapsed:
+            return 0.0
+        return (self.sent + self.failed) / self.elapsed
+
+    def __aiter__(self):
+        if self._started is not None:
+            raise RuntimeError("Broadcast already started")
+        return self._run()
+
+    async def wait(self):
+        """
+        Run the broadcast to completion.
+
+        Returns:
+            List of :class:`sirbot.plugins.slack.broadcast.BroadcastResult`.
+        """
+        return [result async for result in self]
+
+    async def _run(self):
+        self._started = time.monotonic()
+        if self.get_client is not None:
+            self.api = await self.get_client(self.team)
+
+        results = asyncio.Queue(maxsize=self.concurrency)
+        workers = [
+            asyncio.ensure_future(self._worker(results))
+            for _ in range(self.concurrency)
+        ]
+        running = len(workers)
+        try:
+            while running:
+                result = await results.get()
+                if result is None:
+                    running -= 1
+                else:
+                    yield result
+        finally:
+            self._finished = time.monotonic()
+            for worker in workers:
+                worker.cancel()
+            LOG.debug(
+                "Broadcast finished: %s sent, %s failed, %.1f/s",
+                self.sent,
+                self.failed,
+                self.throughput,
+            )
+
+    async def _worker(self, results):
+        for target in self._targets:
+            result = await self._deliver(target)
+            if result.ok:
+                self.sent += 1
+                self._count("broadcast_sent")
+            else:
+                self.failed += 1
+                self._count("broadcast_failed")
+            await results.put(result)
+        await results.put(None)
+
+    async def _deliver(self, target):
+        try:
+            return await self._deliver_with_retries(target)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            LOG.exception("Broadcast to %s failed", target)
+            return BroadcastResult(target, error=e)
+
+    async def _deliver_with_retries(self, target):
+        data = dict(self.payload, channel=target)
+        attempts = 0
+        while True:
+            attempts += 1
+            delay = self._resume_at - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            try:
+                response = await self.api.query(self.method, data)
+                return BroadcastResult(target, response, attempts=attempts)
+            except RateLimited as e:
+                self._resume_at = max(self._resume_at, time.monotonic() + e.retry_after)
+                self._count("api_rate_limited")
+                retry_delay = 0
+                error = e
+            except HTTPException as e:
+                if e.status < 500:
+                    return BroadcastResult(target, error=e, attempts=attempts)
+                retry_delay = self.backoff * 2 ** (attempts - 1)
+                error = e
+            except SlackAPIError as e:
+                return BroadcastResult(target, error=e, attempts=attempts)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                retry_delay = self.backoff * 2 ** (attempts - 1)
+                error = e
+
+            if attempts > self.max_retries:
+                LOG.warning("Broadcast to %s failed: %s", target, error)
+                return BroadcastResult(target, error=error, attempts=attempts)
+
+            self.retries += 1
+            await asyncio.sleep(retry_delay)
+
+    def _count(self, key):
+        if self.metrics is not None:
+            self.metrics[key] += 1
@@ -1,14 +1,19 @@
 import asyncio
 import logging
+import functools
 
 import aiohttp.web
-from aiohttp.web import Response
+from slack import methods
+from aiohttp.web import Response, json_response
 from slack.events import Event
 from slack.sansio import validate_request_signature
 from slack.actions import Action
 from slack.commands import Command
 from slack.exceptions import InvalidTimestamp, FailedVerification, InvalidSlackSignature
 
+from .teams import team_id
+from ...concurrency import PRIORITY_LOW
+
 LOG = logging.getLogger(__name__)
 
 
@@ -18,54 +23,108 @@ async def incoming_event(request):
     LOG.log(5, "Incoming event payload: %s", payload)
 
     if payload.get("type") == "url_verification":
-        if slack.signing_secret:
-            try:
-                raw_payload = await request.read()
-                validate_request_signature(
-                    raw_payload.decode("utf-8"), request.headers, slack.signing_secret
-                )
-                return Response(body=payload["challenge"])
-            except (InvalidSlackSignature, InvalidTimestamp):
-                return Response(status=500)
-        elif payload["token"] == slack.verify:
-            return Response(body=payload["challenge"])
-        else:
-            return Response(status=500)
+        return await _url_verification(payload, request, slack)
 
     try:
         verification_token = await _validate_request(request, slack)
-        event = Event.from_http(payload, verification_token=verification_token)
+        event = build_event(payload, slack, verification_token)
     except (FailedVerification, InvalidSlackSignature, InvalidTimestamp):
         return Response(status=401)
 
-    if event["type"] == "message":
-        return await _incoming_message(event, request)
-    else:
-        futures = list(_dispatch(slack.routers["event"], event, request.app))
-        if futures:
-            return await _wait_and_check_result(futures)
+    if event is None:
+        return Response(status=200)
+
+    return await dispatch_event(event, request.app)
+
+
+def build_event(payload, slack, verification_token=None):
+    if slack.prefilter and _drop_event(payload, slack, verification_token):
+        return None
+    return Event.from_http(payload, verification_token=verification_token)
+
+
+async def dispatch_event(event, app):
+    team = await _get_team(app.plugins["slack"], event)
+    if team is False:
+        return Response(status=200)
+    elif event["type"] == "message":
+        return await _incoming_message(event, app, team)
+
+    futures = list(_dispatch(app.plugins["slack"].routers["event"], event, app))
+    if futures:
+        return await _wait_and_check_result(futures)
 
     return Response(status=200)
 
 
-async def _incoming_message(event, request):
-    slack = request.app.plugins["slack"]
+async def _url_verification(payload, request, slack):
+    if slack.signing_secret:
+        try:
+            raw_payload = await request.read()
+            validate_request_signature(
+                raw_payload.decode("utf-8"), request.headers, slack.signing_secret
+            )
+            return Response(body=payload["challenge"])
+        except (InvalidSlackSignature, InvalidTimestamp):
+            return Response(status=500)
+    elif payload["token"] == slack.verify:
+        return Response(body=payload["challenge"])
+    else:
+        return Response(status=500)
+
+
+def _drop_event(payload, slack, verification_token):
+    raw_event = payload.get("event", {})
+    if slack.is_routed(raw_event):
+        return False
+
+    if verification_token and payload.get("token") != verification_token:
+        raise FailedVerification(payload.get("token"), payload.get("team_id"))
+
+    LOG.debug(
+        "Dropping unrouted event: %s, %s",
+        raw_event.get("type"),
+        raw_event.get("subtype"),
+    )
+    slack.metrics["prefilter_dropped"] += 1
+    return True
+
+
+async def _get_team(slack, incoming):
+    if slack.teams is None:
+        return None
+
+    team = await slack.get_team(incoming)
+    if team is None:
+        LOG.warning("Dropping event from unknown team: %s", team_id(incoming))
+        slack.metrics["unknown_team"] += 1
+        return False
+    return team
+
 
-    if slack.bot_id and (
-        event.get("bot_id") == slack.bot_id
-        or event.get("message", {}).get("bot_id") == slack.bot_id
+async def _incoming_message(event, app, team=None):
+    slack = app.plugins["slack"]
+    bot_id = team.bot_id if team else slack.bot_id
+    bot_user_id = team.bot_user_id if team else slack.bot_user_id
+
+    if slack.search_index is not None:
+        slack.search_index.handle(event)
+
+    if bot_id and (
+        event.get("bot_id") == bot_id
+        or event.get("message", {}).get("bot_id") == bot_id
     ):
         return Response(status=200)
 
     LOG.debug("Incoming message: %s", event)
     text = event.get("text")
-    if slack.bot_user_id and text:
-        mention = slack.bot_user_id in event["text"] or event["channel"].startswith("D")
+    if bot_user_id and text:
+        mention = bot_user_id in event["text"] or event["channel"].startswith("D")
     else:
         mention = False
 
-    if mention and text and text.startswith(f"<@{slack.bot_user_id}>"):
-        event["text"] = event["text"][len(f"<@{slack.bot_user_id}>") :]
+    if mention and text and text.startswith(f"<@{bot_user_id}>"):
+        event["text"] = event["text"][len(f"<@{bot_user_id}>") :]
         event["text"] = event["text"].strip()
 
     futures = []
@@ -75,7 +134,7 @@ async def _incoming_message(event, request):
         elif configuration["admin"] and event["user"] not in slack.admins:
             continue
 
-        f = asyncio.ensure_future(handler(event, request.app))
+        f = asyncio.ensure_future(_run_handler(handler, configuration, event, app))
         if configuration["wait"]:
             futures.append(f)
         else:
@@ -97,8 +156,15 @@ async def incoming_command(request):
     except (FailedVerification, InvalidSlackSignature, InvalidTimestamp):
         return Response(status=401)
 
+    return await dispatch_command(command, request.app)
+
+
+async def dispatch_command(command, app):
     LOG.debug("Incoming command: %s", command)
-    futures = list(_dispatch(slack.routers["command"], command, request.app))
+    if await _get_team(app.plugins["slack"], command) is False:
+        return Response(status=200)
+
+    futures = list(_dispatch(app.plugins["slack"].routers["command"], command, app))
     if futures:
         return await _wait_and_check_result(futures)
 
@@ -116,9 +182,15 @@ async def incoming_action(request):
     except (FailedVerification, InvalidSlackSignature, InvalidTimestamp):
         return Response(status=401)
 
+    return await dispatch_action(action, request.app)
+
+
+async def dispatch_action(action, app):
     LOG.debug("Incoming action: %s", action)
+    if await _get_team(app.plugins["slack"], action) is False:
+        return Response(status=200)
 
-    futures = list(_dispatch(slack.routers["action"], action, request.app))
+    futures = list(_dispatch(app.plugins["slack"].routers["action"], action, app))
     if futures:
         return await _wait_and_check_result(futures)
 
@@ -134,13 +206,81 @@ def _callback(f):
 
 def _dispatch(router, event, app):
     for handler, configuration in router.dispatch(event):
-        f = asyncio.ensure_future(handler(event, app))
+        f = asyncio.ensure_future(_run_handler(handler, configuration, event, app))
         if configuration["wait"]:
             yield f
         else:
             f.add_done_callback(_callback)
 
 
+async def _run_handler(handler, configuration, event, app):
+    slack = app.plugins["slack"]
+    rate_limit = configuration.get("rate_limit")
+    if rate_limit and not rate_limit.allow(
+        _rate_limit_key(event, configuration["rate_limit_by"])
+    ):
+        LOG.debug("Rate limited handler %s for %s", handler, event)
+        slack.metrics["rate_limited"] += 1
+        return await _slow_down(slack, configuration, event)
+
+    call = functools.partial(handler, event, app)
+
+    if slack.scheduler:
+        priority = configuration.get("priority", PRIORITY_LOW)
+        call = functools.partial(slack.scheduler.run, call, priority=priority)
+
+    if configuration.get("limiter"):
+        call = functools.partial(configuration["limiter"].run, call)
+
+    if configuration.get("cache") is not None:
+        key = (event["command"], event["text"], event.get("team_id"))
+        call = functools.partial(configuration["cache"].call, key, call)
+
+    try:
+        return await call()
+    except asyncio.QueueFull:
+        LOG.warning("Handler %s queue is full, dropping event", handler)
+        slack.metrics["handler_rejected"] += 1
+
+
+def _rate_limit_key(event, fields):
+    key = []
+    for field in fields:
+        if isinstance(event, Command):
+            key.append(event.get(f"{field}_id"))
+        elif field == "team":
+            key.append(event.get("team") or (event.metadata or {}).get("team_id"))
+        elif field == "user":
+            # Bot messages have no user, keep each bot in its own bucket
+            key.append(event.get("user") or event.get("bot_id"))
+        else:
+            key.append(event.get(field))
+    return tuple(key)
+
+
+async def _slow_down(slack, configuration, event):
+    text = configuration.get("rate_limit_message")
+    if not text:
+        return None
+
+    if isinstance(event, Command):
+        if configuration["wait"]:
+            return json_response({"response_type": "ephemeral", "text": text})
+        data = {"channel": event["channel_id"], "user": event["user_id"], "text": text}
+    elif event.get("user"):
+        data = {"channel": event["channel"], "user": event["user"], "text": text}
+    else:
+        # Bot messages have no user to warn
+        return None
+
+    team = await slack.get_team(event)
+    api = team.api if team else slack.api
+    try:
+        await api.query(methods.CHAT_POST_EPHEMERAL, data=data)
+    except Exception as e:
+        LOG.exception(e)
+
+
 async def _wait_and_check_result(futures):
     dones, _ = await asyncio.wait(futures, return_when=asyncio.ALL_COMPLETED)
     try:
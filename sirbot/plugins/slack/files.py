@@ -0,0 +1,106 @@
+import os
+import inspect
+import logging
+
+import aiohttp
+import aiofiles
+from slack import sansio
+
+LOG = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+
+async def upload(
+    session, url, token, file, *, filename=None, chunk_size=CHUNK_SIZE, **data
+):
+    """
+    Upload a file with a chunked multipart request.
+
+    Args:
+        session: Instance of :class:`aiohttp.ClientSession`.
+        url: ``files.upload`` url.
+        token: Slack authentication token.
+        file: File path or async iterable of bytes.
+        filename: Uploaded file name (defaults to the path base name).
+        chunk_size: Size of the chunks read from disk.
+        **data: Other ``files.upload`` arguments.
+
+    Returns:
+        Dictionary of slack API response data.
+    """
+    if isinstance(file, (str, os.PathLike)):
+        filename = filename or os.path.basename(file)
+        file = read_file(file, chunk_size)
+
+    form = aiohttp.FormData()
+    for key, value in data.items():
+        if value is not None:
+            form.add_field(key, str(value))
+    form.add_field("filename", filename or "file")
+    form.add_field(
+        "file",
+        file,
+        filename=filename or "file",
+        content_type="application/octet-stream",
+    )
+
+    async with session.post(
+        url, data=form, headers={"Authorization": f"Bearer {token}"}
+    ) as response:
+        body = await response.read()
+        return sansio.decode_response(response.status, response.headers, body)
+
+
+async def download(session, url, token, destination, *, chunk_size=CHUNK_SIZE):
+    """
+    Stream a private file to disk or to a consumer.
+
+    Args:
+        session: Instance of :class:`aiohttp.ClientSession`.
+        url: File ``url_private`` or ``url_private_download``.
+        token: Slack authentication token.
+        destination: File path, or function / coroutine function called with each chunk.
+        chunk_size: Maximum size of the chunks.
+
+    Returns:
+        Number of downloaded bytes.
+    """
+    async with session.get(
+        url, headers={"Authorization": f"Bearer {token}"}
+    ) as response:
+        response.raise_for_status()
+
+        if isinstance(destination, (str, os.PathLike)):
+            async with aiofiles.open(destination, "wb") as f:
+                return await _consume(response, f.write, chunk_size)
+        return await _consume(response, destination, chunk_size)
+
+
+async def read_file(path, chunk_size=CHUNK_SIZE):
+    """
+    Read a file by chunks without blocking the event loop.
+
+    Args:
+        path: File path.
+        chunk_size: Size of the chunks.
+
+    Yields:
+        Chunks of bytes.
+    """
+    async with aiofiles.open(path, "rb") as f:
+        while True:
+            chunk = await f.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+async def _consume(response, consumer, chunk_size):
+    size = 0
+    async for chunk in response.content.iter_chunked(chunk_size):
+        result = consumer(chunk)
+        if inspect.isawaitable(result):
+            await result
+        size += len(chunk)
+    return size
@@ -0,0 +1,94 @@
+import os
+import json
+import asyncio
+import logging
+
+LOG = logging.getLogger(__name__)
+
+
+class FileMetadataStore:
+    """
+    Store slack workspace metadata in a local JSON file.
+
+    Args:
+        path: JSON file path.
+    """
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+
+    async def load(self, key):
+        loop = asyncio.get_event_loop()
+        data = await loop.run_in_executor(None, self._read)
+        return data.get(key)
+
+    async def save(self, key, metadata):
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, self._write, key, metadata)
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            LOG.warning("Invalid slack metadata file %s, ignoring it", self.path)
+            return {}
+
+    def _write(self, key, metadata):
+        data = self._read()
+        data[key] = metadata
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp, self.path)
+
+
+class PgMetadataStore:
+    """
+    Store slack workspace metadata through :class:`sirbot.plugins.postgres.PgPlugin`.
+
+    The table is created on first use.
+
+    Args:
+        plugin: Name of the postgres plugin.
+        table: Table name.
+    """
+
+    def __init__(self, plugin="pg", table="slack_metadata"):
+        self.plugin = plugin
+        self.table = table
+        self._app = None
+        self._created = False
+
+    def load_app(self, sirbot):
+        self._app = sirbot
+
+    async def load(self, key):
+        async with self._connection() as pg_con:
+            await self._create_table(pg_con)
+            return await pg_con.fetchval(
+                f"""SELECT metadata FROM {self.table} WHERE key = $1""", key
+            )
+
+    async def save(self, key, metadata):
+        async with self._connection() as pg_con:
+            await self._create_table(pg_con)
+            await pg_con.execute(
+                f"""INSERT INTO {self.table} (key, metadata) VALUES ($1, $2)
+                    ON CONFLICT (key) DO UPDATE SET metadata = $2""",
+                key,
+                metadata,
+            )
+
+    def _connection(self):
+        return self._app["plugins"][self.plugin].connection()
+
+    async def _create_table(self, pg_con):
+        if not self._created:
+            await pg_con.execute(
+                f"""CREATE TABLE IF NOT EXISTS {self.table}
+                    (key TEXT PRIMARY KEY, metadata JSONB)"""
+            )
+            self._created = True
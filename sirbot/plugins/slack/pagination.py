@@ -0,0 +1,127 @@
+import asyncio
+import logging
+
+from slack import sansio
+from slack.exceptions import RateLimited
+
+LOG = logging.getLogger(__name__)
+
+
+async def query(api, url, data=None, headers=None, *, max_retries=5, metrics=None):
+    """
+    Query the slack API, waiting and retrying when rate limited.
+
+    Args:
+        api: Instance of :class:`slack.io.abc.SlackAPI`.
+        url: :class:`slack.methods` or url string.
+        data: JSON encodable MutableMapping.
+        headers: Custom headers.
+        max_retries: Maximum number of retries after a rate limited response.
+        metrics: Instance of :class:`collections.Counter`.
+
+    Returns:
+        Dictionary of slack API response data.
+    """
+    attempt = 0
+    while True:
+        try:
+            return await api.query(url, data, headers)
+        except RateLimited as e:
+            if attempt >= max_retries:
+                raise
+            attempt += 1
+            LOG.debug("Rate limited on %s, retrying in %ss", url, e.retry_after)
+            if metrics is not None:
+                metrics["api_rate_limited"] += 1
+            await asyncio.sleep(e.retry_after)
+
+
+async def paginate(
+    api,
+    url,
+    data=None,
+    headers=None,
+    *,
+    limit=200,
+    iterkey=None,
+    itermode=None,
+    prefetch=1,
+    max_retries=5,
+    metrics=None,
+):
+    """
+    Iterate over a slack API method supporting pagination.
+
+    The next page is requested while the current one is processed. At most
+    ``prefetch`` fetched pages are buffered.
+
+    Args:
+        api: Instance of :class:`slack.io.abc.SlackAPI`.
+        url: :class:`slack.methods` or url string.
+        data: JSON encodable MutableMapping.
+        headers: Custom headers.
+        limit: Maximum number of results per page.
+        iterkey: Key in response data to iterate over (required for url string).
+        itermode: Iteration mode (required for url string).
+        prefetch: Maximum number of pages buffered ahead of the caller.
+        max_retries: Maximum number of retries after a rate limited response.
+        metrics: Instance of :class:`collections.Counter`.
+
+    Yields:
+        Items of ``response_data[iterkey]``.
+    """
+    pages = asyncio.Queue(maxsize=prefetch)
+    producer = asyncio.ensure_future(
+        _fetch_pages(
+            pages,
+            api,
+            url,
+            dict(data or {}),
+            headers,
+            limit=limit,
+            iterkey=iterkey,
+            itermode=itermode,
+            max_retries=max_retries,
+            metrics=metrics,
+        )
+    )
+    try:
+        while True:
+            page = await pages.get()
+            if page is None:
+                break
+            elif isinstance(page, Exception):
+                raise page
+
+            for item in page:
+                yield item
+    finally:
+        producer.cancel()
+
+
+async def _fetch_pages(
+    pages, api, url, data, headers, *, limit, iterkey, itermode, **kwargs
+):
+    try:
+        itervalue = None
+        while True:
+            data, iterkey, itermode = sansio.prepare_iter_request(
+                url,
+                dict(data),
+                iterkey=iterkey,
+                itermode=itermode,
+                limit=limit,
+                itervalue=itervalue,
+            )
+            response_data = await query(api, url, data, headers, **kwargs)
+            itervalue = sansio.decode_iter_request(response_data)
+            await pages.put(response_data[iterkey])
+
+            if not itervalue:
+                break
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        await pages.put(e)
+    else:
+        await pages.put(None)
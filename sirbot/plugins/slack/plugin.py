@@ -1,14 +1,28 @@
 import os
+import time
 import asyncio
+import hashlib
 import logging
+from collections import Counter
 
-from slack import methods
+from slack import HOOK_URL, ROOT_URL, methods
 from slack.events import EventRouter, MessageRouter
 from slack.actions import Router as ActionRouter
 from slack.commands import Router as CommandRouter
 from slack.io.aiohttp import SlackAPI
 
-from . import endpoints
+from . import files, endpoints, pagination
+from .teams import Team, TeamRegistry, team_id
+from ...cache import ResultCache
+from .broadcast import Broadcast
+from .socket_mode import SocketModeClient
+from ...concurrency import (
+    PRIORITY_LOW,
+    PRIORITY_HIGH,
+    PRIORITY_NORMAL,
+    PriorityScheduler,
+    ConcurrencyLimiter,
+)
 
 LOG = logging.getLogger(__name__)
 
@@ -30,9 +44,47 @@ class SlackPlugin:
         verify: slack verification token (env var: `SLACK_VERIFY`).
         signing_secret: slack signing secret key (env var: `SLACK_SIGNING_SECRET`).
                         (disables verification token if provided).
+        prefilter: Acknowledge events without a registered handler before building
+                   the event object. Only handlers registered with the ``on_*`` methods
+                   are known to the prefilter.
+        max_handlers: Maximum number of concurrently running handlers. Waiting handlers
+                      are started by priority: commands and actions first, then
+                      mentions, then other messages and events.
+        app_token: slack app level token enabling Socket Mode (env var:
+                   `SLACK_APP_TOKEN`). The HTTP endpoints are only registered when
+                   a verification token or signing secret is also provided.
+        socket_mode_connections: Number of concurrent Socket Mode connections.
+        team_store: Serve multiple workspaces. Coroutine function called with a team
+                    id and returning a mapping with the team ``token`` and optionally
+                    its ``bot_id`` and ``bot_user_id`` (``None`` for unknown teams).
+                    ``token`` is then only used for the default :attr:`api`.
+        max_teams: Maximum number of teams loaded from ``team_store``.
+        metadata_store: Persist the workspace metadata (bot ids and team info) with
+                        :class:`sirbot.plugins.slack.metadata.FileMetadataStore` or
+                        :class:`sirbot.plugins.slack.metadata.PgMetadataStore`. Stored
+                        metadata is loaded at startup and refreshed in the background.
+        metadata_users: Also persist a snapshot of the workspace users.
+        search_index: Index incoming messages in a
+                      :class:`sirbot.plugins.slack.search.MessageIndex`.
+        search_snapshot: Restore ``search_index`` from this file at startup and save it
+                         at shutdown.
 
     **Variables**:
         * **api**: Slack client. Instance of :class:`slack.io.aiohttp.SlackAPI`.
+        * **metrics**: Instance of :class:`collections.Counter`.
+        * **scheduler**: Instance of :class:`sirbot.concurrency.PriorityScheduler`
+          (``None`` without ``max_handlers``).
+        * **socket_mode**: Instance of
+          :class:`sirbot.plugins.slack.socket_mode.SocketModeClient`
+          (``None`` without ``app_token``).
+        * **team_info**: Workspace ``id``, ``name`` and ``url`` (requires
+          ``metadata_store``).
+        * **users**: Workspace users by id (requires ``metadata_users``).
+        * **search_index**: Instance of
+          :class:`sirbot.plugins.slack.search.MessageIndex` (``None`` without
+          ``search_index``).
+        * **teams**: Instance of :class:`sirbot.plugins.slack.teams.TeamRegistry`
+          (``None`` without ``team_store``).
     """
 
     __name__ = "slack"
@@ -45,22 +97,60 @@ class SlackPlugin:
         bot_user_id=None,
         admins=None,
         verify=None,
-        signing_secret=None
+        signing_secret=None,
+        prefilter=False,
+        max_handlers=None,
+        app_token=None,
+        socket_mode_connections=1,
+        team_store=None,
+        max_teams=100,
+        metadata_store=None,
+        metadata_users=False,
+        search_index=None,
+        search_snapshot=None,
     ):
         self.api = None
-        self.token = token or os.environ["SLACK_TOKEN"]
+        self._session = None
+        if team_store:
+            self.token = token or os.environ.get("SLACK_TOKEN")
+        else:
+            self.token = token or os.environ["SLACK_TOKEN"]
         self.admins = admins or os.environ.get("SLACK_ADMINS", [])
+        app_token = app_token or os.environ.get("SLACK_APP_TOKEN")
         if signing_secret or "SLACK_SIGNING_SECRET" in os.environ:
             self.signing_secret = signing_secret or os.environ["SLACK_SIGNING_SECRET"]
             self.verify = None
+        elif app_token:
+            self.verify = verify or os.environ.get("SLACK_VERIFY")
+            self.signing_secret = None
         else:
             self.verify = verify or os.environ["SLACK_VERIFY"]
             self.signing_secret = None
         self.bot_id = bot_id or os.environ.get("SLACK_BOT_ID")
         self.bot_user_id = bot_user_id or os.environ.get("SLACK_BOT_USER_ID")
         self.handlers_option = {}
+        self.prefilter = prefilter
+        self.scheduler = PriorityScheduler(max_handlers) if max_handlers else None
+        self.metrics = Counter()
+        self._routed_events = set()
+        self._routed_subtypes = set()
+        self.teams = None
+        self._team_store = team_store
+        self._max_teams = max_teams
+        self.team_info = None
+        self.users = None
+        self._metadata_store = metadata_store
+        self._metadata_users = metadata_users
+        self._metadata_refresh = None
+        self.search_index = search_index
+        self._search_snapshot = search_snapshot
+        self.socket_mode = None
+        if app_token:
+            self.socket_mode = SocketModeClient(
+                self, app_token, connections=socket_mode_connections
+            )
 
-        if not self.bot_user_id:
+        if not self.bot_user_id and not team_store and not metadata_store:
             LOG.warning(
                 "`SLACK_BOT_USER_ID` not set. It is required for `on mention` routing and discarding "
                 "message coming from Sir Bot-a-lot to avoid loops."
@@ -76,15 +166,46 @@ class SlackPlugin:
     def load(self, sirbot):
         LOG.info("Loading slack plugin")
         self.api = SlackAPI(session=sirbot.http_session, token=self.token)
+        self._session = sirbot.http_session
+        if self._team_store:
+            self.teams = TeamRegistry(
+                self._team_store,
+                sirbot.http_session,
+                max_teams=self._max_teams,
+                metrics=self.metrics,
+            )
 
-        sirbot.router.add_route("POST", "/slack/events", endpoints.incoming_event)
-        sirbot.router.add_route("POST", "/slack/commands", endpoints.incoming_command)
-        sirbot.router.add_route("POST", "/slack/actions", endpoints.incoming_action)
+        if self.signing_secret or self.verify:
+            sirbot.router.add_route("POST", "/slack/events", endpoints.incoming_event)
+            sirbot.router.add_route(
+                "POST", "/slack/commands", endpoints.incoming_command
+            )
+            sirbot.router.add_route("POST", "/slack/actions", endpoints.incoming_action)
+
+        if self.socket_mode:
+            self.socket_mode.load(sirbot)
 
-        if self.bot_user_id and not self.bot_id:
+        if self.search_index is not None and self._search_snapshot:
+            sirbot.on_startup.append(self._restore_search_index)
+            sirbot.on_shutdown.append(self._save_search_index)
+
+        if self._metadata_store:
+            if hasattr(self._metadata_store, "load_app"):
+                self._metadata_store.load_app(sirbot)
+            sirbot.on_startup.append(self.load_metadata)
+            sirbot.on_shutdown.append(self._cancel_metadata_refresh)
+        elif self.bot_user_id and not self.bot_id:
             sirbot.on_startup.append(self.find_bot_id)
 
-    def on_event(self, event_type, handler, wait=True):
+    def on_event(
+        self,
+        event_type,
+        handler,
+        wait=True,
+        max_concurrency=None,
+        queue_size=None,
+        priority=None,
+    ):
         """
         Register handler for an event
 
@@ -92,14 +213,32 @@ class SlackPlugin:
             event_type: Incoming event type.
             handler: Handler to call.
             wait: Wait for handler execution before responding to the slack API.
+            max_concurrency: Maximum number of concurrent executions of the handler.
+            queue_size: Maximum number of executions waiting for ``max_concurrency``.
+            priority: Handler priority when ``max_handlers`` is reached.
         """
 
         if not asyncio.iscoroutinefunction(handler):
             handler = asyncio.coroutine(handler)
-        configuration = {"wait": wait}
+        if priority is None:
+            priority = PRIORITY_LOW
+        configuration = self._configuration(wait, max_concurrency, queue_size, priority)
         self.routers["event"].register(event_type, (handler, configuration))
+        self._routed_events.add(event_type)
 
-    def on_command(self, command, handler, wait=True):
+    def on_command(
+        self,
+        command,
+        handler,
+        wait=True,
+        max_concurrency=None,
+        queue_size=None,
+        priority=None,
+        rate_limit=None,
+        rate_limit_by=("user",),
+        rate_limit_message=None,
+        cache=None,
+    ):
         """
         Register handler for a command
 
@@ -107,14 +246,56 @@ class SlackPlugin:
             command: Incoming command.
             handler: Handler to call.
             wait: Wait for handler execution before responding to the slack API.
+            max_concurrency: Maximum number of concurrent executions of the handler.
+            queue_size: Maximum number of executions waiting for ``max_concurrency``.
+            priority: Handler priority when ``max_handlers`` is reached.
+            rate_limit: Instance of :class:`sirbot.ratelimit.RateLimiter` checked before
+                        running the handler.
+            rate_limit_by: Fields keying the rate limit (``user``, ``channel`` and/or
+                           ``team``).
+            rate_limit_message: Ephemeral message sent to rate limited users.
+            cache: Cache the handler response by command text. ``True``, a time to
+                   live in seconds or an instance of :class:`sirbot.cache.ResultCache`.
+                   Identical concurrent commands share a single handler execution.
         """
         if not asyncio.iscoroutinefunction(handler):
             handler = asyncio.coroutine(handler)
-        configuration = {"wait": wait}
+        if priority is None:
+            priority = PRIORITY_HIGH
+        if isinstance(cache, ResultCache):
+            pass
+        elif cache is True:
+            cache = ResultCache(metrics=self.metrics)
+        elif cache:
+            cache = ResultCache(ttl=cache, metrics=self.metrics)
+        else:
+            cache = None
+        configuration = self._configuration(
+            wait,
+            max_concurrency,
+            queue_size,
+            priority,
+            rate_limit=rate_limit,
+            rate_limit_by=rate_limit_by,
+            rate_limit_message=rate_limit_message,
+            cache=cache,
+        )
         self.routers["command"].register(command, (handler, configuration))
 
     def on_message(
-        self, pattern, handler, mention=False, admin=False, wait=True, **kwargs
+        self,
+        pattern,
+        handler,
+        mention=False,
+        admin=False,
+        wait=True,
+        max_concurrency=None,
+        queue_size=None,
+        priority=None,
+        rate_limit=None,
+        rate_limit_by=("user",),
+        rate_limit_message=None,
+        **kwargs,
     ):
         """
         Register handler for a message
@@ -127,6 +308,14 @@ class SlackPlugin:
             mention: Only trigger handler when the bot is mentioned.
             admin: Only trigger handler if posted by an admin.
             wait: Wait for handler execution before responding to the slack API.
+            max_concurrency: Maximum number of concurrent executions of the handler.
+            queue_size: Maximum number of executions waiting for ``max_concurrency``.
+            priority: Handler priority when ``max_handlers`` is reached.
+            rate_limit: Instance of :class:`sirbot.ratelimit.RateLimiter` checked before
+                        running the handler.
+            rate_limit_by: Fields keying the rate limit (``user``, ``channel`` and/or
+                           ``team``). Bot messages are keyed by ``bot_id``.
+            rate_limit_message: Ephemeral message sent to rate limited users.
         """
         if not asyncio.iscoroutinefunction(handler):
             handler = asyncio.coroutine(handler)
@@ -136,12 +325,35 @@ class SlackPlugin:
                 "Slack admins ids are not set. Admin limited endpoint will not work."
             )
 
-        configuration = {"mention": mention, "admin": admin, "wait": wait}
+        if priority is None:
+            priority = PRIORITY_NORMAL if mention else PRIORITY_LOW
+        configuration = self._configuration(
+            wait,
+            max_concurrency,
+            queue_size,
+            priority,
+            mention=mention,
+            admin=admin,
+            rate_limit=rate_limit,
+            rate_limit_by=rate_limit_by,
+            rate_limit_message=rate_limit_message,
+        )
         self.routers["message"].register(
             pattern=pattern, handler=(handler, configuration), **kwargs
         )
+        self._routed_events.add("message")
+        self._routed_subtypes.add(kwargs.get("subtype"))
 
-    def on_action(self, action, handler, name="*", wait=True):
+    def on_action(
+        self,
+        action,
+        handler,
+        name="*",
+        wait=True,
+        max_concurrency=None,
+        queue_size=None,
+        priority=None,
+    ):
         """
         Register handler for an action
 
@@ -150,13 +362,27 @@ class SlackPlugin:
             handler: Handler to call.
             name: Choice name of the action.
             wait: Wait for handler execution before responding to the slack API.
+            max_concurrency: Maximum number of concurrent executions of the handler.
+            queue_size: Maximum number of executions waiting for ``max_concurrency``.
+            priority: Handler priority when ``max_handlers`` is reached.
         """
         if not asyncio.iscoroutinefunction(handler):
             handler = asyncio.coroutine(handler)
-        configuration = {"wait": wait}
+        if priority is None:
+            priority = PRIORITY_HIGH
+        configuration = self._configuration(wait, max_concurrency, queue_size, priority)
         self.routers["action"].register(action, (handler, configuration), name)
 
-    def on_block(self, block_id, handler, action_id="*", wait=True):
+    def on_block(
+        self,
+        block_id,
+        handler,
+        action_id="*",
+        wait=True,
+        max_concurrency=None,
+        queue_size=None,
+        priority=None,
+    ):
         """
         Register handler for a `block_actions` type action
 
@@ -165,17 +391,30 @@ class SlackPlugin:
             handler: Handler to call.
             action_id: `action_id` of the incoming action
             wait: Wait for handler execution before responding to the slack API.
+            max_concurrency: Maximum number of concurrent executions of the handler.
+            queue_size: Maximum number of executions waiting for ``max_concurrency``.
+            priority: Handler priority when ``max_handlers`` is reached.
         """
 
         if not asyncio.iscoroutinefunction(handler):
             handler = asyncio.coroutine(handler)
 
-        configuration = {"wait": wait}
+        if priority is None:
+            priority = PRIORITY_HIGH
+        configuration = self._configuration(wait, max_concurrency, queue_size, priority)
         self.routers["action"].register_block_action(
             block_id, (handler, configuration), action_id
         )
 
-    def on_dialog_submission(self, callback_id, handler, wait=True):
+    def on_dialog_submission(
+        self,
+        callback_id,
+        handler,
+        wait=True,
+        max_concurrency=None,
+        queue_size=None,
+        priority=None,
+    ):
         """
         Register handler for a `dialog_submission` type action
 
@@ -183,16 +422,414 @@ class SlackPlugin:
             callback_id: `callback_id` of the incoming action.
             handler: Handler to call.
             wait: Wait for handler execution before responding to the slack API.
+            max_concurrency: Maximum number of concurrent executions of the handler.
+            queue_size: Maximum number of executions waiting for ``max_concurrency``.
+            priority: Handler priority when ``max_handlers`` is reached.
         """
 
         if not asyncio.iscoroutinefunction(handler):
             handler = asyncio.coroutine(handler)
 
-        configuration = {"wait": wait}
+        if priority is None:
+            priority = PRIORITY_HIGH
+        configuration = self._configuration(wait, max_concurrency, queue_size, priority)
         self.routers["action"].register_dialog_submission(
             callback_id, (handler, configuration)
         )
 
+    def _configuration(self, wait, max_concurrency, queue_size, priority, **kwargs):
+        if max_concurrency:
+            limiter = ConcurrencyLimiter(max_concurrency, queue_size)
+        else:
+            limiter = None
+        return {"wait": wait, "limiter": limiter, "priority": priority, **kwargs}
+
+    def is_routed(self, event):
+        """
+        Check if a raw event has registered handlers
+
+        A message handler registered without subtype receives messages of any subtype.
+
+        Args:
+            event: Raw event from the event API payload.
+        """
+        event_type = event.get("type")
+        if event_type == "message" and self.search_index is not None:
+            return True
+        elif event_type not in self._routed_events:
+            return False
+        elif event_type == "message":
+            return (
+                None in self._routed_subtypes
+                or event.get("subtype") in self._routed_subtypes
+            )
+        return True
+
+    async def paginate(
+        self,
+        url,
+        data=None,
+        *,
+        team=None,
+        limit=200,
+        iterkey=None,
+        itermode=None,
+        prefetch=1,
+        max_retries=5,
+    ):
+        """
+        Iterate over a slack API method supporting pagination
+
+        The next page is requested while the current one is processed and rate
+        limited requests are retried after the ``Retry-After`` delay.
+
+        .. code-block:: python
+
+            async for member in slack.paginate(methods.USERS_LIST):
+                ...
+
+        Args:
+            url: :class:`slack.methods` or url string.
+            data: JSON encodable MutableMapping.
+            team: Team, team id or incoming event, command or action to query the
+                  workspace of (see :meth:`get_team`).
+            limit: Maximum number of results per page.
+            iterkey: Key in response data to iterate over (required for url string).
+            itermode: Iteration mode (required for url string).
+            prefetch: Maximum number of pages buffered ahead of the caller.
+            max_retries: Maximum number of retries after a rate limited response.
+
+        Yields:
+            Items of ``response_data[iterkey]``.
+        """
+        api, _ = await self._client(team)
+        items = pagination.paginate(
+            api,
+            url,
+            data,
+            limit=limit,
+            iterkey=iterkey,
+            itermode=itermode,
+            prefetch=prefetch,
+            max_retries=max_retries,
+            metrics=self.metrics,
+        )
+        try:
+            async for item in items:
+                yield item
+        finally:
+            await items.aclose()
+
+    async def paginate_to(self, callback, url, data=None, **kwargs):
+        """
+        Call ``callback`` with each item of a slack API method supporting pagination
+
+        Args:
+            callback: Function or coroutine function called with each item.
+            url: :class:`slack.methods` or url string.
+            data: JSON encodable MutableMapping.
+            **kwargs: Options of :meth:`paginate`.
+
+        Returns:
+            Number of items.
+        """
+        count = 0
+        async for item in self.paginate(url, data, **kwargs):
+            result = callback(item)
+            if asyncio.iscoroutine(result):
+                await result
+            count += 1
+        return count
+
+    async def get_team(self, team):
+        """
+        Get a team of a multi-workspace plugin
+
+        .. code-block:: python
+
+            async def handler(event, app):
+                team = await app.plugins["slack"].get_team(event)
+                await team.api.query(methods.CHAT_POST_MESSAGE, data={...})
+
+        Args:
+            team: Team id or incoming event, command or action.
+
+        Returns:
+            Instance of :class:`sirbot.plugins.slack.teams.Team` or ``None`` for
+            unknown teams and single workspace plugins.
+        """
+        if self.teams is None:
+            return None
+        return await self.teams.get(team_id(team))
+
+    async def _client(self, team):
+        """
+        Slack client and token of a team, the plugin ones without ``team``.
+        """
+        if team is None:
+            return self.api, self.token
+        elif not isinstance(team, Team):
+            resolved = await self.get_team(team)
+            if resolved is None and self.teams is not None:
+                raise LookupError(f"Unknown team: {team_id(team)}")
+            elif resolved is None:
+                return self.api, self.token
+            team = resolved
+        return team.api, team.token
+
+    async def _team_api(self, team):
+        api, _ = await self._client(team)
+        return api
+
+    async def query_template(
+        self, template, url=methods.CHAT_POST_MESSAGE, team=None, **values
+    ):
+        """
+        Query the slack API with a pre-serialized template
+
+        The rendered template is always sent as JSON.
+
+        Args:
+            template: Instance of :class:`sirbot.plugins.slack.templates.Template`.
+            url: :class:`slack.methods`, method url or incoming webhook url.
+            team: Team, team id or incoming event, command or action to query the
+                  workspace of (see :meth:`get_team`).
+            **values: Template placeholders values.
+
+        Returns:
+            Dictionary of slack API response data.
+
+        Raises:
+            :class:`ValueError`: when ``url`` is neither a slack method nor an
+                incoming webhook.
+        """
+        method = _method(url)
+        if not isinstance(method, methods) and not method.startswith(HOOK_URL):
+            raise ValueError(f"Unknown slack method, can not send it as JSON: {url}")
+
+        api, _ = await self._client(team)
+        return await api.query(method, data=template.message(**values), as_json=True)
+
+    async def upload_file(
+        self,
+        file,
+        *,
+        filename=None,
+        channels=None,
+        title=None,
+        initial_comment=None,
+        thread_ts=None,
+        url=methods.FILES_UPLOAD,
+        team=None,
+    ):
+        """
+        Upload a file without loading it in memory
+
+        The file is streamed from disk, or from an async iterator, as a chunked
+        multipart request.
+
+        Args:
+            file: File path or async iterable of bytes.
+            filename: Uploaded file name (defaults to the path base name).
+            channels: Comma separated list of channel ids to share the file in.
+            title: File title.
+            initial_comment: Message text introducing the file.
+            thread_ts: Parent message timestamp to upload the file in a thread.
+            url: :class:`slack.methods` or url string.
+            team: Team, team id or incoming event, command or action to upload the
+                  file to (see :meth:`get_team`).
+
+        Returns:
+            Dictionary of slack API response data.
+        """
+        _, token = await self._client(team)
+        return await files.upload(
+            self._session,
+            _method_url(url),
+            token,
+            file,
+            filename=filename,
+            channels=channels,
+            title=title,
+            initial_comment=initial_comment,
+            thread_ts=thread_ts,
+        )
+
+    async def download_file(self, url, destination, *, team=None):
+        """
+        Stream a private file to disk or to a consumer
+
+        Args:
+            url: File ``url_private`` or ``url_private_download``.
+            destination: File path, or function / coroutine function called with
+                         each chunk.
+            team: Team, team id or incoming event, command or action owning the
+                  file (see :meth:`get_team`).
+
+        Returns:
+            Number of downloaded bytes.
+        """
+        _, token = await self._client(team)
+        return await files.download(self._session, url, token, destination)
+
+    def broadcast(
+        self,
+        targets,
+        payload,
+        *,
+        method=methods.CHAT_POST_MESSAGE,
+        team=None,
+        concurrency=10,
+        max_retries=3,
+        backoff=1,
+    ):
+        """
+        Deliver a payload to many channels or users
+
+        .. code-block:: python
+
+            broadcast = slack.broadcast(channels, {"text": "Hello world"})
+            async for result in broadcast:
+                if not result.ok:
+                    LOG.warning("Failed to post to %s", result.target)
+            LOG.info("Posted at %.1f messages/s", broadcast.throughput)
+
+        Args:
+            targets: Iterable of channel or user ids.
+            payload: API method data, the target is set as ``channel``.
+            method: :class:`slack.methods` or url string.
+            team: Team, team id or incoming event, command or action to deliver in
+                  (see :meth:`get_team`). The team is resolved when the broadcast
+                  starts.
+            concurrency: Maximum number of concurrent deliveries.
+            max_retries: Maximum number of retries of a delivery.
+            backoff: Delay in seconds before the first retry.
+
+        Returns:
+            Instance of :class:`sirbot.plugins.slack.broadcast.Broadcast`.
+        """
+        return Broadcast(
+            self.api,
+            targets,
+            payload,
+            method=method,
+            team=team,
+            get_client=self._team_api if team is not None else None,
+            concurrency=concurrency,
+            max_retries=max_retries,
+            backoff=backoff,
+            metrics=self.metrics,
+        )
+
+    async def backfill_search_index(self, channel, oldest=None):
+        """
+        Index the history of a channel
+
+        Args:
+            channel: Channel id.
+            oldest: Only index messages after this timestamp (defaults to the index
+                    ``max_age``).
+
+        Returns:
+            Number of indexed messages.
+        """
+        if oldest is None and self.search_index.max_age:
+            oldest = time.time() - self.search_index.max_age
+
+        data = {"channel": channel}
+        if oldest:
+            data["oldest"] = str(oldest)
+
+        count = 0
+        async for message in self.paginate(methods.CONVERSATIONS_HISTORY, data):
+            self.search_index.handle(dict(message, channel=channel))
+            count += 1
+        return count
+
+    async def _restore_search_index(self, app):
+        if os.path.exists(self._search_snapshot):
+            loop = asyncio.get_event_loop()
+            await loop.run_in_executor(
+                None, self.search_index.restore, self._search_snapshot
+            )
+
+    async def _save_search_index(self, app):
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, self.search_index.save, self._search_snapshot)
+
+    async def load_metadata(self, app):
+        """
+        Load the stored workspace metadata
+
+        The metadata is refreshed in the background, or before returning when
+        nothing is stored yet.
+        """
+        try:
+            metadata = await self._metadata_store.load(self._metadata_key())
+        except Exception as e:
+            LOG.exception(e)
+            metadata = None
+
+        if metadata:
+            self.bot_id = self.bot_id or metadata.get("bot_id")
+            self.bot_user_id = self.bot_user_id or metadata.get("bot_user_id")
+            self._set_metadata(metadata)
+            self._metadata_refresh = asyncio.ensure_future(self._refresh_metadata())
+        else:
+            await self.refresh_metadata()
+
+    async def refresh_metadata(self):
+        """
+        Fetch the workspace metadata from slack and store it
+
+        Returns:
+            Workspace metadata.
+        """
+        rep = await self.api.query(methods.AUTH_TEST)
+        metadata = {
+            "bot_id": rep.get("bot_id"),
+            "bot_user_id": rep.get("user_id"),
+            "team": {
+                "id": rep.get("team_id"),
+                "name": rep.get("team"),
+                "url": rep.get("url"),
+            },
+        }
+        if not metadata["bot_id"] and metadata["bot_user_id"]:
+            rep = await self.api.query(
+                url=methods.USERS_INFO, data={"user": metadata["bot_user_id"]}
+            )
+            metadata["bot_id"] = rep["user"]["profile"].get("bot_id")
+
+        if self._metadata_users:
+            metadata["users"] = [
+                user async for user in self.paginate(methods.USERS_LIST)
+            ]
+
+        self.bot_id = metadata["bot_id"] or self.bot_id
+        self.bot_user_id = metadata["bot_user_id"] or self.bot_user_id
+        self._set_metadata(metadata)
+        await self._metadata_store.save(self._metadata_key(), metadata)
+        return metadata
+
+    async def _refresh_metadata(self):
+        try:
+            await self.refresh_metadata()
+        except Exception as e:
+            LOG.exception(e)
+
+    async def _cancel_metadata_refresh(self, app):
+        if self._metadata_refresh and not self._metadata_refresh.done():
+            self._metadata_refresh.cancel()
+
+    def _set_metadata(self, metadata):
+        self.team_info = metadata.get("team")
+        if "users" in metadata:
+            self.users = {user["id"]: user for user in metadata["users"]}
+
+    def _metadata_key(self):
+        return hashlib.sha256((self.token or "").encode("utf-8")).hexdigest()[:16]
+
     async def find_bot_id(self, app):
         rep = await self.api.query(
             url=methods.USERS_INFO, data={"user": self.bot_user_id}
@@ -202,3 +839,21 @@ class SlackPlugin:
             '`SLACK_BOT_ID` not set. For a faster start time set it to: "%s"',
             self.bot_id,
         )
+
+
+def _method(url):
+    # Method urls are only sent as JSON when given as a :class:`slack.methods`
+    if isinstance(url, str):
+        url = _method_url(url)
+        for method in methods:
+            if method.value[0] == url:
+                return method
+    return url
+
+
+def _method_url(url):
+    if isinstance(url, methods):
+        return url.value[0]
+    elif url.startswith(("http://", "https://")):
+        return url
+    return ROOT_URL + url
@@ -0,0 +1,216 @@
+import os
+import re
+import gzip
+import json
+import time
+import heapq
+import logging
+
+LOG = logging.getLogger(__name__)
+
+TOKEN_RE = re.compile(r"\w+")
+QUERY_RE = re.compile(r'"([^"]*)"|(\S+)')
+INDEXED_SUBTYPES = (None, "bot_message", "me_message", "thread_broadcast", "file_share")
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower())
+
+
+class MessageIndex:
+    """
+    In-memory inverted index of slack messages.
+
+    Messages are indexed by token with their positions to answer keyword and
+    ``"quoted phrase"`` queries. Edited messages are re-indexed and deleted
+    messages removed. Messages older than ``max_age`` seconds, or the oldest ones
+    beyond ``max_messages``, are evicted.
+
+    Args:
+        max_age: Maximum message age in seconds.
+        max_messages: Maximum number of indexed messages.
+    """
+
+    def __init__(self, max_age=None, max_messages=None):
+        self.max_age = max_age
+        self.max_messages = max_messages
+
+        self._postings = {}
+        self._documents = {}
+        self._ids = {}
+        self._ages = []
+        self._next_id = 0
+
+    def __len__(self):
+        return len(self._documents)
+
+    def __contains__(self, message):
+        return message in self._ids
+
+    def handle(self, event):
+        """
+        Update the index with a ``message`` event.
+        """
+        subtype = event.get("subtype")
+        if subtype == "message_deleted":
+            self.remove(event["channel"], event["deleted_ts"])
+        elif subtype == "message_changed":
+            message = event["message"]
+            self.add(
+                event["channel"],
+                message["ts"],
+                message.get("text") or "",
+                message.get("user"),
+            )
+        elif subtype in INDEXED_SUBTYPES and "ts" in event:
+            self.add(
+                event["channel"],
+                event["ts"],
+                event.get("text") or "",
+                event.get("user"),
+            )
+
+    def add(self, channel, ts, text, user=None):
+        """
+        Index a message, replacing any previous version.
+        """
+        if (channel, ts) in self._ids:
+            self.remove(channel, ts)
+
+        doc_id = self._next_id
+        self._next_id += 1
+
+        positions = {}
+        for position, token in enumerate(tokenize(text)):
+            positions.setdefault(token, []).append(position)
+        for token, token_positions in positions.items():
+            self._postings.setdefault(token, {})[doc_id] = tuple(token_positions)
+
+        self._documents[doc_id] = (channel, ts, user, text)
+        self._ids[(channel, ts)] = doc_id
+        heapq.heappush(self._ages, (float(ts), doc_id))
+        self.evict()
+
+    def remove(self, channel, ts):
+        """
+        Remove a message from the index.
+
+        Returns:
+            ``True`` if the message was indexed.
+        """
+        doc_id = self._ids.get((channel, ts))
+        if doc_id is None:
+            return False
+
+        self._remove(doc_id)
+        return True
+
+    def evict(self, now=None):
+        """
+        Remove messages older than ``max_age`` or beyond ``max_messages``.
+        """
+        oldest = None
+        if self.max_age:
+            oldest = (now or time.time()) - self.max_age
+
+        while self._ages:
+            ts, doc_id = self._ages[0]
+            if doc_id not in self._documents:
+                heapq.heappop(self._ages)
+            elif (oldest and ts < oldest) or (
+                self.max_messages and len(self._documents) > self.max_messages
+            ):
+                heapq.heappop(self._ages)
+                self._remove(doc_id)
+            else:
+                break
+
+        # Edits and deletes leave stale entries behind
+        if len(self._ages) > 2 * len(self._documents) + 100:
+            self._ages = [
+                (age, doc_id) for age, doc_id in self._ages if doc_id in self._documents
+            ]
+            heapq.heapify(self._ages)
+
+    def search(self, query, channel=None, limit=20):
+        """
+        Find the messages matching all the keywords and phrases of ``query``.
+
+        Args:
+            query: Keywords and ``"quoted phrases"``.
+            channel: Only search in this channel.
+            limit: Maximum number of results.
+
+        Returns:
+            Matching messages, newest first, as dictionaries with ``channel``,
+            ``ts``, ``user`` and ``text`` keys.
+        """
+        phrases = []
+        for phrase, word in QUERY_RE.findall(query):
+            tokens = tokenize(phrase or word)
+            if tokens:
+                phrases.append(tokens)
+        if not phrases:
+            return []
+
+        tokens = {token for phrase in phrases for token in phrase}
+        postings = sorted((self._postings.get(token, {}) for token in tokens), key=len)
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            candidates.intersection_update(posting)
+
+        results = []
+        for doc_id in candidates:
+            document = self._documents[doc_id]
+            if channel and document[0] != channel:
+                continue
+            if all(self._has_phrase(doc_id, phrase) for phrase in phrases):
+                results.append(document)
+
+        results.sort(key=lambda document: float(document[1]), reverse=True)
+        return [
+            {"channel": channel, "ts": ts, "user": user, "text": text}
+            for channel, ts, user, text in results[:limit]
+        ]
+
+    def save(self, path):
+        """
+        Snapshot the indexed messages to a gzip compressed JSONL file.
+        """
+        tmp = f"{path}.tmp"
+        with gzip.open(tmp, "wt", encoding="utf-8") as f:
+            for document in self._documents.values():
+                f.write(json.dumps(document) + "\n")
+        os.replace(tmp, path)
+
+    def restore(self, path):
+        """
+        Index the messages of a snapshot.
+        """
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    channel, ts, user, text = json.loads(line)
+                    self.add(channel, ts, text, user)
+        LOG.debug("Restored %s messages from %s", len(self), path)
+
+    def _has_phrase(self, doc_id, phrase):
+        if len(phrase) == 1:
+            return True
+
+        starts = self._postings[phrase[0]][doc_id]
+        for offset, token in enumerate(phrase[1:], 1):
+            positions = set(self._postings[token][doc_id])
+            starts = [start for start in starts if start + offset in positions]
+            if not starts:
+                return False
+        return True
+
+    def _remove(self, doc_id):
+        channel, ts, _, text = self._documents.pop(doc_id)
+        del self._ids[(channel, ts)]
+        for token in set(tokenize(text)):
+            posting = self._postings[token]
+            del posting[doc_id]
+            if not posting:
+                del self._postings[token]
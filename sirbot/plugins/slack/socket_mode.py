@@ -0,0 +1,166 @@
+import json
+import asyncio
+import logging
+
+import aiohttp
+from slack.actions import Action
+from slack.commands import Command
+
+from . import endpoints
+
+LOG = logging.getLogger(__name__)
+
+OPEN_URL = "https://slack.com/api/apps.connections.open"
+
+
+class SocketModeClient:
+    """
+    Receive slack events, commands and actions over Socket Mode websockets.
+
+    Incoming envelopes are dispatched to the same handlers as the HTTP endpoints and
+    acknowledged with the handlers response. Each connection reconnects with an
+    exponential backoff when it is closed.
+
+    Args:
+        plugin: Instance of :class:`sirbot.plugins.slack.SlackPlugin`.
+        app_token: Slack app level token (``xapp-``).
+        connections: Number of concurrent websocket connections.
+        url: Websocket url, skips ``apps.connections.open`` when set.
+        heartbeat: Websocket ping interval in seconds.
+        max_backoff: Maximum delay between reconnection attempts in seconds.
+
+    **Variables**:
+        * **connected**: Number of open websocket connections.
+    """
+
+    def __init__(
+        self,
+        plugin,
+        app_token,
+        *,
+        connections=1,
+        url=None,
+        heartbeat=30,
+        max_backoff=60,
+    ):
+        self.plugin = plugin
+        self.app_token = app_token
+        self.connections = connections
+        self.url = url
+        self.heartbeat = heartbeat
+        self.max_backoff = max_backoff
+        self.connected = 0
+
+        self._app = None
+        self._tasks = []
+
+    def load(self, sirbot):
+        sirbot.on_startup.append(self.start)
+        sirbot.on_shutdown.append(self.stop)
+
+    async def start(self, sirbot):
+        self._app = sirbot
+        self._tasks = [
+            asyncio.ensure_future(self._connection()) for _ in range(self.connections)
+        ]
+
+    async def stop(self, sirbot):
+        for task in self._tasks:
+            task.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _open(self):
+        if self.url:
+            return self.url
+
+        async with self._app.http_session.post(
+            OPEN_URL, headers={"Authorization": f"Bearer {self.app_token}"}
+        ) as response:
+            data = await response.json()
+
+        if not data.get("ok"):
+            raise ConnectionError(f"apps.connections.open failed: {data.get('error')}")
+        return data["url"]
+
+    async def _connection(self):
+        backoff = 1
+        while True:
+            try:
+                url = await self._open()
+                async with self._app.http_session.ws_connect(
+                    url, heartbeat=self.heartbeat
+                ) as ws:
+                    self.connected += 1
+                    backoff = 1
+                    try:
+                        await self._receive(ws)
+                    finally:
+                        self.connected -= 1
+                LOG.debug("Socket mode connection closed, reconnecting")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                LOG.warning("Socket mode connection failed: %s", e)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+
+    async def _receive(self, ws):
+        pending = set()
+        try:
+            async for message in ws:
+                if message.type != aiohttp.WSMsgType.TEXT:
+                    continue
+
+                envelope = json.loads(message.data)
+                if envelope.get("type") == "disconnect":
+                    LOG.debug("Socket mode disconnect: %s", envelope.get("reason"))
+                    break
+                if "envelope_id" not in envelope:
+                    continue
+
+                task = asyncio.ensure_future(self._handle(ws, envelope))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+        finally:
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
+    async def _handle(self, ws, envelope):
+        self.plugin.metrics["socket_mode_envelopes"] += 1
+        try:
+            response = await self._dispatch(envelope)
+        except Exception as e:
+            LOG.exception(e)
+            response = None
+
+        ack = {"envelope_id": envelope["envelope_id"]}
+        if envelope.get("accepts_response_payload"):
+            payload = _response_payload(response)
+            if payload is not None:
+                ack["payload"] = payload
+
+        if not ws.closed:
+            await ws.send_str(json.dumps(ack))
+
+    async def _dispatch(self, envelope):
+        payload = envelope.get("payload", {})
+        if envelope["type"] == "events_api":
+            event = endpoints.build_event(payload, self.plugin)
+            if event is None:
+                return None
+            return await endpoints.dispatch_event(event, self._app)
+        elif envelope["type"] == "slash_commands":
+            return await endpoints.dispatch_command(Command(payload), self._app)
+        elif envelope["type"] == "interactive":
+            return await endpoints.dispatch_action(Action(payload), self._app)
+
+        LOG.debug("Unhandled socket mode envelope type: %s", envelope["type"])
+        return None
+
+
+def _response_payload(response):
+    if response is None or response.content_type != "application/json":
+        return None
+    return json.loads(response.body)
@@ -0,0 +1,131 @@
+import asyncio
+import logging
+from collections import OrderedDict
+
+from slack import methods
+from slack.events import Event
+from slack.actions import Action
+from slack.commands import Command
+from slack.io.aiohttp import SlackAPI
+
+LOG = logging.getLogger(__name__)
+
+
+class Team:
+    """
+    Slack workspace served by a multi-workspace :class:`sirbot.plugins.slack.SlackPlugin`.
+
+    **Variables**:
+        * **id**: Team id.
+        * **token**: Slack authentication token of the team.
+        * **bot_id**: Bot id in the team.
+        * **bot_user_id**: User id of the bot in the team.
+        * **api**: Slack client of the team. Instance of :class:`slack.io.aiohttp.SlackAPI`.
+    """
+
+    def __init__(self, id, token, session, bot_id=None, bot_user_id=None):
+        self.id = id
+        self.token = token
+        self.bot_id = bot_id
+        self.bot_user_id = bot_user_id
+        self.api = SlackAPI(session=session, token=token)
+
+    def __repr__(self):
+        return f"<Team {self.id}>"
+
+
+class TeamRegistry:
+    """
+    Lazily loaded and size bounded registry of :class:`Team`.
+
+    Teams are loaded from ``store`` on first use, concurrent loads of the same team
+    share a single store call. The least recently used team is evicted when more
+    than ``max_teams`` are loaded.
+
+    Args:
+        store: Coroutine function called with a team id and returning a mapping with
+               a ``token`` and optionally ``bot_id`` / ``bot_user_id``, or ``None``
+               for unknown teams.
+        session: Instance of :class:`aiohttp.ClientSession` shared by the teams clients.
+        max_teams: Maximum number of loaded teams.
+        metrics: Instance of :class:`collections.Counter`.
+    """
+
+    def __init__(self, store, session, max_teams=100, metrics=None):
+        self.store = store
+        self.session = session
+        self.max_teams = max_teams
+        self.metrics = metrics
+        self._teams = OrderedDict()
+        self._loading = {}
+
+    def __contains__(self, team_id):
+        return team_id in self._teams
+
+    def __len__(self):
+        return len(self._teams)
+
+    async def get(self, team_id):
+        """
+        Get a team, loading it from the store if needed.
+
+        Returns:
+            Instance of :class:`Team` or ``None`` for unknown teams.
+        """
+        team = self._teams.get(team_id)
+        if team is not None:
+            self._teams.move_to_end(team_id)
+            return team
+
+        if team_id not in self._loading:
+            self._loading[team_id] = asyncio.ensure_future(self._load(team_id))
+        return await asyncio.shield(self._loading[team_id])
+
+    def evict(self, team_id):
+        """
+        Drop a loaded team, it is reloaded from the store on next use.
+        """
+        self._teams.pop(team_id, None)
+
+    async def _load(self, team_id):
+        try:
+            data = await self.store(team_id)
+            if not data:
+                return None
+
+            team = Team(
+                team_id,
+                data["token"],
+                self.session,
+                bot_id=data.get("bot_id"),
+                bot_user_id=data.get("bot_user_id"),
+            )
+            if not team.bot_id or not team.bot_user_id:
+                rep = await team.api.query(methods.AUTH_TEST)
+                team.bot_id = team.bot_id or rep.get("bot_id")
+                team.bot_user_id = team.bot_user_id or rep.get("user_id")
+
+            self._teams[team_id] = team
+            if self.metrics is not None:
+                self.metrics["team_loaded"] += 1
+            while len(self._teams) > self.max_teams:
+                evicted, _ = self._teams.popitem(last=False)
+                LOG.debug("Evicting team %s", evicted)
+                if self.metrics is not None:
+                    self.metrics["team_evicted"] += 1
+            return team
+        finally:
+            del self._loading[team_id]
+
+
+def team_id(incoming):
+    """
+    Find the team id of an incoming event, command or action.
+    """
+    if isinstance(incoming, Event):
+        return (incoming.metadata or {}).get("team_id") or incoming.get("team")
+    elif isinstance(incoming, Command):
+        return incoming.get("team_id")
+    elif isinstance(incoming, Action):
+        return incoming.get("team", {}).get("id")
+    return incoming
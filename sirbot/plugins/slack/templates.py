@@ -0,0 +1,155 @@
+import json
+from string import Formatter
+
+from slack.events import Message
+
+
+class Value:
+    """
+    Placeholder for a whole JSON value of a :class:`Template`.
+
+    Args:
+        name: Placeholder name.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return f"<Value {self.name}>"
+
+
+class Template:
+    """
+    Message layout compiled once into pre-serialized JSON.
+
+    ``{name}`` fields in strings are replaced by the escaped text of the value and
+    :class:`Value` placeholders by the JSON encoding of the value. Literal braces
+    are written ``{{`` and ``}}``. Rendering only encodes the placeholder values and
+    joins them with the pre-serialized parts.
+
+    .. code-block:: python
+
+        ALERT = Template(
+            {
+                "channel": "{channel}",
+                "blocks": [
+                    {"type": "section", "text": {"type": "mrkdwn", "text": "*{title}*"}},
+                    Value("fields"),
+                ],
+            }
+        )
+
+        body = ALERT.render(channel="C00000A00", title="Down", fields={...})
+
+    Args:
+        layout: JSON encodable layout with placeholders.
+
+    **Variables**:
+        * **fields**: Names of the placeholders.
+    """
+
+    def __init__(self, layout):
+        parts = []
+        _compile(layout, parts)
+
+        self._parts = []
+        self._fields = []
+        for part in parts:
+            if isinstance(part, str):
+                if self._parts and isinstance(self._parts[-1], str):
+                    self._parts[-1] += part
+                else:
+                    self._parts.append(part)
+            else:
+                self._fields.append((len(self._parts),) + part)
+                self._parts.append(None)
+
+        self.fields = {name for _, name, _ in self._fields}
+
+    def render(self, **values):
+        """
+        Fill the placeholders.
+
+        Raises:
+            :class:`KeyError`: when a placeholder value is missing.
+
+        Returns:
+            JSON encoded request body.
+        """
+        parts = list(self._parts)
+        for index, name, encode in self._fields:
+            parts[index] = encode(values[name])
+        return "".join(parts)
+
+    def message(self, **values):
+        """
+        Fill the placeholders into a message accepted by
+        :meth:`slack.io.abc.SlackAPI.query`.
+
+        Returns:
+            Instance of :class:`sirbot.plugins.slack.templates.RenderedMessage`.
+        """
+        return RenderedMessage(self.render(**values))
+
+
+class RenderedMessage(Message):
+    """
+    :class:`slack.events.Message` sent with a pre-serialized JSON body.
+
+    Args:
+        body: JSON encoded request body.
+    """
+
+    def __init__(self, body):
+        super().__init__()
+        self.body = body
+
+    def to_json(self):
+        return self.body
+
+
+def _compile(node, parts):
+    if isinstance(node, Value):
+        parts.append((node.name, json.dumps))
+    elif isinstance(node, dict):
+        _compile_dict(node, parts)
+    elif isinstance(node, (list, tuple)):
+        _compile_list(node, parts)
+    elif isinstance(node, str):
+        _compile_str(node, parts)
+    else:
+        parts.append(json.dumps(node))
+
+
+def _compile_dict(node, parts):
+    parts.append("{")
+    for i, (key, value) in enumerate(node.items()):
+        if i:
+            parts.append(", ")
+        parts.append(json.dumps(key) + ": ")
+        _compile(value, parts)
+    parts.append("}")
+
+
+def _compile_list(node, parts):
+    parts.append("[")
+    for i, value in enumerate(node):
+        if i:
+            parts.append(", ")
+        _compile(value, parts)
+    parts.append("]")
+
+
+def _compile_str(node, parts):
+    parts.append('"')
+    for literal, field, _, _ in Formatter().parse(node):
+        if literal:
+            parts.append(_escape(literal))
+        if field is not None:
+            parts.append((field, _escape))
+    parts.append('"')
+
+
+def _escape(value):
+    return json.dumps(str(value))[1:-1]
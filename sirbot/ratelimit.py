@@ -0,0 +1,53 @@
+import time
+from collections import OrderedDict
+
+
+class RateLimiter:
+    """
+    Token bucket rate limiter with one bucket per key.
+
+    Each bucket holds up to ``burst`` tokens and is refilled at ``rate`` tokens per
+    second. Only the ``max_keys`` most recently used buckets are kept.
+
+    Args:
+        rate: Number of allowed calls per second and per key.
+        burst: Number of calls allowed in a burst.
+        max_keys: Maximum number of tracked keys.
+
+    **Variables**:
+        * **shed**: Number of refused calls.
+    """
+
+    def __init__(self, rate, burst=1, max_keys=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.shed = 0
+        self._buckets = OrderedDict()
+
+    def allow(self, key):
+        """
+        Take a token from the ``key`` bucket.
+
+        Args:
+            key: Hashable bucket key.
+
+        Returns:
+            ``True`` if a token was available.
+        """
+        now = time.monotonic()
+        tokens, last = self._buckets.pop(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - last) * self.rate)
+
+        if tokens >= 1:
+            tokens -= 1
+            allowed = True
+        else:
+            self.shed += 1
+            allowed = False
+
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+
+        return allowed
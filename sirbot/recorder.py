@@ -0,0 +1,174 @@
+import os
+import gzip
+import json
+import time
+import base64
+import asyncio
+import logging
+
+from aiohttp.web import middleware
+
+LOG = logging.getLogger(__name__)
+
+
+class Recorder:
+    """
+    Record incoming webhook requests to a gzip compressed JSONL file.
+
+    Requests are queued by the middleware and written to disk from a background task,
+    the file I/O is done in an executor so recording never blocks request handling.
+    When the queue is full new records are dropped.
+
+    Enable it with:
+
+    .. code-block:: python
+
+        bot = SirBot(recorder=Recorder("traffic.jsonl.gz"))
+
+    Recordings can be fed back into a bot with :func:`sirbot.replay.replay`.
+
+    Args:
+        path: Recording file path.
+        max_bytes: Rotate the recording file once it is bigger than ``max_bytes``.
+        backups: Number of rotated recording files to keep.
+        queue_size: Maximum number of records waiting to be written.
+        paths: Url prefixes of the recorded requests.
+        max_body_size: Requests with a bigger, or unknown, ``Content-Length`` are not
+                       recorded and their body is left for the handler to stream.
+                       Must not exceed the application ``client_max_size``.
+
+    **Variables**:
+        * **dropped**: Number of records dropped because the queue was full.
+        * **skipped**: Number of requests not recorded because of their size.
+    """
+
+    def __init__(
+        self,
+        path,
+        *,
+        max_bytes=50 * 1024 * 1024,
+        backups=5,
+        queue_size=10000,
+        paths=("/slack/", "/github", "/readthedocs"),
+        max_body_size=1024 ** 2,
+    ):
+        self.path = os.path.abspath(path)
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.paths = tuple(paths)
+        self.max_body_size = max_body_size
+        self.dropped = 0
+        self.skipped = 0
+
+        self._queue_size = queue_size
+        self._queue = None
+        self._writer = None
+
+    def load(self, sirbot):
+        sirbot.middlewares.append(self.middleware)
+        sirbot.on_startup.append(self.start)
+        sirbot.on_shutdown.append(self.stop)
+
+    async def start(self, sirbot):
+        self._queue = asyncio.Queue(maxsize=self._queue_size)
+        self._writer = asyncio.ensure_future(self._write_records())
+
+    async def stop(self, sirbot):
+        if self._writer:
+            await self._queue.put(None)
+            await self._writer
+            self._writer = None
+
+    async def flush(self):
+        """
+        Wait for all queued records to be written to disk.
+        """
+        if self._queue:
+            await self._queue.join()
+
+    @middleware
+    async def middleware(self, request, handler):
+        if self._queue is not None and request.path.startswith(self.paths):
+            if request.body_exists and (
+                request.content_length is None
+                or request.content_length > self.max_body_size
+            ):
+                self.skipped += 1
+                LOG.debug("Not recording oversized request to %s", request.path)
+            else:
+                self.record(request, await request.read())
+        return await handler(request)
+
+    def record(self, request, body):
+        record = {
+            "timestamp": time.time(),
+            "method": request.method,
+            "path": request.path_qs,
+            "headers": dict(request.headers),
+            "body": base64.b64encode(body).decode("ascii"),
+        }
+        try:
+            self._queue.put_nowait(record)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            LOG.warning("Recorder queue full, dropping request to %s", request.path)
+
+    async def _write_records(self):
+        loop = asyncio.get_event_loop()
+        running = True
+        while running:
+            records = [await self._queue.get()]
+            while not self._queue.empty():
+                records.append(self._queue.get_nowait())
+
+            fetched = len(records)
+            if None in records:
+                records = [record for record in records if record is not None]
+                running = False
+
+            try:
+                if records:
+                    await loop.run_in_executor(None, self._write, records)
+            except Exception as e:
+                LOG.exception(e)
+            finally:
+                for _ in range(fetched):
+                    self._queue.task_done()
+
+    def _write(self, records):
+        # Each batch is written as its own gzip member so the file stays readable
+        # while recording.
+        with gzip.open(self.path, "ab") as f:
+            for record in records:
+                f.write(json.dumps(record).encode("utf-8") + b"\n")
+
+        if os.path.getsize(self.path) >= self.max_bytes:
+            self._rotate()
+
+    def _rotate(self):
+        for i in range(self.backups - 1, 0, -1):
+            source = f"{self.path}.{i}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{i + 1}")
+        if self.backups:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+
+def read_recording(path):
+    """
+    Iterate over the records of a recording file.
+
+    Args:
+        path: Recording file path.
+
+    Yields:
+        Records as dictionary with the decoded request body.
+    """
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                record["body"] = base64.b64decode(record["body"])
+                yield record
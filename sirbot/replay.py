@@ -0,0 +1,252 @@
+"""
+Replay a recording made by :class:`sirbot.recorder.Recorder` into a local bot.
+
+Several files or glob patterns can be given, rotated backups are replayed oldest
+first.
+
+.. code-block:: console
+
+    $ python -m sirbot.replay 'traffic.jsonl.gz*' mybot:create_app --speed 10
+"""
+import os
+import re
+import sys
+import glob
+import hmac
+import time
+import asyncio
+import hashlib
+import argparse
+import importlib
+import itertools
+
+from multidict import CIMultiDict
+from aiohttp.test_utils import TestClient, TestServer
+
+from .recorder import read_recording
+
+SKIPPED_HEADERS = ("Host", "Content-Length", "Transfer-Encoding")
+
+BACKUP_RE = re.compile(r"^(.*)\.(\d+)$")
+
+
+class ReplayReport:
+    """
+    Latency and throughput of a replay.
+
+    **Variables**:
+        * **latencies**: Request latencies in seconds.
+        * **statuses**: Response status of each request.
+        * **elapsed**: Total replay duration in seconds.
+    """
+
+    def __init__(self, latencies, statuses, elapsed):
+        self.latencies = latencies
+        self.statuses = statuses
+        self.elapsed = elapsed
+
+    @property
+    def count(self):
+        return len(self.latencies)
+
+    @property
+    def errors(self):
+        return len([status for status in self.statuses if status >= 400])
+
+    @property
+    def throughput(self):
+        if not self.elapsed:
+            return 0.0
+        return self.count / self.elapsed
+
+    def percentile(self, percent):
+        if not self.latencies:
+            return 0.0
+        latencies = sorted(self.latencies)
+        index = min(len(latencies) - 1, int(len(latencies) * percent / 100))
+        return latencies[index]
+
+    def __str__(self):
+        return (
+            f"{self.count} requests ({self.errors} errors) in {self.elapsed:.2f}s, "
+            f"{self.throughput:.1f} req/s, latency p50={self.percentile(50) * 1000:.1f}ms "
+            f"p90={self.percentile(90) * 1000:.1f}ms p99={self.percentile(99) * 1000:.1f}ms"
+        )
+
+
+def sign(record, *, slack_signing_secret=None, github_secret=None):
+    """
+    Re-sign a recorded request so it passes verification.
+
+    Args:
+        record: Recorded request.
+        slack_signing_secret: Slack signing secret of the replay bot.
+        github_secret: Github webhook secret of the replay bot.
+
+    Returns:
+        Request headers.
+    """
+    headers = CIMultiDict(record["headers"])
+    for header in SKIPPED_HEADERS:
+        headers.popall(header, None)
+
+    body = record["body"]
+    if slack_signing_secret and record["path"].startswith("/slack/"):
+        timestamp = str(int(time.time()))
+        signature = hmac.new(
+            slack_signing_secret.encode("utf-8"),
+            b"v0:" + timestamp.encode("utf-8") + b":" + body,
+            digestmod=hashlib.sha256,
+        )
+        headers["X-Slack-Request-Timestamp"] = timestamp
+        headers["X-Slack-Signature"] = "v0=" + signature.hexdigest()
+    elif github_secret and record["path"].startswith("/github"):
+        signature = hmac.new(
+            github_secret.encode("utf-8"), body, digestmod=hashlib.sha1
+        )
+        headers["X-Hub-Signature"] = "sha1=" + signature.hexdigest()
+
+    return headers
+
+
+async def replay(
+    app,
+    path,
+    *,
+    speed=1.0,
+    concurrency=100,
+    slack_signing_secret=None,
+    github_secret=None,
+):
+    """
+    Feed a recording into a bot.
+
+    Args:
+        app: Instance of :class:`sirbot.SirBot`.
+        path: Recording file path or list of paths, replayed in order. Records are
+              read lazily.
+        speed: Replay speed multiplier. ``None`` replays as fast as possible.
+        concurrency: Maximum number of requests in flight.
+        slack_signing_secret: Re-sign slack requests with this signing secret.
+        github_secret: Re-sign github requests with this secret.
+
+    Returns:
+        Instance of :class:`sirbot.replay.ReplayReport`.
+    """
+    paths = [path] if isinstance(path, (str, os.PathLike)) else path
+    records = itertools.chain.from_iterable(read_recording(p) for p in paths)
+    latencies = []
+    statuses = []
+    semaphore = asyncio.Semaphore(concurrency)
+    # Only failed requests are kept once done, to raise their exception
+    tasks = set()
+
+    async def send(record):
+        try:
+            headers = sign(
+                record,
+                slack_signing_secret=slack_signing_secret,
+                github_secret=github_secret,
+            )
+            start = time.monotonic()
+            response = await client.request(
+                record["method"], record["path"], headers=headers, data=record["body"]
+            )
+            await response.read()
+            latencies.append(time.monotonic() - start)
+            statuses.append(response.status)
+        finally:
+            semaphore.release()
+
+    def done(task):
+        if not task.cancelled() and task.exception() is None:
+            tasks.discard(task)
+
+    client = TestClient(TestServer(app))
+    await client.start_server()
+    try:
+        start = time.monotonic()
+        async for record in _paced(records, speed):
+            await semaphore.acquire()
+            task = asyncio.ensure_future(send(record))
+            tasks.add(task)
+            task.add_done_callback(done)
+
+        if tasks:
+            await asyncio.gather(*tasks)
+        elapsed = time.monotonic() - start
+    finally:
+        await client.close()
+
+    return ReplayReport(latencies, statuses, elapsed)
+
+
+async def _paced(records, speed):
+    # Yield the records at their recorded pace, as fast as possible without speed
+    start = time.monotonic()
+    first = None
+    for record in records:
+        if first is None:
+            first = record["timestamp"]
+        if speed:
+            delay = start + (record["timestamp"] - first) / speed - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        yield record
+
+
+def _rotation_order(paths):
+    # ``traffic.jsonl.gz.2`` is older than ``traffic.jsonl.gz.1`` and
+    # ``traffic.jsonl.gz``
+    def key(path):
+        match = BACKUP_RE.match(path)
+        if match:
+            return match.group(1), -int(match.group(2))
+        return path, 0
+
+    return sorted(set(paths), key=key)
+
+
+def _load_app(target):
+    module_name, _, factory_name = target.partition(":")
+    factory = getattr(importlib.import_module(module_name), factory_name)
+    app = factory()
+    if asyncio.iscoroutine(app):
+        app = asyncio.get_event_loop().run_until_complete(app)
+    return app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay recorded webhook traffic")
+    parser.add_argument("paths", nargs="+", help="Recording files or glob patterns")
+    parser.add_argument("app", help="Bot factory, as `module:function`")
+    parser.add_argument(
+        "--speed", default="1", help="Speed multiplier or `max` (default: 1)"
+    )
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument(
+        "--slack-signing-secret", default=os.environ.get("SLACK_SIGNING_SECRET")
+    )
+    parser.add_argument("--github-secret", default=os.environ.get("GITHUB_VERIFY"))
+    args = parser.parse_args(argv)
+
+    speed = None if args.speed == "max" else float(args.speed)
+    paths = _rotation_order(
+        itertools.chain.from_iterable(glob.glob(path) or [path] for path in args.paths)
+    )
+    app = _load_app(args.app)
+    report = asyncio.get_event_loop().run_until_complete(
+        replay(
+            app,
+            paths,
+            speed=speed,
+            concurrency=args.concurrency,
+            slack_signing_secret=args.slack_signing_secret,
+            github_secret=args.github_secret,
+        )
+    )
+    print(report)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
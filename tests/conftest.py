@@ -1,3 +1,5 @@
+import pytest
+
 pytest_plugins = ("slack.tests.plugin",)
 
 
@@ -5,3 +7,9 @@ def pytest_addoption(parser):
     parser.addoption(
         "--postgres", action="store_true", default=False, help="Test PostgreSQL plugin"
     )
+
+
+@pytest.fixture
+def loop(event_loop):
+    # Share the loop running the async fixtures with the aiohttp test utilities
+    return event_loop
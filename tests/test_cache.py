@@ -0,0 +1,114 @@
+import asyncio
+from unittest import mock
+
+import pytest
+import asynctest
+from aiohttp.web import json_response
+
+from sirbot.cache import ResultCache, cached
+
+
+class TestResultCache:
+    async def test_hit(self):
+        cache = ResultCache()
+        coroutine = asynctest.CoroutineMock(return_value=1)
+
+        assert await cache.call("a", coroutine) == 1
+        assert await cache.call("a", coroutine) == 1
+        assert await cache.call("b", coroutine) == 1
+
+        assert coroutine.call_count == 2
+        assert cache.hits == 1
+        assert cache.misses == 2
+
+    async def test_ttl(self):
+        cache = ResultCache(ttl=10)
+        coroutine = asynctest.CoroutineMock(return_value=1)
+
+        with mock.patch("time.monotonic", return_value=100.0):
+            await cache.call("a", coroutine)
+        with mock.patch("time.monotonic", return_value=105.0):
+            await cache.call("a", coroutine)
+        assert coroutine.call_count == 1
+
+        with mock.patch("time.monotonic", return_value=111.0):
+            await cache.call("a", coroutine)
+        assert coroutine.call_count == 2
+
+    async def test_lru(self):
+        cache = ResultCache(max_size=2)
+        coroutine = asynctest.CoroutineMock(return_value=1)
+
+        await cache.call("a", coroutine)
+        await cache.call("b", coroutine)
+        await cache.call("a", coroutine)
+        await cache.call("c", coroutine)
+
+        assert list(cache._results) == ["a", "c"]
+
+    async def test_single_flight(self):
+        cache = ResultCache()
+        calls = 0
+
+        async def coroutine():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return calls
+
+        results = await asyncio.gather(*(cache.call("a", coroutine) for _ in range(5)))
+
+        assert results == [1] * 5
+        assert calls == 1
+        assert cache.coalesced == 4
+
+    async def test_exception(self):
+        cache = ResultCache()
+        coroutine = asynctest.CoroutineMock(side_effect=[ValueError, 1])
+
+        with pytest.raises(ValueError):
+            await cache.call("a", coroutine)
+        assert await cache.call("a", coroutine) == 1
+
+    async def test_response(self):
+        cache = ResultCache()
+        coroutine = asynctest.CoroutineMock(return_value=json_response({"ok": True}))
+
+        first = await cache.call("a", coroutine)
+        second = await cache.call("a", coroutine)
+
+        assert first is not second
+        assert first.body == second.body == b'{"ok": true}'
+        assert second.content_type == "application/json"
+
+    async def test_invalidate(self):
+        cache = ResultCache()
+        coroutine = asynctest.CoroutineMock(return_value=1)
+
+        await cache.call("a", coroutine)
+        cache.invalidate("a")
+        await cache.call("a", coroutine)
+
+        assert coroutine.call_count == 2
+
+
+class TestCached:
+    async def test_cached(self):
+        coroutine = asynctest.CoroutineMock(return_value=1)
+        decorated = cached(ttl=10)(coroutine)
+
+        assert await decorated(1, a=2) == 1
+        assert await decorated(1, a=2) == 1
+        assert await decorated(2) == 1
+
+        assert coroutine.call_count == 2
+        assert decorated.cache.hits == 1
+
+    async def test_key(self):
+        coroutine = asynctest.CoroutineMock(return_value=1)
+        decorated = cached(key=lambda value, app: value)(coroutine)
+
+        await decorated(1, object())
+        await decorated(1, object())
+
+        assert coroutine.call_count == 1
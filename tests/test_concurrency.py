@@ -0,0 +1,147 @@
+import asyncio
+
+import pytest
+from sirbot.concurrency import (
+    PRIORITY_LOW,
+    PRIORITY_HIGH,
+    PRIORITY_NORMAL,
+    PriorityScheduler,
+    ConcurrencyLimiter,
+    limit,
+)
+
+
+class TestConcurrencyLimiter:
+    async def test_limit(self):
+        limiter = ConcurrencyLimiter(2)
+        running = []
+        peak = 0
+
+        async def job():
+            nonlocal peak
+            running.append(1)
+            peak = max(peak, len(running))
+            await asyncio.sleep(0.01)
+            running.pop()
+
+        await asyncio.gather(*(limiter.run(job) for _ in range(10)))
+        assert peak == 2
+        assert limiter.running == 0
+        assert limiter.waiting == 0
+
+    async def test_queue_full(self):
+        limiter = ConcurrencyLimiter(1, queue_size=1)
+        event = asyncio.Event()
+
+        first = asyncio.ensure_future(limiter.run(event.wait))
+        second = asyncio.ensure_future(limiter.run(event.wait))
+        await asyncio.sleep(0)
+
+        with pytest.raises(asyncio.QueueFull):
+            await limiter.run(event.wait)
+        assert limiter.rejected == 1
+
+        event.set()
+        await asyncio.gather(first, second)
+        assert limiter.running == 0
+
+    async def test_cancel_waiting(self):
+        limiter = ConcurrencyLimiter(1)
+        event = asyncio.Event()
+
+        first = asyncio.ensure_future(limiter.run(event.wait))
+        second = asyncio.ensure_future(limiter.run(event.wait))
+        await asyncio.sleep(0)
+        second.cancel()
+        await asyncio.sleep(0)
+        assert limiter.waiting == 0
+
+        event.set()
+        await first
+        assert limiter.running == 0
+
+    @pytest.mark.parametrize("limiter_class", (ConcurrencyLimiter, PriorityScheduler))
+    async def test_cancel_release_race(self, limiter_class):
+        limiter = limiter_class(1)
+        await limiter.acquire()
+
+        waiting = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        waiting.cancel()
+        limiter.release()
+
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        assert limiter.running == 0
+        assert limiter.waiting == 0
+
+    def test_invalid_limit(self):
+        with pytest.raises(ValueError):
+            ConcurrencyLimiter(0)
+
+
+class TestPriorityScheduler:
+    async def test_priority_order(self):
+        scheduler = PriorityScheduler(1)
+        event = asyncio.Event()
+        order = []
+
+        async def job(name):
+            order.append(name)
+            await event.wait()
+
+        tasks = [asyncio.ensure_future(scheduler.run(job, "first"))]
+        await asyncio.sleep(0)
+        for name, priority in (
+            ("low", PRIORITY_LOW),
+            ("normal", PRIORITY_NORMAL),
+            ("high", PRIORITY_HIGH),
+            ("high2", PRIORITY_HIGH),
+        ):
+            tasks.append(
+                asyncio.ensure_future(scheduler.run(job, name, priority=priority))
+            )
+        await asyncio.sleep(0)
+        assert scheduler.waiting == 4
+
+        event.set()
+        await asyncio.gather(*tasks)
+        assert order == ["first", "high", "high2", "normal", "low"]
+
+    async def test_cancel_waiting(self):
+        scheduler = PriorityScheduler(1)
+        event = asyncio.Event()
+
+        first = asyncio.ensure_future(scheduler.run(event.wait))
+        second = asyncio.ensure_future(
+            scheduler.run(event.wait, priority=PRIORITY_HIGH)
+        )
+        third = asyncio.ensure_future(scheduler.run(event.wait))
+        await asyncio.sleep(0)
+        second.cancel()
+        await asyncio.sleep(0)
+        assert scheduler.waiting == 1
+
+        event.set()
+        await asyncio.gather(first, third)
+        assert scheduler.running == 0
+
+
+class TestLimit:
+    async def test_limit_rejected(self):
+        metrics = {"handler_rejected": 0}
+        event = asyncio.Event()
+
+        async def handler():
+            await event.wait()
+            return True
+
+        limited = limit(handler, 1, queue_size=0, metrics=metrics)
+        first = asyncio.ensure_future(limited())
+        await asyncio.sleep(0)
+
+        assert await limited() is None
+        assert metrics["handler_rejected"] == 1
+
+        event.set()
+        assert await first is True
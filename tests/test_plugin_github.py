@@ -1,8 +1,26 @@
+import os
+import re
+import hmac
 import json
+import time
+import asyncio
+import hashlib
+import datetime
+from unittest import mock
+from collections import Counter
 
 import pytest
+import asynctest
+from aiohttp import web
+from gidgethub.sansio import Event
 from sirbot import SirBot
+from sirbot.recorder import Recorder
 from sirbot.plugins.github import GithubPlugin
+from sirbot.plugins.github.apps import InstallationTokens
+from sirbot.plugins.github.cache import ETagCache
+from sirbot.plugins.github.graphql import GraphQLError, GraphQLBatcher
+from sirbot.plugins.github.scheduler import BULK, INTERACTIVE, RateLimitScheduler
+from sirbot.plugins.github.deliveries import MemoryDeliveryStore
 
 
 @pytest.fixture
@@ -12,6 +30,13 @@ async def bot():
     return b
 
 
+@pytest.fixture
+async def prefilter_bot():
+    b = SirBot()
+    b.load_plugin(GithubPlugin(verify="supersecrettoken", prefilter=True))
+    return b
+
+
 @pytest.fixture(params=["pr_merged", "issue_closed"])
 async def event(request):
     with open(f"tests/data/github/events/{request.param}.json") as f:
@@ -49,3 +74,933 @@ class TestPluginGithub:
         client = await aiohttp_client(bot)
         r = await client.post("/github", json=event[0], headers=event[1])
         assert r.status == 500
+
+    async def test_on_event(self, bot, aiohttp_client, event):
+        handler = asynctest.CoroutineMock()
+        bot["plugins"]["github"].on_event(
+            event[1]["X-GitHub-Event"], handler, action=event[0]["action"]
+        )
+        client = await aiohttp_client(bot)
+        r = await client.post("/github", json=event[0], headers=event[1])
+        assert r.status == 200
+        assert handler.call_count == 1
+
+    async def test_on_event_max_concurrency(self, bot, aiohttp_client, event):
+        handler = asynctest.CoroutineMock()
+        bot["plugins"]["github"].on_event(
+            event[1]["X-GitHub-Event"], handler, max_concurrency=1, queue_size=0
+        )
+        routed = bot["plugins"]["github"].router._shallow_routes[
+            event[1]["X-GitHub-Event"]
+        ][0]
+        assert routed.limiter.max_concurrency == 1
+
+        client = await aiohttp_client(bot)
+        r = await client.post("/github", json=event[0], headers=event[1])
+        assert r.status == 200
+        assert handler.call_count == 1
+
+
+class TestPluginGithubWorkers:
+    async def test_incoming_event(self, aiohttp_client, event):
+        bot = SirBot()
+        bot.load_plugin(GithubPlugin(verify="supersecrettoken", workers=2))
+        processed = asyncio.Event()
+
+        async def handler(event, app):
+            processed.set()
+
+        bot["plugins"]["github"].on_event(event[1]["X-GitHub-Event"], handler)
+        client = await aiohttp_client(bot)
+
+        r = await client.post("/github", json=event[0], headers=event[1])
+        assert r.status == 202
+
+        await asyncio.wait_for(processed.wait(), 1)
+        await asyncio.sleep(0)
+        assert bot["plugins"]["github"].metrics["github_queued"] == 1
+        assert bot["plugins"]["github"].metrics["github_processed"] == 1
+
+    async def test_drain_api_call(self, aiohttp_client, aiohttp_server, event):
+        async def repository(request):
+            return web.json_response({"name": "sir-bot-a-lot"})
+
+        api = web.Application()
+        api.router.add_get("/repos/pyslackers/sir-bot-a-lot", repository)
+        server = await aiohttp_server(api)
+        url = str(server.make_url("/repos/pyslackers/sir-bot-a-lot"))
+
+        bot = SirBot()
+        bot.load_plugin(GithubPlugin(verify="supersecrettoken", workers=1))
+        responses = []
+
+        async def handler(event, app):
+            await asyncio.sleep(0.01)
+            responses.append(await app["plugins"]["github"].api.getitem(url))
+
+        bot["plugins"]["github"].on_event(event[1]["X-GitHub-Event"], handler)
+        client = await aiohttp_client(bot)
+
+        for _ in range(3):
+            r = await client.post("/github", json=event[0], headers=event[1])
+            assert r.status == 202
+
+        await client.close()
+        assert responses == [{"name": "sir-bot-a-lot"}] * 3
+        assert bot["plugins"]["github"].metrics["github_failed"] == 0
+
+    async def test_incoming_event_401(self, aiohttp_client, event):
+        bot = SirBot()
+        bot.load_plugin(GithubPlugin(verify="wrongsupersecrettoken", workers=2))
+        client = await aiohttp_client(bot)
+
+        r = await client.post("/github", json=event[0], headers=event[1])
+        assert r.status == 401
+        assert bot["plugins"]["github"].queued == 0
+
+    async def test_ordering(self, aiohttp_client, event):
+        bot = SirBot()
+        bot.load_plugin(GithubPlugin(verify="supersecrettoken", workers=4))
+        deliveries = []
+
+        async def handler(event, app):
+            await asyncio.sleep(0.01 if not deliveries else 0)
+            deliveries.append(event.delivery_id)
+
+        bot["plugins"]["github"].on_event(event[1]["X-GitHub-Event"], handler)
+        client = await aiohttp_client(bot)
+
+        expected = []
+        for i in range(5):
+            headers = dict(event[1], **{"X-GitHub-Delivery": str(i)})
+            r = await client.post("/github", json=event[0], headers=headers)
+            assert r.status == 202
+            expected.append(str(i))
+
+        await client.close()
+        assert deliveries == expected
+
+    async def test_queue_full(self, aiohttp_client, event):
+        bot = SirBot()
+        bot.load_plugin(
+            GithubPlugin(verify="supersecrettoken", workers=1, queue_size=1)
+        )
+        release = asyncio.Event()
+
+        async def handler(event, app):
+            await release.wait()
+
+        bot["plugins"]["github"].on_event(event[1]["X-GitHub-Event"], handler)
+        client = await aiohttp_client(bot)
+
+        statuses = []
+        for _ in range(3):
+            r = await client.post("/github", json=event[0], headers=event[1])
+            statuses.append(r.status)
+            await asyncio.sleep(0)
+
+        release.set()
+        assert statuses == [202, 202, 503]
+        assert bot["plugins"]["github"].metrics["github_queue_full"] == 1
+
+    async def test_handler_error(self, aiohttp_client, event):
+        bot = SirBot()
+        bot.load_plugin(GithubPlugin(verify="supersecrettoken", workers=1))
+        handler = asynctest.CoroutineMock(side_effect=RuntimeError)
+        bot["plugins"]["github"].on_event(event[1]["X-GitHub-Event"], handler)
+        client = await aiohttp_client(bot)
+
+        r = await client.post("/github", json=event[0], headers=event[1])
+        assert r.status == 202
+
+        await client.close()
+        assert bot["plugins"]["github"].metrics["github_failed"] == 1
+
+
+class TestPluginGithubDeliveries:
+    async def test_duplicate(self, aiohttp_client, event):
+        bot = SirBot()
+        bot.load_plugin(GithubPlugin(verify="supersecrettoken", deliveries=True))
+        handler = asynctest.CoroutineMock()
+        bot["plugins"]["github"].on_event(event[1]["X-GitHub-Event"], handler)
+        client = await aiohttp_client(bot)
+
+        for _ in range(2):
+            r = await client.post("/github", json=event[0], headers=event[1])
+            assert r.status == 200
+
+        assert handler.call_count == 1
+        assert bot["plugins"]["github"].metrics["github_duplicate"] == 1
+
+    async def test_failed_redelivery(self, aiohttp_client, event):
+        bot = SirBot()
+        bot.load_plugin(GithubPlugin(verify="supersecrettoken", deliveries=True))
+        handler = asynctest.CoroutineMock(side_effect=[RuntimeError, None])
+        bot["plugins"]["github"].on_event(event[1]["X-GitHub-Event"], handler)
+        client = await aiohttp_client(bot)
+
+        r = await client.post("/github", json=event[0], headers=event[1])
+        assert r.status == 500
+        r = await client.post("/github", json=event[0], headers=event[1])
+        assert r.status == 200
+
+        assert handler.call_count == 2
+
+    async def test_unverified(self, aiohttp_client, event):
+        store = asynctest.Mock(add=asynctest.CoroutineMock(return_value=True))
+        bot = SirBot()
+        bot.load_plugin(GithubPlugin(verify="wrongsupersecrettoken", deliveries=store))
+        client = await aiohttp_client(bot)
+
+        r = await client.post("/github", json=event[0], headers=event[1])
+
+        assert r.status == 401
+        assert store.add.call_count == 0
+
+    async def test_memory_store(self):
+        store = MemoryDeliveryStore(max_size=2)
+        assert await store.add("a", 10)
+        assert not await store.add("a", 10)
+        assert await store.add("b", 10)
+        assert await store.add("c", 10)
+        assert list(store._deliveries) == ["b", "c"]
+
+        with mock.patch("time.monotonic", return_value=time.monotonic() + 11):
+            assert await store.add("b", 10)
+        assert list(store._deliveries) == ["b"]
+
+        await store.discard("b")
+        assert await store.add("b", 10)
+
+
+class TestPluginGithubRouting:
+    async def test_unrouted(self, prefilter_bot, aiohttp_client, event):
+        client = await aiohttp_client(prefilter_bot)
+        with mock.patch("gidgethub.sansio.Event.from_http") as from_http:
+            r = await client.post("/github", json=event[0], headers=event[1])
+
+        assert r.status == 200
+        assert from_http.call_count == 0
+        assert prefilter_bot["plugins"]["github"].metrics["github_unrouted"] == 1
+
+    async def test_unrouted_401(self, prefilter_bot, aiohttp_client, event):
+        prefilter_bot["plugins"]["github"].verify = "wrongsupersecrettoken"
+        client = await aiohttp_client(prefilter_bot)
+        headers = {k: v for k, v in event[1].items() if k != "X-Hub-Signature"}
+
+        r = await client.post("/github", json=event[0], headers=event[1])
+        assert r.status == 401
+        r = await client.post("/github", json=event[0], headers=headers)
+        assert r.status == 401
+
+    async def test_unrouted_action(self, prefilter_bot, aiohttp_client, event):
+        handler = asynctest.CoroutineMock()
+        prefilter_bot["plugins"]["github"].on_event(
+            event[1]["X-GitHub-Event"], handler, action="not_" + event[0]["action"]
+        )
+        client = await aiohttp_client(prefilter_bot)
+
+        r = await client.post("/github", json=event[0], headers=event[1])
+
+        assert r.status == 200
+        assert handler.call_count == 0
+        assert prefilter_bot["plugins"]["github"].metrics["github_unrouted"] == 1
+
+    async def test_no_prefilter(self, bot, aiohttp_client, event):
+        client = await aiohttp_client(bot)
+        with mock.patch("gidgethub.sansio.Event.from_http") as from_http:
+            r = await client.post("/github", json=event[0], headers=event[1])
+
+        assert r.status == 200
+        assert from_http.call_count == 1
+        assert bot["plugins"]["github"].metrics["github_unrouted"] == 0
+
+    async def test_router_handler_after_startup(
+        self, prefilter_bot, aiohttp_client, event
+    ):
+        client = await aiohttp_client(prefilter_bot)
+        handler = asynctest.CoroutineMock()
+        prefilter_bot["plugins"]["github"].router.add(
+            handler, event[1]["X-GitHub-Event"]
+        )
+
+        r = await client.post("/github", json=event[0], headers=event[1])
+
+        assert r.status == 200
+        assert handler.call_count == 1
+        assert prefilter_bot["plugins"]["github"].metrics["github_unrouted"] == 0
+
+    async def test_is_routed(self, bot):
+        github = bot["plugins"]["github"]
+        github.on_event("pull_request", None, action="opened")
+        github.on_event("issues", None)
+        github.on_event("status", None, state="success")
+
+        assert github.is_routed("pull_request", b'{"action": "opened", "number": 1}')
+        assert not github.is_routed("pull_request", b'{"action": "closed"}')
+        assert github.is_routed("pull_request", b'{"number": 1, "action": "closed"}')
+        assert github.is_routed("issues", b'{"action": "closed"}')
+        assert github.is_routed("status", b"{}")
+        assert not github.is_routed("push", b"{}")
+
+
+def _signed(body, secret="supersecrettoken"):
+    signature = hmac.new(secret.encode("utf-8"), body, digestmod=hashlib.sha1)
+    return {
+        "X-GitHub-Event": "push",
+        "X-GitHub-Delivery": "72d3162e-cc78-11e3-81ab-4c9367dc0958",
+        "X-Hub-Signature": "sha1=" + signature.hexdigest(),
+        "Content-Type": "application/json",
+    }
+
+
+class TestPluginGithubPayload:
+    async def test_large_payload(self, aiohttp_client):
+        bot = SirBot()
+        bot.load_plugin(GithubPlugin(verify="supersecrettoken", offload_size=1024))
+        handler = asynctest.CoroutineMock()
+        bot["plugins"]["github"].on_event("push", handler)
+        client = await aiohttp_client(bot)
+
+        body = json.dumps({"commits": ["a" * 1024] * 3072}).encode("utf-8")
+        assert len(body) > bot._client_max_size
+        loop = asyncio.get_event_loop()
+        with mock.patch.object(
+            loop, "run_in_executor", wraps=loop.run_in_executor
+        ) as run_in_executor:
+            r = await client.post("/github", data=body, headers=_signed(body))
+
+        assert r.status == 200
+        assert handler.call_count == 1
+        # Signature verification and decoding
+        assert run_in_executor.call_count == 2
+        assert len(handler.call_args[0][0].data["commits"]) == 3072
+
+    async def test_large_payload_401(self, aiohttp_client):
+        bot = SirBot()
+        bot.load_plugin(GithubPlugin(verify="supersecrettoken", offload_size=1024))
+        bot["plugins"]["github"].on_event("push", asynctest.CoroutineMock())
+        client = await aiohttp_client(bot)
+
+        body = json.dumps({"commits": ["a" * 1024] * 3072}).encode("utf-8")
+        headers = _signed(body + b" ")
+        r = await client.post("/github", data=body, headers=headers)
+
+        assert r.status == 401
+
+    async def test_chunked_payload(self, aiohttp_client):
+        bot = SirBot()
+        bot.load_plugin(GithubPlugin(verify="supersecrettoken"))
+        handler = asynctest.CoroutineMock()
+        bot["plugins"]["github"].on_event("push", handler)
+        client = await aiohttp_client(bot)
+
+        body = json.dumps({"commits": ["a" * 1024] * 64}).encode("utf-8")
+
+        async def chunks():
+            for i in range(0, len(body), 4096):
+                yield body[i : i + 4096]
+
+        r = await client.post("/github", data=chunks(), headers=_signed(body))
+
+        assert r.status == 200
+        assert handler.call_count == 1
+
+    async def test_max_body_size(self, aiohttp_client):
+        bot = SirBot()
+        bot.load_plugin(GithubPlugin(verify="supersecrettoken", max_body_size=4096))
+        handler = asynctest.CoroutineMock()
+        bot["plugins"]["github"].on_event("push", handler)
+        client = await aiohttp_client(bot)
+
+        body = json.dumps({"commits": ["a" * 1024] * 8}).encode("utf-8")
+
+        async def chunks():
+            yield body
+
+        r = await client.post("/github", data=body, headers=_signed(body))
+        assert r.status == 413
+        r = await client.post("/github", data=chunks(), headers=_signed(body))
+        assert r.status == 413
+
+        assert handler.call_count == 0
+        assert bot["plugins"]["github"].metrics["github_too_large"] == 2
+
+    async def test_recorded_payload(self, aiohttp_client, tmpdir):
+        bot = SirBot(recorder=Recorder(str(tmpdir.join("traffic.jsonl.gz"))))
+        bot.load_plugin(GithubPlugin(verify="supersecrettoken"))
+        handler = asynctest.CoroutineMock()
+        bot["plugins"]["github"].on_event("push", handler)
+        client = await aiohttp_client(bot)
+
+        body = json.dumps({"commits": []}).encode("utf-8")
+        r = await client.post("/github", data=body, headers=_signed(body))
+
+        assert r.status == 200
+        assert handler.call_count == 1
+
+    async def test_recorded_large_payload(self, aiohttp_client, tmpdir):
+        recorder = Recorder(str(tmpdir.join("traffic.jsonl.gz")))
+        bot = SirBot(recorder=recorder)
+        bot.load_plugin(GithubPlugin(verify="supersecrettoken"))
+        handler = asynctest.CoroutineMock()
+        bot["plugins"]["github"].on_event("push", handler)
+        client = await aiohttp_client(bot)
+
+        body = json.dumps({"commits": ["a" * 1024] * 3072}).encode("utf-8")
+        r = await client.post("/github", data=body, headers=_signed(body))
+
+        assert r.status == 200
+        assert handler.call_count == 1
+        assert recorder.skipped == 1
+
+
+class TestPluginGithubCache:
+    async def test_conditional_request(self, aiohttp_server):
+        calls = []
+
+        async def repository(request):
+            calls.append(request.headers.get("If-None-Match"))
+            if request.headers.get("If-None-Match") == '"abc"':
+                return web.Response(status=304, headers={"ETag": '"abc"'})
+            return web.json_response(
+                {"name": "sir-bot-a-lot"}, headers={"ETag": '"abc"'}
+            )
+
+        api = web.Application()
+        api.router.add_get("/repos/pyslackers/sir-bot-a-lot", repository)
+        server = await aiohttp_server(api)
+
+        bot = SirBot()
+        bot.load_plugin(GithubPlugin(verify="supersecrettoken"))
+        github = bot["plugins"]["github"]
+        url = str(server.make_url("/repos/pyslackers/sir-bot-a-lot"))
+
+        for _ in range(3):
+            assert await github.api.getitem(url) == {"name": "sir-bot-a-lot"}
+
+        assert calls == [None, '"abc"', '"abc"']
+        assert github.metrics["github_cache_miss"] == 1
+        assert github.metrics["github_cache_hit"] == 2
+        assert github.metrics["github_cache_304"] == 2
+        await bot.http_session.close()
+
+    async def test_no_cache(self):
+        bot = SirBot()
+        bot.load_plugin(GithubPlugin(verify="supersecrettoken", cache=False))
+        assert bot["plugins"]["github"].api._cache is None
+        await bot.http_session.close()
+
+    async def test_lru(self):
+        metrics = Counter()
+        cache = ETagCache(max_size=2, metrics=metrics)
+        cache["a"] = ("1", None, {}, None)
+        cache["b"] = ("2", None, {}, None)
+        assert cache["a"] == ("1", None, {}, None)
+        cache["c"] = ("3", None, {}, None)
+
+        assert list(cache) == ["a", "c"]
+        with pytest.raises(KeyError):
+            cache["b"]
+        assert metrics == {"github_cache_hit": 1, "github_cache_miss": 1}
+
+
+def _expires_in(seconds):
+    expires = datetime.datetime.utcnow() + datetime.timedelta(seconds=seconds)
+    return expires.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _private_key():
+    rsa = pytest.importorskip("cryptography.hazmat.primitives.asymmetric.rsa")
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import serialization
+
+    key = rsa.generate_private_key(65537, 2048, default_backend())
+    pem = key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    )
+    return key, pem
+
+
+@pytest.fixture
+async def app_bot():
+    b = SirBot()
+    b.load_plugin(GithubPlugin(verify="supersecrettoken", app_id=42))
+    b["plugins"]["github"].installations.app_jwt = mock.Mock(return_value="jwt")
+    return b
+
+
+class TestPluginGithubApps:
+    async def test_installation_api(self, app_bot):
+        github = app_bot["plugins"]["github"]
+        github.api.post = asynctest.CoroutineMock(
+            return_value={"token": "v1.abc", "expires_at": _expires_in(3600)}
+        )
+
+        event = Event({"installation": {"id": 1234}}, event="push", delivery_id="1")
+        api = await github.installation_api(event)
+        assert api.oauth_token == "v1.abc"
+        api = await github.installation_api(1234)
+        assert api.oauth_token == "v1.abc"
+
+        assert github.api.post.call_count == 1
+        assert github.api.post.call_args[0] == (
+            "/app/installations/{installation_id}/access_tokens",
+            {"installation_id": "1234"},
+        )
+        assert github.api.post.call_args[1]["jwt"] == "jwt"
+        assert github.metrics["github_app_token_minted"] == 1
+        assert github.metrics["github_app_token_cached"] == 1
+
+    async def test_concurrent_requests(self, app_bot):
+        github = app_bot["plugins"]["github"]
+
+        async def post(*args, **kwargs):
+            await asyncio.sleep(0.01)
+            return {"token": "v1.abc", "expires_at": _expires_in(3600)}
+
+        github.api.post = asynctest.CoroutineMock(side_effect=post)
+
+        tokens = await asyncio.gather(
+            *(github.installations.token(1234) for _ in range(10))
+        )
+        assert tokens == ["v1.abc"] * 10
+        assert github.api.post.call_count == 1
+
+    async def test_proactive_refresh(self, app_bot):
+        github = app_bot["plugins"]["github"]
+        github.api.post = asynctest.CoroutineMock(
+            side_effect=[
+                {"token": "v1.abc", "expires_at": _expires_in(120)},
+                {"token": "v1.def", "expires_at": _expires_in(3600)},
+            ]
+        )
+
+        assert await github.installations.token(1234) == "v1.abc"
+        assert await github.installations.token(1234) == "v1.abc"
+        await asyncio.sleep(0)
+        assert await github.installations.token(1234) == "v1.def"
+        assert github.api.post.call_count == 2
+
+    async def test_expired_token(self, app_bot):
+        github = app_bot["plugins"]["github"]
+        github.api.post = asynctest.CoroutineMock(
+            side_effect=[
+                {"token": "v1.abc", "expires_at": _expires_in(-10)},
+                {"token": "v1.def", "expires_at": _expires_in(3600)},
+            ]
+        )
+
+        assert await github.installations.token(1234) == "v1.abc"
+        assert await github.installations.token(1234) == "v1.def"
+
+    async def test_not_configured(self, bot):
+        with pytest.raises(RuntimeError):
+            await bot["plugins"]["github"].installation_api(1234)
+
+    async def test_mint_with_app_jwt(self):
+        jwt = pytest.importorskip("jwt")
+        key, pem = _private_key()
+
+        bot = SirBot()
+        bot.load_plugin(
+            GithubPlugin(verify="supersecrettoken", app_id=42, private_key=pem)
+        )
+        github = bot["plugins"]["github"]
+        github.api.post = asynctest.CoroutineMock(
+            return_value={"token": "v1.abc", "expires_at": _expires_in(3600)}
+        )
+
+        assert await github.installations.token(1234) == "v1.abc"
+        app_jwt = github.api.post.call_args[1]["jwt"]
+        claims = jwt.decode(app_jwt, key.public_key(), algorithms=["RS256"])
+        assert claims["iss"] == 42
+        assert claims["exp"] - claims["iat"] <= 660
+        await bot.http_session.close()
+
+    async def test_app_jwt(self):
+        jwt = pytest.importorskip("jwt")
+        key, pem = _private_key()
+        tokens = InstallationTokens(None, 42, pem)
+
+        token = tokens.app_jwt()
+        assert tokens.app_jwt() == token
+        claims = jwt.decode(token, key.public_key(), algorithms=["RS256"])
+        assert claims["iss"] == 42
+
+
+def _ratelimit(remaining, reset, limit=5000):
+    return {
+        "x-ratelimit-limit": str(limit),
+        "x-ratelimit-remaining": str(remaining),
+        "x-ratelimit-reset": str(reset),
+    }
+
+
+class TestPluginGithubScheduler:
+    async def test_interactive(self):
+        scheduler = RateLimitScheduler(reserve=10)
+        scheduler.update("token", 200, _ratelimit(5, int(time.time()) + 100))
+
+        with asynctest.patch("asyncio.sleep") as sleep:
+            for _ in range(5):
+                await scheduler.acquire("token", INTERACTIVE)
+
+        assert sleep.call_count == 0
+        assert scheduler.quota("token")[1] == 0
+
+    async def test_bulk_pacing(self):
+        metrics = Counter()
+        scheduler = RateLimitScheduler(reserve=10, metrics_key="token", metrics=metrics)
+        scheduler.update("token", 200, _ratelimit(20, int(time.time()) + 100))
+        scheduler.update("other", 200, _ratelimit(30, int(time.time()) + 100))
+
+        with asynctest.patch("asyncio.sleep") as sleep:
+            for _ in range(3):
+                await scheduler.acquire("token", BULK)
+
+        delays = [call[0][0] for call in sleep.call_args_list]
+        assert len(delays) == 2
+        assert 9 < delays[0] < 10.1
+        assert 19 < delays[1] < 20.2
+        assert metrics["github_ratelimit_waits"] == 2
+        assert metrics["github_ratelimit_remaining"] == 20
+
+    async def test_bulk_reserve(self):
+        scheduler = RateLimitScheduler(reserve=10)
+        scheduler.update("token", 200, _ratelimit(11, int(time.time()) + 100))
+
+        def reset(delay):
+            scheduler.update("token", 200, _ratelimit(5000, int(time.time()) + 3600))
+
+        with asynctest.patch("asyncio.sleep", side_effect=reset) as sleep:
+            await scheduler.acquire("token", INTERACTIVE)
+            assert sleep.call_count == 0
+            await scheduler.acquire("token", BULK)
+
+        assert sleep.call_count == 1
+        assert 99 < sleep.call_args[0][0] <= 100
+
+    async def test_exhausted(self):
+        metrics = Counter()
+        scheduler = RateLimitScheduler(max_wait=10, metrics=metrics)
+        scheduler.update("token", 200, _ratelimit(0, int(time.time()) + 100))
+
+        with asynctest.patch("asyncio.sleep") as sleep:
+            await scheduler.acquire("token", INTERACTIVE)
+            await scheduler.acquire("other", INTERACTIVE)
+
+        assert sleep.call_count == 0
+        assert metrics["github_ratelimit_exhausted"] == 1
+
+    async def test_secondary_ratelimit(self, aiohttp_server):
+        responses = [
+            web.json_response(
+                {"message": "secondary rate limit"},
+                status=403,
+                headers={
+                    "Retry-After": "0",
+                    **_ratelimit(4000, int(time.time()) + 100),
+                },
+            ),
+            web.json_response({"name": "sir-bot-a-lot"}),
+        ]
+
+        async def repository(request):
+            return responses.pop(0)
+
+        api = web.Application()
+        api.router.add_get("/repos/pyslackers/sir-bot-a-lot", repository)
+        server = await aiohttp_server(api)
+
+        bot = SirBot()
+        bot.load_plugin(GithubPlugin(verify="supersecrettoken"))
+        github = bot["plugins"]["github"]
+        url = str(server.make_url("/repos/pyslackers/sir-bot-a-lot"))
+
+        assert await github.api.getitem(url) == {"name": "sir-bot-a-lot"}
+        assert github.metrics["github_requests"] == 2
+        assert github.metrics["github_ratelimit_secondary"] == 1
+        assert github.api.with_priority(BULK).priority == BULK
+        assert github.api.priority == INTERACTIVE
+        await bot.http_session.close()
+
+    async def test_quota_keys(self, aiohttp_server):
+        async def repository(request):
+            authorization = request.headers.get("Authorization")
+            remaining = 100 if authorization == "token v1.abc" else 4000
+            return web.json_response(
+                {"name": "sir-bot-a-lot"},
+                headers=_ratelimit(remaining, int(time.time()) + 100),
+            )
+
+        api = web.Application()
+        api.router.add_get("/repos/pyslackers/sir-bot-a-lot", repository)
+        server = await aiohttp_server(api)
+        url = str(server.make_url("/repos/pyslackers/sir-bot-a-lot"))
+
+        bot = SirBot()
+        bot.load_plugin(GithubPlugin(verify="supersecrettoken", app_id=42))
+        github = bot["plugins"]["github"]
+        github.installations._tokens[1234] = (time.time() + 3600, "v1.abc")
+        installation_api = await github.installation_api(1234)
+        await github.api.getitem(url)
+        await installation_api.getitem(url)
+        await github.api.getitem(url, jwt="jwt")
+
+        assert list(github.scheduler._quotas) == ["plugin", "installation:1234", "app"]
+        assert github.scheduler.quota("installation:1234")[1] == 100
+        assert github.metrics["github_ratelimit_remaining"] == 4000
+        await bot.http_session.close()
+
+
+class TestPluginGithubGraphQL:
+    async def test_batching(self, aiohttp_server):
+        queries = []
+        authorizations = []
+
+        async def graphql(request):
+            body = await request.json()
+            queries.append(body["query"])
+            authorizations.append(request.headers.get("Authorization"))
+            data = {}
+            for alias, variable in re.findall(
+                r"(q\d+): pullRequest\(number: \$(\w+)\)", body["query"]
+            ):
+                data[alias] = {"number": body["variables"][variable]}
+            return web.json_response({"data": data})
+
+        api = web.Application()
+        api.router.add_post("/graphql", graphql)
+        server = await aiohttp_server(api)
+
+        bot = SirBot()
+        bot.load_plugin(GithubPlugin(verify="supersecrettoken", oauth_token="abc"))
+        github = bot["plugins"]["github"]
+        github.graphql.url = str(server.make_url("/graphql"))
+
+        results = await asyncio.gather(
+            *(
+                github.graphql.query(
+                    "pullRequest(number: $number) { number }", number=i
+                )
+                for i in range(5)
+            )
+        )
+
+        assert results == [{"number": i} for i in range(5)]
+        assert len(queries) == 1
+        assert queries[0].startswith("query($q0_number: Int!, $q1_number: Int!")
+        assert authorizations == ["token abc"]
+        assert github.metrics["github_graphql_queries"] == 1
+        assert github.metrics["github_graphql_lookups"] == 5
+        await bot.http_session.close()
+
+    async def test_max_batch_and_errors(self, aiohttp_server):
+        queries = []
+        authorizations = []
+
+        async def graphql(request):
+            queries.append(await request.json())
+            authorizations.append(request.headers.get("Authorization"))
+            return web.json_response(
+                {
+                    "data": {"q0": {"name": "sir-bot-a-lot"}, "q1": None},
+                    "errors": [{"message": "Not found", "path": ["q1"]}],
+                }
+            )
+
+        api = web.Application()
+        api.router.add_post("/graphql", graphql)
+        server = await aiohttp_server(api)
+
+        bot = SirBot()
+        bot.load_plugin(GithubPlugin(verify="supersecrettoken"))
+        batcher = GraphQLBatcher(
+            bot["plugins"]["github"].api,
+            oauth_token="def",
+            max_batch=2,
+            url=str(server.make_url("/graphql")),
+        )
+
+        query = "repository(owner: $owner, name: $name) { name }"
+        results = await asyncio.gather(
+            batcher.query(query, owner="pyslackers", name="sir-bot-a-lot"),
+            batcher.query(query, owner="pyslackers", name="unknown"),
+            batcher.query(query, owner="pyslackers", name="sir-bot-a-lot"),
+            return_exceptions=True,
+        )
+
+        assert results[0] == {"name": "sir-bot-a-lot"}
+        assert isinstance(results[1], GraphQLError)
+        assert results[1].errors == [{"message": "Not found", "path": ["q1"]}]
+        assert results[2] == {"name": "sir-bot-a-lot"}
+        assert len(queries) == 2
+        assert authorizations == ["token def", "token def"]
+        assert (
+            "q1: repository(owner: $q1_owner, name: $q1_name) { name }"
+            in queries[0]["query"]
+        )
+        assert queries[0]["variables"]["q1_name"] == "unknown"
+        await bot.http_session.close()
+
+    async def test_variables(self, aiohttp_server, aiohttp_client):
+        queries = []
+
+        async def graphql(request):
+            queries.append(await request.json())
+            await asyncio.sleep(0.01)
+            return web.json_response({"data": {"q0": {"issueCount": 1}}})
+
+        api = web.Application()
+        api.router.add_post("/graphql", graphql)
+        server = await aiohttp_server(api)
+
+        bot = SirBot()
+        bot.load_plugin(GithubPlugin(verify="supersecrettoken", oauth_token="abc"))
+        batcher = bot["plugins"]["github"].graphql
+        batcher.url = str(server.make_url("/graphql"))
+        client = await aiohttp_client(bot)
+
+        with pytest.raises(TypeError):
+            await batcher.query("search(type: $type) { issueCount }", type=None)
+        with pytest.raises(ValueError):
+            await batcher.query("search(type: $type) { issueCount }")
+
+        result = asyncio.ensure_future(
+            batcher.query(
+                'search(query: $q, type: $type, first: 1) { issueCount } x: viewer { login(x: "$q") }',
+                types={"type": "SearchType!"},
+                q="is:open",
+                type="ISSUE",
+            )
+        )
+        await asyncio.sleep(0)
+        await client.close()
+
+        assert result.done()
+        assert result.result() == {"issueCount": 1}
+        assert queries == [
+            {
+                "query": "query($q0_q: String!, $q0_type: SearchType!) { q0: search("
+                "query: $q0_q, type: $q0_type, first: 1) { issueCount } "
+                'x: viewer { login(x: "$q") } }',
+                "variables": {"q0_q": "is:open", "q0_type": "ISSUE"},
+            }
+        ]
+
+    async def test_unauthenticated(self):
+        with mock.patch.dict(os.environ, {"GITHUB_TOKEN": ""}):
+            bot = SirBot()
+            bot.load_plugin(GithubPlugin(verify="supersecrettoken"))
+
+        assert bot["plugins"]["github"].graphql is None
+        await bot.http_session.close()
+
+
+def _push(repository):
+    return json.dumps({"repository": {"full_name": repository}}).encode("utf-8")
+
+
+class TestPluginGithubDigest:
+    async def test_window(self, aiohttp_client):
+        bot = SirBot()
+        bot.load_plugin(GithubPlugin(verify="supersecrettoken"))
+        handler = asynctest.CoroutineMock()
+        bot["plugins"]["github"].on_digest("push", handler, window=0.05)
+        client = await aiohttp_client(bot)
+
+        for repository in ("pyslackers/a", "pyslackers/a", "pyslackers/b"):
+            body = _push(repository)
+            r = await client.post("/github", data=body, headers=_signed(body))
+            assert r.status == 200
+
+        assert handler.call_count == 0
+        await asyncio.sleep(0.1)
+
+        assert handler.call_count == 2
+        batches = sorted(len(call[0][0]) for call in handler.call_args_list)
+        assert batches == [1, 2]
+        assert handler.call_args[0][1] is bot
+        assert bot["plugins"]["github"].metrics["github_digest_events"] == 3
+        assert bot["plugins"]["github"].metrics["github_digest_flushed"] == 2
+
+    async def test_max_size(self, aiohttp_client):
+        bot = SirBot()
+        bot.load_plugin(GithubPlugin(verify="supersecrettoken"))
+        handler = asynctest.CoroutineMock()
+        bot["plugins"]["github"].on_digest("push", handler, window=60, max_size=2)
+        client = await aiohttp_client(bot)
+
+        for _ in range(3):
+            body = _push("pyslackers/a")
+            await client.post("/github", data=body, headers=_signed(body))
+        await asyncio.sleep(0)
+
+        assert handler.call_count == 1
+        assert len(handler.call_args[0][0]) == 2
+
+    async def test_shutdown(self, aiohttp_client):
+        bot = SirBot()
+        bot.load_plugin(GithubPlugin(verify="supersecrettoken"))
+        handled = []
+
+        async def handler(events, app):
+            await asyncio.sleep(0.01)
+            handled.extend(events)
+
+        bot["plugins"]["github"].on_digest(
+            "push", handler, window=60, key=lambda event: None
+        )
+        client = await aiohttp_client(bot)
+
+        for repository in ("pyslackers/a", "pyslackers/b"):
+            body = _push(repository)
+            await client.post("/github", data=body, headers=_signed(body))
+
+        await client.close()
+        assert len(handled) == 2
+
+    async def test_shutdown_api_call(self, aiohttp_client, aiohttp_server):
+        async def comment(request):
+            return web.json_response({"id": 1}, status=201)
+
+        api = web.Application()
+        api.router.add_post("/comments", comment)
+        server = await aiohttp_server(api)
+        url = str(server.make_url("/comments"))
+
+        bot = SirBot()
+        bot.load_plugin(GithubPlugin(verify="supersecrettoken"))
+        responses = []
+
+        async def handler(events, app):
+            github = app["plugins"]["github"]
+            responses.append(await github.api.post(url, data={"count": len(events)}))
+
+        bot["plugins"]["github"].on_digest("push", handler, window=60)
+        client = await aiohttp_client(bot)
+
+        body = _push("pyslackers/a")
+        await client.post("/github", data=body, headers=_signed(body))
+
+        await client.close()
+        assert responses == [{"id": 1}]
+        assert bot["plugins"]["github"].metrics["github_digest_failed"] == 0
+
+    async def test_handler_error(self, aiohttp_client):
+        bot = SirBot()
+        bot.load_plugin(GithubPlugin(verify="supersecrettoken"))
+        handler = asynctest.CoroutineMock(side_effect=RuntimeError())
+        bot["plugins"]["github"].on_digest("push", handler, window=0.01)
+        client = await aiohttp_client(bot)
+
+        body = _push("pyslackers/a")
+        r = await client.post("/github", data=body, headers=_signed(body))
+        assert r.status == 200
+        await asyncio.sleep(0.05)
+
+        assert handler.call_count == 1
+        assert bot["plugins"]["github"].metrics["github_digest_failed"] == 1
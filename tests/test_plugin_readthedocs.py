@@ -1,7 +1,21 @@
+import asyncio
+from unittest import mock
+
 import pytest
+import aiohttp
 import asynctest
+from aiohttp import web
 from sirbot import SirBot
 from sirbot.plugins.readthedocs import RTDPlugin
+from sirbot.plugins.readthedocs.plugin import BuildResult
+
+
+def _response(status=200, data=None):
+    response = mock.Mock(status=status)
+    response.json = asynctest.CoroutineMock(
+        return_value={"build_triggered": True} if data is None else data
+    )
+    return response
 
 
 @pytest.fixture
@@ -23,27 +37,175 @@ class TestPluginReadTheDocs:
         assert "test" in bot["plugins"]["readthedocs"]._projects
 
     async def test_build_project(self, bot):
-        bot["plugins"]["readthedocs"]._session.post = asynctest.CoroutineMock()
+        response = _response()
+        bot["plugins"]["readthedocs"]._session.post = asynctest.CoroutineMock(
+            return_value=response
+        )
         bot["plugins"]["readthedocs"].register_project(
             "test", build_url="https://example.com", jeton="aaaaaa"
         )
-        await bot["plugins"]["readthedocs"].build("test")
+        result = await bot["plugins"]["readthedocs"].build("test")
 
         assert bot["plugins"]["readthedocs"]._session.post.call_count == 1
         bot["plugins"]["readthedocs"]._session.post.assert_called_with(
-            "https://example.com", json={"branch": "latest", "token": "aaaaaa"}
+            "https://example.com",
+            json={"branch": "latest", "token": "aaaaaa"},
+            timeout=mock.ANY,
         )
+        assert response.release.call_count == 1
+        assert isinstance(result, BuildResult)
+        assert result.ok
+        assert result.triggered
+        assert result.data == {"build_triggered": True}
 
     async def test_build_project_branch(self, bot):
-        bot["plugins"]["readthedocs"]._session.post = asynctest.CoroutineMock()
+        bot["plugins"]["readthedocs"]._session.post = asynctest.CoroutineMock(
+            return_value=_response()
+        )
         bot["plugins"]["readthedocs"].register_project(
             "test", build_url="https://example.com", jeton="aaaaaa"
         )
-        await bot["plugins"]["readthedocs"].build("test", branch="dev")
+        result = await bot["plugins"]["readthedocs"].build("test", branch="dev")
 
         assert bot["plugins"]["readthedocs"]._session.post.call_count == 1
         bot["plugins"]["readthedocs"]._session.post.assert_called_with(
-            "https://example.com", json={"branch": "dev", "token": "aaaaaa"}
+            "https://example.com",
+            json={"branch": "dev", "token": "aaaaaa"},
+            timeout=mock.ANY,
+        )
+        assert result.branch == "dev"
+
+    async def test_build_retry(self):
+        bot = SirBot()
+        bot.load_plugin(RTDPlugin(build_retries=2, retry_delay=0))
+        rtd = bot["plugins"]["readthedocs"]
+        rtd._session.post = asynctest.CoroutineMock(
+            side_effect=[
+                asyncio.TimeoutError(),
+                _response(status=502, data={}),
+                _response(),
+            ]
+        )
+        rtd.register_project("test", build_url="https://example.com", jeton="aaaaaa")
+
+        result = await rtd.build("test")
+
+        assert result.triggered
+        assert result.attempts == 3
+        assert rtd.metrics["rtd_build_retry"] == 2
+        await bot.http_session.close()
+
+    async def test_build_failed(self):
+        bot = SirBot()
+        bot.load_plugin(RTDPlugin(build_retries=1, retry_delay=0))
+        rtd = bot["plugins"]["readthedocs"]
+        rtd.register_project("test", build_url="https://example.com", jeton="aaaaaa")
+
+        rtd._session.post = asynctest.CoroutineMock(
+            return_value=_response(status=403, data={"detail": "invalid token"})
+        )
+        result = await rtd.build("test")
+        assert not result.ok
+        assert not result.triggered
+        assert result.attempts == 1
+
+        rtd._session.post = asynctest.CoroutineMock(
+            side_effect=aiohttp.ClientConnectionError()
+        )
+        with pytest.raises(aiohttp.ClientConnectionError):
+            await rtd.build("test")
+        assert rtd._session.post.call_count == 2
+        assert rtd.metrics["rtd_build_failed"] == 2
+        await bot.http_session.close()
+
+    async def test_build_connection_pool(self, aiohttp_server):
+        async def build(request):
+            return web.json_response({"build_triggered": True})
+
+        rtd_api = web.Application()
+        rtd_api.router.add_post("/build", build)
+        server = await aiohttp_server(rtd_api)
+
+        bot = SirBot()
+        bot.load_plugin(RTDPlugin())
+        rtd = bot["plugins"]["readthedocs"]
+        rtd.register_project(
+            "test", build_url=str(server.make_url("/build")), jeton="a"
+        )
+
+        results = await rtd.build_many(
+            [("test", f"branch-{i}") for i in range(2000)], max_concurrency=20
+        )
+
+        assert all(result.triggered for result in results)
+        connector = bot.http_session.connector
+        assert not connector._acquired
+        assert len(connector._conns) <= 1
+        assert sum(len(conns) for conns in connector._conns.values()) <= 20
+        await bot.http_session.close()
+
+    async def test_build_coalesced(self, bot):
+        rtd = bot["plugins"]["readthedocs"]
+        rtd._session.post = asynctest.CoroutineMock(
+            side_effect=lambda *a, **kw: _response()
+        )
+        rtd.register_project("test", build_url="https://example.com", jeton="aaaaaa")
+
+        results = await asyncio.gather(
+            rtd.build("test"), rtd.build("test"), rtd.build("test", branch="dev")
+        )
+
+        assert results[0] is results[1]
+        assert results[2].branch == "dev"
+        assert rtd._session.post.call_count == 2
+        assert rtd.metrics["rtd_build_coalesced"] == 1
+
+        await rtd.build("test")
+        assert rtd._session.post.call_count == 3
+
+    async def test_build_window(self):
+        bot = SirBot()
+        bot.load_plugin(RTDPlugin(build_window=0.05))
+        rtd = bot["plugins"]["readthedocs"]
+        rtd._session.post = asynctest.CoroutineMock(return_value=_response())
+        rtd.register_project("test", build_url="https://example.com", jeton="aaaaaa")
+
+        first = asyncio.ensure_future(rtd.build("test"))
+        await asyncio.sleep(0.01)
+        second = asyncio.ensure_future(rtd.build("test"))
+        await asyncio.gather(first, second)
+
+        assert rtd._session.post.call_count == 1
+        await bot.http_session.close()
+
+    async def test_build_many(self, bot):
+        rtd = bot["plugins"]["readthedocs"]
+        running = []
+        concurrency = []
+
+        async def post(url, json, timeout):
+            running.append(url)
+            concurrency.append(len(running))
+            await asyncio.sleep(0.01)
+            running.remove(url)
+            return _response(data={"build_triggered": True, "url": url})
+
+        rtd._session.post = asynctest.CoroutineMock(side_effect=post)
+        for i in range(6):
+            rtd.register_project(f"test{i}", build_url=f"https://{i}", jeton="aaaaaa")
+
+        results = await rtd.build_many(
+            [f"test{i}" for i in range(5)] + [("test5", "dev"), "unknown"],
+            max_concurrency=2,
+        )
+
+        assert [result.data["url"] for result in results[:6]] == [
+            f"https://{i}" for i in range(6)
+        ]
+        assert isinstance(results[6], KeyError)
+        assert max(concurrency) == 2
+        rtd._session.post.assert_any_call(
+            "https://5", json={"branch": "dev", "token": "aaaaaa"}, timeout=mock.ANY
         )
 
     async def test_register_handler(self, bot):
@@ -59,6 +221,20 @@ class TestPluginReadTheDocs:
         assert len(h) == 1
         assert h[0] is handler
 
+    async def test_register_handler_max_concurrency(self, bot):
+        handler = asynctest.CoroutineMock()
+
+        bot["plugins"]["readthedocs"].register_handler(
+            "test", handler, max_concurrency=2
+        )
+
+        h = list(bot["plugins"]["readthedocs"].dispatch({"slug": "test"}))
+        assert len(h) == 1
+        assert h[0].limiter.max_concurrency == 2
+
+        await h[0]({"slug": "test"}, bot)
+        handler.assert_called_once_with({"slug": "test"}, bot)
+
     async def test_register_multiple_handlers(self, bot):
         def handler():
             pass
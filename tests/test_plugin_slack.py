@@ -1,20 +1,29 @@
+import gc
 import re
+import copy
 import hmac
 import json
 import time
 import asyncio
 import hashlib
+import warnings
 import urllib.parse
 from typing import Dict, Tuple, Union, Optional
 from unittest import mock
 from collections import MutableMapping
 
+import slack
 import pytest
 import asynctest
+from aiohttp import web
 from aiohttp.web import json_response
-import slack
 from sirbot import SirBot
+from sirbot.ratelimit import RateLimiter
+from sirbot.concurrency import PRIORITY_LOW, PRIORITY_HIGH, PriorityScheduler
 from sirbot.plugins.slack import SlackPlugin
+from sirbot.plugins.slack.search import MessageIndex
+from sirbot.plugins.slack.metadata import FileMetadataStore
+from sirbot.plugins.slack.templates import Value, Template
 
 
 @pytest.fixture
@@ -208,6 +217,26 @@ class TestPluginSlack:
             ._routes["*"][None][msg_compile][1][0]
         )
 
+    async def test_register_priority(self, bot):
+        async def handler():
+            pass
+
+        bot["plugins"]["slack"].on_command("/hello", handler)
+        bot["plugins"]["slack"].on_command("/hello", handler, priority=PRIORITY_LOW)
+        bot["plugins"]["slack"].on_event("team_join", handler)
+
+        commands = bot["plugins"]["slack"].routers["command"]._routes["/hello"]
+        events = bot["plugins"]["slack"].routers["event"]._routes["team_join"]
+        assert commands[0][1]["priority"] == PRIORITY_HIGH
+        assert commands[1][1]["priority"] == PRIORITY_LOW
+        assert events["*"]["*"][0][1]["priority"] == PRIORITY_LOW
+
+    async def test_start_max_handlers(self):
+        plugin = SlackPlugin(
+            token="foo", verify="bar", bot_user_id="baz", bot_id="boo", max_handlers=5
+        )
+        assert plugin.scheduler.max_concurrency == 5
+
     async def test_register_admin_message_no_admin(self, caplog):
         async def handler():
             pass
@@ -277,6 +306,159 @@ class TestPluginSlack:
         await aiohttp_server(bot)
         assert bot["plugins"]["slack"].bot_id == "B00000000"
 
+    async def test_paginate(self, bot, aiohttp_server):
+        pages = [
+            {"ok": True, "members": [1, 2], "response_metadata": {"next_cursor": "a"}},
+            {"ok": True, "members": [3], "response_metadata": {"next_cursor": "b"}},
+            {"ok": True, "members": [4], "response_metadata": {"next_cursor": ""}},
+        ]
+        await aiohttp_server(bot)
+        query = asynctest.CoroutineMock(side_effect=pages)
+        bot["plugins"]["slack"].api.query = query
+
+        items = []
+        async for item in bot["plugins"]["slack"].paginate(slack.methods.USERS_LIST):
+            if item == 1:
+                # The second page is fetched while the first one is processed
+                await asyncio.sleep(0)
+                assert query.call_count > 1
+            items.append(item)
+
+        assert items == [1, 2, 3, 4]
+        assert query.call_count == 3
+        assert query.call_args_list[1][0][1]["cursor"] == "a"
+
+    async def test_paginate_rate_limited(self, bot, aiohttp_server):
+        rate_limited = slack.exceptions.RateLimited(0, "ratelimited", 429, {}, {})
+        pages = [rate_limited, {"ok": True, "channels": [1], "response_metadata": {}}]
+        await aiohttp_server(bot)
+        bot["plugins"]["slack"].api.query = asynctest.CoroutineMock(side_effect=pages)
+
+        items = [
+            item
+            async for item in bot["plugins"]["slack"].paginate(
+                slack.methods.CONVERSATIONS_LIST
+            )
+        ]
+
+        assert items == [1]
+        assert bot["plugins"]["slack"].metrics["api_rate_limited"] == 1
+
+    async def test_paginate_error(self, bot, aiohttp_server):
+        error = slack.exceptions.SlackAPIError("channel_not_found", {}, {})
+        await aiohttp_server(bot)
+        bot["plugins"]["slack"].api.query = asynctest.CoroutineMock(side_effect=error)
+
+        with pytest.raises(slack.exceptions.SlackAPIError):
+            async for _ in bot["plugins"]["slack"].paginate(
+                slack.methods.CONVERSATIONS_HISTORY, {"channel": "C00000A00"}
+            ):
+                pass
+
+    async def test_paginate_to(self, bot, aiohttp_server):
+        pages = [{"ok": True, "members": [1, 2], "response_metadata": {}}]
+        await aiohttp_server(bot)
+        bot["plugins"]["slack"].api.query = asynctest.CoroutineMock(side_effect=pages)
+        callback = asynctest.CoroutineMock()
+
+        count = await bot["plugins"]["slack"].paginate_to(
+            callback, slack.methods.CONVERSATIONS_MEMBERS, {"channel": "C00000A00"}
+        )
+
+        assert count == 2
+        assert callback.call_count == 2
+
+    async def test_broadcast(self, bot, aiohttp_server):
+        await aiohttp_server(bot)
+        bot["plugins"]["slack"].api.query = asynctest.CoroutineMock(
+            return_value={"ok": True}
+        )
+        targets = [f"C{i}" for i in range(20)]
+
+        broadcast = bot["plugins"]["slack"].broadcast(
+            targets, {"text": "hello"}, concurrency=5
+        )
+        results = await broadcast.wait()
+
+        assert sorted(result.target for result in results) == sorted(targets)
+        assert all(result.ok for result in results)
+        assert broadcast.sent == 20
+        assert broadcast.throughput > 0
+        assert bot["plugins"]["slack"].metrics["broadcast_sent"] == 20
+        data = bot["plugins"]["slack"].api.query.call_args[0][1]
+        assert data["text"] == "hello"
+
+    async def test_broadcast_concurrency(self, bot, aiohttp_server):
+        running = 0
+        max_running = 0
+
+        async def query(*args, **kwargs):
+            nonlocal running, max_running
+            running += 1
+            max_running = max(running, max_running)
+            await asyncio.sleep(0.01)
+            running -= 1
+            return {"ok": True}
+
+        await aiohttp_server(bot)
+        bot["plugins"]["slack"].api.query = query
+
+        await bot["plugins"]["slack"].broadcast(
+            range(20), {"text": "hello"}, concurrency=3
+        ).wait()
+
+        assert max_running == 3
+
+    async def test_broadcast_failures(self, bot, aiohttp_server):
+        async def query(method, data):
+            if data["channel"] == "missing":
+                raise slack.exceptions.SlackAPIError("channel_not_found", {}, {})
+            elif data["channel"] == "flaky" and query.calls < 1:
+                query.calls += 1
+                raise slack.exceptions.HTTPException(503, {}, {})
+            elif data["channel"] == "limited" and query.limited < 1:
+                query.limited += 1
+                raise slack.exceptions.RateLimited(0, "ratelimited", 429, {}, {})
+            return {"ok": True}
+
+        query.calls = 0
+        query.limited = 0
+        await aiohttp_server(bot)
+        bot["plugins"]["slack"].api.query = query
+
+        broadcast = bot["plugins"]["slack"].broadcast(
+            ["missing", "flaky", "limited", "ok"], {"text": "hello"}, backoff=0
+        )
+        results = {result.target: result async for result in broadcast}
+
+        assert not results["missing"].ok
+        assert results["missing"].attempts == 1
+        assert results["flaky"].ok
+        assert results["flaky"].attempts == 2
+        assert results["limited"].ok
+        assert results["ok"].ok
+        assert broadcast.sent == 3
+        assert broadcast.failed == 1
+        assert broadcast.retries == 2
+
+    async def test_broadcast_unexpected_error(self, bot, aiohttp_server):
+        async def query(method, data):
+            if data["channel"] == "broken":
+                raise TypeError("Object of type bytes is not JSON serializable")
+            return {"ok": True}
+
+        await aiohttp_server(bot)
+        bot["plugins"]["slack"].api.query = query
+
+        broadcast = bot["plugins"]["slack"].broadcast(
+            ["broken", "ok"], {"text": "hello"}, concurrency=1
+        )
+        results = await asyncio.wait_for(broadcast.wait(), 1)
+
+        assert [result.ok for result in results] == [False, True]
+        assert isinstance(results[0].error, TypeError)
+        assert broadcast.failed == 1
+
 
 class TestPluginSlackEndpoints:
     async def test_incoming_event(self, bot, aiohttp_client, slack_event):
@@ -643,6 +825,230 @@ class TestPluginSlackEndpoints:
         assert r.status == 200
         assert (await r.text()) == ""
 
+    @pytest.mark.parametrize("slack_event", ("reaction_added",), indirect=True)
+    async def test_prefilter_unrouted_event(self, bot, aiohttp_client, slack_event):
+        bot["plugins"]["slack"].prefilter = True
+        bot["plugins"]["slack"].routers["event"].dispatch = mock.MagicMock()
+
+        client = await aiohttp_client(bot)
+        r = await client.post("/slack/events", json=slack_event)
+        assert r.status == 200
+        assert bot["plugins"]["slack"].routers["event"].dispatch.call_count == 0
+        assert bot["plugins"]["slack"].metrics["prefilter_dropped"] == 1
+
+    @pytest.mark.parametrize("slack_event", ("reaction_added",), indirect=True)
+    async def test_prefilter_routed_event(self, bot, aiohttp_client, slack_event):
+        handler = asynctest.CoroutineMock()
+        bot["plugins"]["slack"].prefilter = True
+        bot["plugins"]["slack"].on_event("reaction_added", handler)
+
+        client = await aiohttp_client(bot)
+        r = await client.post("/slack/events", json=slack_event)
+        assert r.status == 200
+        assert handler.call_count == 1
+        assert bot["plugins"]["slack"].metrics["prefilter_dropped"] == 0
+
+    @pytest.mark.parametrize("slack_event", ("reaction_added",), indirect=True)
+    async def test_prefilter_wrong_token(self, bot, aiohttp_client, slack_event):
+        bot["plugins"]["slack"].prefilter = True
+        bot["plugins"]["slack"].verify = "bar"
+
+        client = await aiohttp_client(bot)
+        r = await client.post("/slack/events", json=slack_event)
+        assert r.status == 401
+
+    @pytest.mark.parametrize("slack_message", ("edit",), indirect=True)
+    async def test_prefilter_message_subtype(self, bot, aiohttp_client, slack_message):
+        handler = asynctest.CoroutineMock()
+        bot["plugins"]["slack"].prefilter = True
+        bot["plugins"]["slack"].on_message("hello", handler, subtype="bot_message")
+
+        client = await aiohttp_client(bot)
+        r = await client.post("/slack/events", json=slack_message)
+        assert r.status == 200
+        assert handler.call_count == 0
+        assert bot["plugins"]["slack"].metrics["prefilter_dropped"] == 1
+
+    @pytest.mark.parametrize("slack_message", ("edit",), indirect=True)
+    async def test_prefilter_message_any_subtype(
+        self, bot, aiohttp_client, slack_message
+    ):
+        handler = asynctest.CoroutineMock()
+        bot["plugins"]["slack"].prefilter = True
+        bot["plugins"]["slack"].on_message("hello", handler)
+
+        client = await aiohttp_client(bot)
+        r = await client.post("/slack/events", json=slack_message)
+        assert r.status == 200
+        assert handler.call_count == 1
+
+    @pytest.mark.parametrize("slack_event", ("reaction_added",), indirect=True)
+    async def test_handler_max_concurrency(self, bot, aiohttp_client, slack_event):
+        event = asyncio.Event()
+        handler = asynctest.CoroutineMock(side_effect=lambda *args: event.wait())
+        bot["plugins"]["slack"].on_event(
+            "reaction_added", handler, wait=False, max_concurrency=1, queue_size=1
+        )
+
+        client = await aiohttp_client(bot)
+        for _ in range(3):
+            r = await client.post("/slack/events", json=slack_event)
+            assert r.status == 200
+
+        assert handler.call_count == 1
+        assert bot["plugins"]["slack"].metrics["handler_rejected"] == 1
+
+        event.set()
+        await asyncio.sleep(0.1)
+        assert handler.call_count == 2
+
+    @pytest.mark.parametrize("slack_event", ("reaction_added",), indirect=True)
+    async def test_handler_priority(
+        self, bot, aiohttp_client, slack_event, slack_command
+    ):
+        gate = asyncio.Event()
+        order = []
+
+        async def event_handler(event, app):
+            order.append("event")
+            await gate.wait()
+
+        async def command_handler(command, app):
+            order.append("command")
+
+        bot["plugins"]["slack"].scheduler = PriorityScheduler(1)
+        bot["plugins"]["slack"].on_event("reaction_added", event_handler, wait=False)
+        bot["plugins"]["slack"].on_command("/test", command_handler)
+
+        client = await aiohttp_client(bot)
+        await client.post("/slack/events", json=slack_event)
+        await client.post("/slack/events", json=slack_event)
+        command = asyncio.ensure_future(
+            client.post("/slack/commands", data=slack_command)
+        )
+        await asyncio.sleep(0.1)
+        assert order == ["event"]
+
+        gate.set()
+        r = await command
+        assert r.status == 200
+        await asyncio.sleep(0.1)
+        assert order == ["event", "command", "event"]
+
+    async def test_command_rate_limit(self, bot, aiohttp_client, slack_command):
+        handler = asynctest.CoroutineMock(return_value=None)
+        bot["plugins"]["slack"].on_command(
+            "/test",
+            handler,
+            rate_limit=RateLimiter(rate=0.001),
+            rate_limit_message="slow down",
+        )
+
+        client = await aiohttp_client(bot)
+        r = await client.post("/slack/commands", data=slack_command)
+        assert r.status == 200
+        assert (await r.text()) == ""
+
+        r = await client.post("/slack/commands", data=slack_command)
+        assert r.status == 200
+        assert (await r.json()) == {"response_type": "ephemeral", "text": "slow down"}
+        assert handler.call_count == 1
+        assert bot["plugins"]["slack"].metrics["rate_limited"] == 1
+
+    @pytest.mark.parametrize("slack_message", ("simple",), indirect=True)
+    async def test_message_rate_limit(self, bot, aiohttp_client, slack_message):
+        handler = asynctest.CoroutineMock()
+        bot["plugins"]["slack"].on_message(
+            "hello",
+            handler,
+            rate_limit=RateLimiter(rate=0.001),
+            rate_limit_by=("user", "channel", "team"),
+            rate_limit_message="slow down",
+        )
+
+        client = await aiohttp_client(bot)
+        bot["plugins"]["slack"].api.query = asynctest.CoroutineMock()
+        for _ in range(3):
+            r = await client.post("/slack/events", json=slack_message)
+            assert r.status == 200
+
+        assert handler.call_count == 1
+        assert bot["plugins"]["slack"].metrics["rate_limited"] == 2
+        bot["plugins"]["slack"].api.query.assert_called_with(
+            slack.methods.CHAT_POST_EPHEMERAL,
+            data={"channel": "C00000A00", "user": "U000AA000", "text": "slow down"},
+        )
+
+    @pytest.mark.parametrize("slack_message", ("simple",), indirect=True)
+    async def test_bot_message_rate_limit(self, bot, aiohttp_client, slack_message):
+        handler = asynctest.CoroutineMock()
+        bot["plugins"]["slack"].on_message(
+            "hello",
+            handler,
+            rate_limit=RateLimiter(rate=0.001),
+            rate_limit_message="slow down",
+        )
+
+        client = await aiohttp_client(bot)
+        bot["plugins"]["slack"].api.query = asynctest.CoroutineMock()
+        for bot_id in ("B000AA000", "B000BB000"):
+            message = copy.deepcopy(slack_message)
+            del message["event"]["user"]
+            message["event"]["subtype"] = "bot_message"
+            message["event"]["bot_id"] = bot_id
+            for _ in range(3):
+                r = await client.post("/slack/events", json=message)
+                assert r.status == 200
+
+        assert handler.call_count == 2
+        assert bot["plugins"]["slack"].metrics["rate_limited"] == 4
+        assert bot["plugins"]["slack"].api.query.call_count == 0
+
+    @pytest.mark.parametrize("slack_message", ("simple",), indirect=True)
+    async def test_message_rate_limit_drop(self, bot, aiohttp_client, slack_message):
+        handler = asynctest.CoroutineMock()
+        limiter = RateLimiter(rate=0.001)
+        bot["plugins"]["slack"].on_message("hello", handler, rate_limit=limiter)
+
+        client = await aiohttp_client(bot)
+        bot["plugins"]["slack"].api.query = asynctest.CoroutineMock()
+        for _ in range(2):
+            r = await client.post("/slack/events", json=slack_message)
+            assert r.status == 200
+
+        assert handler.call_count == 1
+        assert limiter.shed == 1
+        assert bot["plugins"]["slack"].api.query.call_count == 0
+
+    async def test_command_cache(self, bot, aiohttp_client, slack_command):
+        calls = 0
+
+        async def handler(command, app):
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return json_response(data={"text": command["text"]})
+
+        bot["plugins"]["slack"].on_command("/test", handler, cache=60)
+
+        client = await aiohttp_client(bot)
+        responses = await asyncio.gather(
+            *(client.post("/slack/commands", data=slack_command) for _ in range(3))
+        )
+        responses.append(await client.post("/slack/commands", data=slack_command))
+
+        for r in responses:
+            assert r.status == 200
+            assert (await r.json()) == {"text": slack_command["text"]}
+        assert calls == 1
+        assert bot["plugins"]["slack"].metrics["cache_miss"] == 1
+        assert bot["plugins"]["slack"].metrics["cache_coalesced"] == 2
+        assert bot["plugins"]["slack"].metrics["cache_hit"] == 1
+
+        slack_command["text"] = "other"
+        await client.post("/slack/commands", data=slack_command)
+        assert calls == 2
+
     async def test_handler_no_wait(self, bot, aiohttp_client, slack_event):
         global sentinel
         sentinel = False
@@ -669,3 +1075,699 @@ class TestPluginSlackEndpoints:
 
         await asyncio.sleep(0.5)
         assert sentinel
+
+
+@pytest.fixture
+async def socket_mode_server(aiohttp_server):
+    envelopes = []
+    acks = asyncio.Queue()
+    sockets = []
+
+    async def handler(request):
+        ws = web.WebSocketResponse()
+        sockets.append(ws)
+        await ws.prepare(request)
+        await ws.send_json({"type": "hello"})
+        for envelope in envelopes:
+            await ws.send_json(envelope)
+        async for message in ws:
+            await acks.put(json.loads(message.data))
+        return ws
+
+    async def close(app):
+        for ws in sockets:
+            await ws.close()
+
+    app = web.Application()
+    app.router.add_get("/socket", handler)
+    app.on_shutdown.append(close)
+    server = await aiohttp_server(app)
+    server.envelopes = envelopes
+    server.acks = acks
+    return server
+
+
+@pytest.fixture
+async def socket_mode_bot(socket_mode_server, request):
+    b = SirBot()
+    plugin = SlackPlugin(
+        token="foo",
+        app_token="xapp-foo",
+        bot_user_id="baz",
+        bot_id="boo",
+        socket_mode_connections=getattr(request, "param", 1),
+    )
+    plugin.socket_mode.url = str(socket_mode_server.make_url("/socket"))
+    b.load_plugin(plugin)
+    return b
+
+
+class TestPluginSlackSocketMode:
+    async def test_no_http_endpoints(self, aiohttp_client, socket_mode_bot):
+        assert socket_mode_bot["plugins"]["slack"].verify is None
+
+        client = await aiohttp_client(socket_mode_bot)
+        r = await client.post("/slack/events", json={})
+        assert r.status == 404
+
+    @pytest.mark.parametrize("slack_event", ("reaction_added",), indirect=True)
+    async def test_event(
+        self, aiohttp_client, socket_mode_server, socket_mode_bot, slack_event
+    ):
+        envelope = {"envelope_id": "1", "type": "events_api", "payload": slack_event}
+        socket_mode_server.envelopes.append(envelope)
+        handler = asynctest.CoroutineMock(return_value=None)
+        socket_mode_bot["plugins"]["slack"].on_event("reaction_added", handler)
+
+        await aiohttp_client(socket_mode_bot)
+        ack = await asyncio.wait_for(socket_mode_server.acks.get(), 5)
+
+        assert ack == {"envelope_id": "1"}
+        assert handler.call_count == 1
+        assert handler.call_args[0][0]["type"] == "reaction_added"
+        assert socket_mode_bot["plugins"]["slack"].metrics["socket_mode_envelopes"] == 1
+
+    async def test_command_response(
+        self, aiohttp_client, socket_mode_server, socket_mode_bot, slack_command
+    ):
+        envelope = {
+            "envelope_id": "2",
+            "type": "slash_commands",
+            "accepts_response_payload": True,
+            "payload": slack_command,
+        }
+        socket_mode_server.envelopes.append(envelope)
+
+        async def handler(command, app):
+            return json_response(data={"text": "pong"})
+
+        socket_mode_bot["plugins"]["slack"].on_command("/test", handler)
+
+        await aiohttp_client(socket_mode_bot)
+        ack = await asyncio.wait_for(socket_mode_server.acks.get(), 5)
+
+        assert ack == {"envelope_id": "2", "payload": {"text": "pong"}}
+
+    @pytest.mark.parametrize("socket_mode_bot", (3,), indirect=True)
+    async def test_connections(self, aiohttp_client, socket_mode_bot):
+        socket_mode = socket_mode_bot["plugins"]["slack"].socket_mode
+
+        await aiohttp_client(socket_mode_bot)
+        for _ in range(50):
+            if socket_mode.connected == 3:
+                break
+            await asyncio.sleep(0.01)
+
+        assert socket_mode.connected == 3
+
+    async def test_reconnect(self, aiohttp_client, socket_mode_server, socket_mode_bot):
+        socket_mode_server.envelopes.append(
+            {"type": "disconnect", "reason": "refresh_requested"}
+        )
+        socket_mode = socket_mode_bot["plugins"]["slack"].socket_mode
+        socket_mode._open = asynctest.CoroutineMock(return_value=socket_mode.url)
+
+        await aiohttp_client(socket_mode_bot)
+        for _ in range(50):
+            if socket_mode._open.call_count >= 2:
+                break
+            await asyncio.sleep(0.01)
+
+        assert socket_mode._open.call_count >= 2
+
+
+class TestPluginSlackTemplate:
+    def test_render(self):
+        layout = {
+            "channel": "{channel}",
+            "blocks": [
+                {"type": "section", "text": {"type": "mrkdwn", "text": "*{title}*"}},
+                Value("fields"),
+                {"type": "context", "elements": ["{{literal}}", 1, True, None]},
+            ],
+        }
+        template = Template(layout)
+        fields = {"type": "section", "fields": [{"type": "plain_text", "text": "a"}]}
+
+        body = template.render(channel="C00000A00", title='"quoted"\n', fields=fields)
+
+        expected = {
+            "channel": "C00000A00",
+            "blocks": [
+                {"type": "section", "text": {"type": "mrkdwn", "text": '*"quoted"\n*'}},
+                fields,
+                {"type": "context", "elements": ["{literal}", 1, True, None]},
+            ],
+        }
+        assert body == json.dumps(expected)
+        assert template.fields == {"channel", "title", "fields"}
+
+    def test_render_missing(self):
+        with pytest.raises(KeyError):
+            Template({"text": "{text}"}).render()
+
+    async def test_query_template(self, bot, aiohttp_server):
+        await aiohttp_server(bot)
+        bot["plugins"]["slack"].api._request = asynctest.CoroutineMock(
+            return_value=(200, b'{"ok": true}', {"content-type": "application/json"})
+        )
+        template = Template({"channel": "{channel}", "text": "hello {name}"})
+
+        response = await bot["plugins"]["slack"].query_template(
+            template, channel="C00000A00", name="world"
+        )
+
+        assert response == {"ok": True}
+        method, url, headers, body = bot["plugins"]["slack"].api._request.call_args[0]
+        assert url == "https://slack.com/api/chat.postMessage"
+        assert headers["Authorization"] == "Bearer foo"
+        assert json.loads(body) == {"channel": "C00000A00", "text": "hello world"}
+
+        await bot["plugins"]["slack"].query_template(
+            template, url="chat.postMessage", channel="C00000A00", name="world"
+        )
+        method, url, headers, body = bot["plugins"]["slack"].api._request.call_args[0]
+        assert url == "https://slack.com/api/chat.postMessage"
+        assert headers["Content-type"] == "application/json; charset=utf-8"
+        assert json.loads(body) == {"channel": "C00000A00", "text": "hello world"}
+
+        with pytest.raises(ValueError):
+            await bot["plugins"]["slack"].query_template(
+                template, url="unknown.method", channel="C00000A00", name="world"
+            )
+        assert bot["plugins"]["slack"].api._request.call_count == 2
+
+
+async def _slack_files_server(aiohttp_server, token="foo"):
+    uploads = []
+
+    async def upload(request):
+        assert request.headers["Authorization"] == f"Bearer {token}"
+        fields = {}
+        reader = await request.multipart()
+        async for part in reader:
+            if part.filename:
+                size = 0
+                while True:
+                    chunk = await part.read_chunk()
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                fields[part.name] = (part.filename, size)
+            else:
+                fields[part.name] = await part.text()
+        uploads.append(fields)
+        return web.json_response({"ok": True, "file": {"id": "F000AAA0A"}})
+
+    async def download(request):
+        assert request.headers["Authorization"] == f"Bearer {token}"
+        response = web.StreamResponse()
+        await response.prepare(request)
+        for _ in range(64):
+            await response.write(b"x" * 16384)
+        return response
+
+    app = web.Application()
+    app.router.add_post("/api/files.upload", upload)
+    app.router.add_get("/files/report.txt", download)
+    server = await aiohttp_server(app)
+    server.uploads = uploads
+    return server
+
+
+class TestPluginSlackFiles:
+    async def test_upload_path(self, bot, aiohttp_server, aiohttp_client, tmpdir):
+        path = tmpdir.join("report.txt")
+        path.write_binary(b"x" * 1_000_000)
+        slack_files_server = await _slack_files_server(aiohttp_server)
+        await aiohttp_client(bot)
+
+        response = await bot["plugins"]["slack"].upload_file(
+            str(path),
+            channels="C00000A00",
+            url=str(slack_files_server.make_url("/api/files.upload")),
+        )
+
+        assert response["file"]["id"] == "F000AAA0A"
+        assert slack_files_server.uploads == [
+            {
+                "channels": "C00000A00",
+                "filename": "report.txt",
+                "file": ("report.txt", 1_000_000),
+            }
+        ]
+
+    async def test_upload_iterator(self, bot, aiohttp_server, aiohttp_client):
+        async def chunks():
+            for _ in range(10):
+                yield b"x" * 1000
+
+        slack_files_server = await _slack_files_server(aiohttp_server)
+        await aiohttp_client(bot)
+
+        await bot["plugins"]["slack"].upload_file(
+            chunks(),
+            filename="log.txt",
+            url=str(slack_files_server.make_url("/api/files.upload")),
+        )
+
+        assert slack_files_server.uploads[0]["file"] == ("log.txt", 10000)
+
+    async def test_download_path(self, bot, aiohttp_server, aiohttp_client, tmpdir):
+        path = tmpdir.join("report.txt")
+        slack_files_server = await _slack_files_server(aiohttp_server)
+        await aiohttp_client(bot)
+
+        size = await bot["plugins"]["slack"].download_file(
+            str(slack_files_server.make_url("/files/report.txt")), str(path)
+        )
+
+        assert size == 64 * 16384
+        assert path.read_binary() == b"x" * size
+
+    async def test_download_consumer(self, bot, aiohttp_server, aiohttp_client):
+        chunks = []
+
+        async def consumer(chunk):
+            chunks.append(len(chunk))
+
+        slack_files_server = await _slack_files_server(aiohttp_server)
+        await aiohttp_client(bot)
+
+        size = await bot["plugins"]["slack"].download_file(
+            str(slack_files_server.make_url("/files/report.txt")), consumer
+        )
+
+        assert sum(chunks) == size == 64 * 16384
+        assert max(chunks) <= 64 * 1024
+
+
+@pytest.fixture
+def team_store():
+    return asynctest.CoroutineMock(
+        return_value={"token": "xoxb-T1", "bot_id": "B1", "bot_user_id": "U1"}
+    )
+
+
+@pytest.fixture
+async def teams_bot(team_store, request):
+    b = SirBot()
+    b.load_plugin(
+        SlackPlugin(
+            token="foo",
+            verify="supersecuretoken",
+            team_store=team_store,
+            max_teams=getattr(request, "param", 100),
+        )
+    )
+    return b
+
+
+class TestPluginSlackTeams:
+    @pytest.mark.parametrize("teams_bot", (2,), indirect=True)
+    async def test_registry(self, aiohttp_client, team_store, teams_bot):
+        async def store(team_id):
+            await asyncio.sleep(0)
+            if team_id.startswith("T"):
+                return {"token": f"xoxb-{team_id}", "bot_id": "B1", "bot_user_id": "U1"}
+
+        team_store.side_effect = store
+        await aiohttp_client(teams_bot)
+        slack_plugin = teams_bot["plugins"]["slack"]
+
+        teams = await asyncio.gather(*(slack_plugin.get_team("T1") for _ in range(5)))
+        assert team_store.call_count == 1
+        assert all(team is teams[0] for team in teams)
+        assert teams[0].token == "xoxb-T1"
+        assert teams[0].api._session is teams_bot.http_session
+
+        await slack_plugin.get_team("T2")
+        await slack_plugin.get_team("T1")
+        await slack_plugin.get_team("T3")
+        assert "T1" in slack_plugin.teams
+        assert "T2" not in slack_plugin.teams
+        assert slack_plugin.metrics["team_evicted"] == 1
+
+        assert await slack_plugin.get_team("X1") is None
+
+    async def test_registry_auth_test(self, aiohttp_client, team_store, teams_bot):
+        team_store.return_value = {"token": "xoxb-T1"}
+        await aiohttp_client(teams_bot)
+
+        with asynctest.patch(
+            "slack.io.aiohttp.SlackAPI.query",
+            return_value={"ok": True, "user_id": "U1", "bot_id": "B1"},
+        ) as query:
+            team = await teams_bot["plugins"]["slack"].get_team("T1")
+
+        assert query.call_args[0][0] == slack.methods.AUTH_TEST
+        assert team.bot_id == "B1"
+        assert team.bot_user_id == "U1"
+
+    @pytest.mark.parametrize("slack_message", ("simple",), indirect=True)
+    async def test_message_mention(
+        self, aiohttp_client, slack_message, team_store, teams_bot
+    ):
+        handler = asynctest.CoroutineMock(return_value=None)
+        teams_bot["plugins"]["slack"].on_message(".*", handler, mention=True)
+        slack_message["event"]["text"] = "<@U1> hello"
+
+        client = await aiohttp_client(teams_bot)
+        r = await client.post("/slack/events", json=slack_message)
+
+        assert r.status == 200
+        assert team_store.call_args[0][0] == "T000AAA0A"
+        assert handler.call_count == 1
+        assert handler.call_args[0][0]["text"] == "hello"
+
+    @pytest.mark.parametrize("slack_event", ("reaction_added",), indirect=True)
+    async def test_unknown_team(
+        self, aiohttp_client, slack_event, team_store, teams_bot
+    ):
+        team_store.return_value = None
+        handler = asynctest.CoroutineMock()
+        teams_bot["plugins"]["slack"].on_event("reaction_added", handler)
+
+        client = await aiohttp_client(teams_bot)
+        r = await client.post("/slack/events", json=slack_event)
+
+        assert r.status == 200
+        assert handler.call_count == 0
+        assert teams_bot["plugins"]["slack"].metrics["unknown_team"] == 1
+
+    async def test_command(self, aiohttp_client, slack_command, team_store, teams_bot):
+        handler = asynctest.CoroutineMock(return_value=None)
+        teams_bot["plugins"]["slack"].on_command("/test", handler)
+
+        client = await aiohttp_client(teams_bot)
+        r = await client.post("/slack/commands", data=slack_command)
+
+        assert r.status == 200
+        assert team_store.call_args[0][0] == slack_command["team_id"]
+        assert handler.call_count == 1
+
+    async def test_team_client(self, aiohttp_client, teams_bot):
+        await aiohttp_client(teams_bot)
+        slack_plugin = teams_bot["plugins"]["slack"]
+        template = Template({"channel": "{channel}", "text": "hello"})
+
+        with asynctest.patch(
+            "slack.io.aiohttp.SlackAPI._request",
+            return_value=(
+                200,
+                b'{"ok": true, "members": ["U1"]}',
+                {"content-type": "application/json"},
+            ),
+        ) as request:
+            await slack_plugin.query_template(template, team="T1", channel="C1")
+            members = [
+                member
+                async for member in slack_plugin.paginate(
+                    slack.methods.CONVERSATIONS_MEMBERS, {"channel": "C1"}, team="T1"
+                )
+            ]
+            results = await slack_plugin.broadcast(
+                ["C1", "C2"], {"text": "hello"}, team="T1"
+            ).wait()
+
+        assert members == ["U1"]
+        assert all(result.ok for result in results)
+        assert request.call_count == 4
+        for method, url, headers, body in (c[0] for c in request.call_args_list):
+            if url.endswith("conversations.members"):
+                assert body["token"] == "xoxb-T1"
+            else:
+                assert headers["Authorization"] == "Bearer xoxb-T1"
+
+    async def test_team_broadcast_lazy(self, aiohttp_client, team_store, teams_bot):
+        await aiohttp_client(teams_bot)
+        gc.collect()
+
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            broadcast = teams_bot["plugins"]["slack"].broadcast(
+                ["C1"], {"text": "hello"}, team="T1"
+            )
+            del broadcast
+            gc.collect()
+
+        assert not caught
+        assert team_store.call_count == 0
+
+    async def test_team_files(self, aiohttp_client, aiohttp_server, tmpdir, teams_bot):
+        slack_files_server = await _slack_files_server(aiohttp_server, token="xoxb-T1")
+        await aiohttp_client(teams_bot)
+        path = tmpdir.join("report.txt")
+
+        size = await teams_bot["plugins"]["slack"].download_file(
+            str(slack_files_server.make_url("/files/report.txt")), str(path), team="T1"
+        )
+        await teams_bot["plugins"]["slack"].upload_file(
+            str(path),
+            url=str(slack_files_server.make_url("/api/files.upload")),
+            team="T1",
+        )
+
+        assert size == 64 * 16384
+        assert slack_files_server.uploads[0]["file"] == ("report.txt", size)
+
+    async def test_team_client_unknown(self, aiohttp_client, team_store, teams_bot):
+        team_store.return_value = None
+        await aiohttp_client(teams_bot)
+
+        with pytest.raises(LookupError):
+            await teams_bot["plugins"]["slack"].query_template(
+                Template({"text": "hello"}), team="T1"
+            )
+
+
+@pytest.fixture
+def metadata_store(tmpdir):
+    return FileMetadataStore(str(tmpdir.join("metadata.json")))
+
+
+@pytest.fixture
+async def metadata_bot(metadata_store, request):
+    b = SirBot()
+    b.load_plugin(
+        SlackPlugin(
+            token="foo",
+            verify="supersecuretoken",
+            metadata_store=metadata_store,
+            metadata_users=getattr(request, "param", False),
+        )
+    )
+    return b
+
+
+AUTH_TEST = {
+    "ok": True,
+    "url": "https://pyslackers.slack.com/",
+    "team": "pyslackers",
+    "team_id": "T000AAA0A",
+    "user": "sirbot",
+    "user_id": "U000AA000",
+    "bot_id": "B00000000",
+}
+
+
+class TestPluginSlackMetadata:
+    async def test_first_boot(self, aiohttp_client, metadata_store, metadata_bot):
+        metadata_bot["plugins"]["slack"].api.query = asynctest.CoroutineMock(
+            return_value=AUTH_TEST
+        )
+
+        await aiohttp_client(metadata_bot)
+
+        assert metadata_bot["plugins"]["slack"].bot_id == "B00000000"
+        assert metadata_bot["plugins"]["slack"].bot_user_id == "U000AA000"
+        assert metadata_bot["plugins"]["slack"].team_info["name"] == "pyslackers"
+        metadata = await metadata_store.load(
+            metadata_bot["plugins"]["slack"]._metadata_key()
+        )
+        assert metadata["bot_id"] == "B00000000"
+
+    async def test_stored(self, aiohttp_client, metadata_store, metadata_bot):
+        await metadata_store.save(
+            metadata_bot["plugins"]["slack"]._metadata_key(),
+            {"bot_id": "B0", "bot_user_id": "U0", "team": {"id": "T000AAA0A"}},
+        )
+        refreshed = asyncio.Event()
+
+        async def query(*args, **kwargs):
+            await refreshed.wait()
+            return AUTH_TEST
+
+        metadata_bot["plugins"]["slack"].api.query = query
+
+        await aiohttp_client(metadata_bot)
+
+        assert metadata_bot["plugins"]["slack"].bot_id == "B0"
+        assert metadata_bot["plugins"]["slack"].team_info == {"id": "T000AAA0A"}
+
+        refreshed.set()
+        await metadata_bot["plugins"]["slack"]._metadata_refresh
+        assert metadata_bot["plugins"]["slack"].bot_id == "B00000000"
+        metadata = await metadata_store.load(
+            metadata_bot["plugins"]["slack"]._metadata_key()
+        )
+        assert metadata["team"]["url"] == "https://pyslackers.slack.com/"
+
+    @pytest.mark.parametrize("metadata_bot", (True,), indirect=True)
+    async def test_users(self, aiohttp_client, metadata_store, metadata_bot):
+        users = {"ok": True, "members": [{"id": "U1"}, {"id": "U2"}]}
+        metadata_bot["plugins"]["slack"].api.query = asynctest.CoroutineMock(
+            side_effect=[AUTH_TEST, users]
+        )
+
+        await aiohttp_client(metadata_bot)
+
+        assert set(metadata_bot["plugins"]["slack"].users) == {"U1", "U2"}
+        metadata = await metadata_store.load(
+            metadata_bot["plugins"]["slack"]._metadata_key()
+        )
+        assert len(metadata["users"]) == 2
+
+
+class TestMessageIndex:
+    def test_search(self):
+        index = MessageIndex()
+        index.add("C1", "1.0", "The quick brown fox", "U1")
+        index.add("C1", "2.0", "A brown dog jumps over the fox", "U2")
+        index.add("C2", "3.0", "quick fox", "U1")
+
+        assert [r["ts"] for r in index.search("fox")] == ["3.0", "2.0", "1.0"]
+        assert [r["ts"] for r in index.search("brown FOX")] == ["2.0", "1.0"]
+        assert [r["ts"] for r in index.search('"brown fox"')] == ["1.0"]
+        assert [r["ts"] for r in index.search("fox", channel="C2")] == ["3.0"]
+        assert [r["ts"] for r in index.search("fox", limit=1)] == ["3.0"]
+        assert index.search("cat") == []
+        assert index.search("") == []
+        assert index.search("fox")[0] == {
+            "channel": "C2",
+            "ts": "3.0",
+            "user": "U1",
+            "text": "quick fox",
+        }
+
+    def test_edit_delete(self):
+        index = MessageIndex()
+        index.handle({"channel": "C1", "ts": "1.0", "text": "hello world"})
+        index.handle(
+            {
+                "channel": "C1",
+                "subtype": "message_changed",
+                "message": {"ts": "1.0", "text": "goodbye world"},
+            }
+        )
+        assert index.search("hello") == []
+        assert len(index.search("goodbye")) == 1
+
+        index.handle(
+            {"channel": "C1", "subtype": "message_deleted", "deleted_ts": "1.0"}
+        )
+        assert index.search("world") == []
+        assert len(index) == 0
+        assert index._postings == {}
+
+    def test_ignored_subtypes(self):
+        index = MessageIndex()
+        index.handle(
+            {"channel": "C1", "ts": "1.0", "subtype": "channel_join", "text": "joined"}
+        )
+        assert len(index) == 0
+
+    def test_eviction(self):
+        index = MessageIndex(max_age=100, max_messages=3)
+        now = time.time()
+        index.add("C1", str(now - 200), "old")
+        assert len(index) == 0
+
+        for i in range(5):
+            index.add("C1", str(now + i), f"message {i}")
+        assert len(index) == 3
+        assert [r["text"] for r in index.search("message")] == [
+            "message 4",
+            "message 3",
+            "message 2",
+        ]
+
+    def test_snapshot(self, tmpdir):
+        path = str(tmpdir.join("index.jsonl.gz"))
+        index = MessageIndex()
+        index.add("C1", "1.0", "hello world", "U1")
+        index.save(path)
+
+        restored = MessageIndex()
+        restored.restore(path)
+        assert restored.search("hello") == index.search("hello")
+
+
+class TestPluginSlackSearch:
+    @pytest.mark.parametrize("slack_message", ("simple",), indirect=True)
+    async def test_incoming_message(self, bot, aiohttp_client, slack_message):
+        bot["plugins"]["slack"].search_index = MessageIndex()
+        bot["plugins"]["slack"].prefilter = True
+
+        client = await aiohttp_client(bot)
+        r = await client.post("/slack/events", json=slack_message)
+
+        assert r.status == 200
+        results = bot["plugins"]["slack"].search_index.search(
+            slack_message["event"]["text"]
+        )
+        assert results[0]["ts"] == slack_message["event"]["ts"]
+
+    async def test_backfill(self, bot, aiohttp_server):
+        history = {
+            "ok": True,
+            "messages": [
+                {"type": "message", "ts": "2.0", "user": "U1", "text": "hello"},
+                {
+                    "type": "message",
+                    "ts": "1.0",
+                    "subtype": "channel_join",
+                    "text": "x",
+                },
+            ],
+            "has_more": False,
+        }
+        bot["plugins"]["slack"].search_index = MessageIndex()
+        await aiohttp_server(bot)
+        bot["plugins"]["slack"].api.query = asynctest.CoroutineMock(
+            return_value=history
+        )
+
+        count = await bot["plugins"]["slack"].backfill_search_index("C1")
+
+        assert count == 2
+        assert len(bot["plugins"]["slack"].search_index) == 1
+        assert (
+            bot["plugins"]["slack"].search_index.search("hello")[0]["channel"] == "C1"
+        )
+
+    async def test_snapshot(self, aiohttp_client, tmpdir):
+        path = str(tmpdir.join("index.jsonl.gz"))
+        index = MessageIndex()
+        index.add("C1", "1.0", "hello world")
+        index.save(path)
+
+        bot = SirBot()
+        bot.load_plugin(
+            SlackPlugin(
+                token="foo",
+                verify="supersecuretoken",
+                bot_id="boo",
+                search_index=MessageIndex(),
+                search_snapshot=path,
+            )
+        )
+        client = await aiohttp_client(bot)
+        assert len(bot["plugins"]["slack"].search_index) == 1
+
+        bot["plugins"]["slack"].search_index.add("C1", "2.0", "second")
+        await client.close()
+
+        restored = MessageIndex()
+        restored.restore(path)
+        assert len(restored) == 2
@@ -0,0 +1,30 @@
+from unittest import mock
+
+from sirbot.ratelimit import RateLimiter
+
+
+class TestRateLimiter:
+    def test_burst(self):
+        limiter = RateLimiter(rate=1, burst=2)
+        assert limiter.allow("a")
+        assert limiter.allow("a")
+        assert not limiter.allow("a")
+        assert limiter.allow("b")
+        assert limiter.shed == 1
+
+    def test_refill(self):
+        limiter = RateLimiter(rate=10, burst=1)
+        with mock.patch("time.monotonic", return_value=100.0):
+            assert limiter.allow("a")
+            assert not limiter.allow("a")
+        with mock.patch("time.monotonic", return_value=100.5):
+            assert limiter.allow("a")
+            assert not limiter.allow("a")
+
+    def test_max_keys(self):
+        limiter = RateLimiter(rate=0.001, max_keys=2)
+        assert limiter.allow("a")
+        assert limiter.allow("b")
+        assert limiter.allow("c")
+        assert list(limiter._buckets) == ["b", "c"]
+        assert limiter.allow("a")
@@ -1,5 +1,17 @@
+import glob
+import hmac
+import json
+import asyncio
+import hashlib
+from unittest import mock
+
 import pytest
+import asynctest
 from sirbot import SirBot
+from sirbot.replay import replay, _rotation_order
+from sirbot.recorder import Recorder, read_recording
+from sirbot.plugins.github import GithubPlugin
+from sirbot.plugins.readthedocs import RTDPlugin
 
 
 @pytest.mark.asyncio
@@ -61,3 +73,139 @@ class TestEndpoints:
         rep = await client.get("/sirbot/plugins")
         data = await rep.json()
         assert data == {"plugins": ["myplugin"]}
+
+    async def test_metrics(self, aiohttp_client):
+        class MyPlugin:
+            __name__ = "myplugin"
+
+            def __init__(self):
+                self.metrics = {"foo": 1}
+
+            def load(self, test_bot):
+                pass
+
+        bot = SirBot()
+        bot.load_plugin(MyPlugin())
+        client = await aiohttp_client(bot)
+        rep = await client.get("/sirbot/metrics")
+        data = await rep.json()
+        assert data == {"myplugin": {"foo": 1}}
+
+
+class TestRecorder:
+    async def test_record(self, aiohttp_client, tmpdir):
+        path = str(tmpdir.join("traffic.jsonl.gz"))
+        bot = SirBot(recorder=Recorder(path))
+        client = await aiohttp_client(bot)
+        await client.post("/readthedocs", data=b'{"a": "b"}')
+        await client.get("/sirbot/plugins")
+        await bot.recorder.flush()
+
+        records = list(read_recording(path))
+        assert len(records) == 1
+        assert records[0]["method"] == "POST"
+        assert records[0]["path"] == "/readthedocs"
+        assert records[0]["body"] == b'{"a": "b"}'
+
+    async def test_record_rotate(self, aiohttp_client, tmpdir):
+        path = str(tmpdir.join("traffic.jsonl.gz"))
+        bot = SirBot(recorder=Recorder(path, max_bytes=1, backups=2))
+        client = await aiohttp_client(bot)
+        for _ in range(3):
+            await client.post("/readthedocs", data=b"{}")
+            await bot.recorder.flush()
+
+        assert not tmpdir.join("traffic.jsonl.gz").exists()
+        assert len(list(read_recording(path + ".1"))) == 1
+        assert len(list(read_recording(path + ".2"))) == 1
+        assert not tmpdir.join("traffic.jsonl.gz.3").exists()
+
+    async def test_record_queue_full(self, aiohttp_client, tmpdir):
+        path = str(tmpdir.join("traffic.jsonl.gz"))
+        bot = SirBot(recorder=Recorder(path, queue_size=1))
+        client = await aiohttp_client(bot)
+        with mock.patch.object(
+            bot.recorder._queue, "put_nowait", side_effect=asyncio.QueueFull
+        ):
+            await client.post("/readthedocs", data=b"{}")
+        assert bot.recorder.dropped == 1
+
+    async def test_replay(self, aiohttp_client, tmpdir):
+        path = str(tmpdir.join("traffic.jsonl.gz"))
+        payload = {"build": {"success": True}, "slug": "sir-bot-a-lot"}
+
+        bot = SirBot(recorder=Recorder(path))
+        bot.load_plugin(RTDPlugin())
+        bot["plugins"]["readthedocs"].register_handler(
+            "sir-bot-a-lot", asynctest.CoroutineMock()
+        )
+        client = await aiohttp_client(bot)
+        for _ in range(3):
+            await client.post("/readthedocs", json=payload)
+        await bot.recorder.flush()
+
+        handler = asynctest.CoroutineMock()
+        replay_bot = SirBot()
+        replay_bot.load_plugin(RTDPlugin())
+        replay_bot["plugins"]["readthedocs"].register_handler("sir-bot-a-lot", handler)
+        report = await replay(replay_bot, path, speed=None)
+
+        assert report.count == 3
+        assert report.errors == 0
+        assert handler.call_count == 3
+        handler.assert_called_with(payload, replay_bot)
+
+    async def test_replay_rotated(self, aiohttp_client, tmpdir):
+        path = str(tmpdir.join("traffic.jsonl.gz"))
+
+        bot = SirBot(recorder=Recorder(path, max_bytes=1, backups=3))
+        bot.load_plugin(RTDPlugin())
+        bot["plugins"]["readthedocs"].register_handler(
+            "sir-bot-a-lot", asynctest.CoroutineMock()
+        )
+        client = await aiohttp_client(bot)
+        for i in range(3):
+            await client.post(
+                "/readthedocs",
+                json={"build": {"id": i, "success": True}, "slug": "sir-bot-a-lot"},
+            )
+            await bot.recorder.flush()
+
+        paths = _rotation_order(glob.glob(path + "*"))
+        assert paths == [path + ".3", path + ".2", path + ".1"]
+
+        handler = asynctest.CoroutineMock()
+        replay_bot = SirBot()
+        replay_bot.load_plugin(RTDPlugin())
+        replay_bot["plugins"]["readthedocs"].register_handler("sir-bot-a-lot", handler)
+        report = await replay(replay_bot, paths, speed=None, concurrency=1)
+
+        assert report.count == 3
+        assert [call[0][0]["build"]["id"] for call in handler.call_args_list] == [
+            0,
+            1,
+            2,
+        ]
+
+    async def test_replay_github_resign(self, aiohttp_client, tmpdir):
+        path = str(tmpdir.join("traffic.jsonl.gz"))
+        body = json.dumps({"action": "opened"}).encode("utf-8")
+        headers = {
+            "content-type": "application/json",
+            "X-GitHub-Event": "issues",
+            "X-GitHub-Delivery": "72d3162e-cc78-11e3-81ab-4c9367dc0958",
+            "X-Hub-Signature": "sha1="
+            + hmac.new(b"recordsecret", body, digestmod=hashlib.sha1).hexdigest(),
+        }
+
+        bot = SirBot(recorder=Recorder(path))
+        bot.load_plugin(GithubPlugin(verify="recordsecret"))
+        client = await aiohttp_client(bot)
+        r = await client.post("/github", data=body, headers=headers)
+        assert r.status == 200
+        await bot.recorder.flush()
+
+        replay_bot = SirBot()
+        replay_bot.load_plugin(GithubPlugin(verify="replaysecret"))
+        report = await replay(replay_bot, path, github_secret="replaysecret")
+        assert report.statuses == [200]